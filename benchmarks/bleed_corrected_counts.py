@@ -0,0 +1,80 @@
+"""
+Peak memory of building the bleed corrected dataset.
+
+Given fit spot rates, builds the corrected read counts and the cleaned
+SpatialExpressionDataset holding them, as a dense float matrix (the previous
+implementation) and with bleeding_correction.corrected_read_counts, reporting
+the peak memory allocated on top of the fit rates and the wall time.
+
+Usage:
+
+    python benchmarks/bleed_corrected_counts.py --n-spots 20000 --n-genes 2000
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from bayestme import bleeding_correction, data
+from bayestme.common import Layout
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-spots", type=int, default=20000)
+    parser.add_argument("--n-genes", type=int, default=2000)
+    parser.add_argument("--mean-count", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    # Sparse counts, as typical of high throughput spatial data
+    fit_rates = rng.poisson(args.mean_count, size=(args.n_spots, args.n_genes)) * (
+        1 + 0.1 * rng.random((args.n_spots, args.n_genes))
+    )
+    read_totals = np.round(fit_rates.sum(axis=0))
+    positions = np.stack(
+        [np.arange(args.n_spots) // 100, np.arange(args.n_spots) % 100], axis=1
+    )
+    tissue_mask = np.ones(args.n_spots, dtype=bool)
+    gene_names = np.array([str(i) for i in range(args.n_genes)])
+
+    def dense():
+        return np.round(
+            fit_rates / fit_rates.sum(axis=0, keepdims=True) * read_totals[None]
+        )
+
+    def chunked():
+        return bleeding_correction.corrected_read_counts(fit_rates, read_totals)
+
+    print(
+        "{} spots, {} genes, {:.1f} MB of fit rates".format(
+            args.n_spots, args.n_genes, fit_rates.nbytes / 2**20
+        )
+    )
+    print("{:>10} {:>14} {:>10}".format("counts", "peak mem (MB)", "time (s)"))
+    for name, corrected_read_counts in [("dense", dense), ("chunked", chunked)]:
+        tracemalloc.start()
+        start = time.time()
+        dataset = data.SpatialExpressionDataset.from_arrays(
+            raw_counts=corrected_read_counts(),
+            positions=positions,
+            tissue_mask=tissue_mask,
+            gene_names=gene_names,
+            layout=Layout.SQUARE,
+            edges=np.zeros((0, 2), dtype=int),
+        )
+        elapsed = time.time() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{:>10} {:>14.1f} {:>10.1f}".format(name, peak / 2**20, elapsed))
+        del dataset
+
+
+if __name__ == "__main__":
+    main()
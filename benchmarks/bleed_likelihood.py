@@ -0,0 +1,126 @@
+"""
+Per-iteration cost of the bleed correction multinomial likelihood.
+
+Times one loss evaluation plus backward pass of the fit_spot_rates loss, with
+the likelihood computed by one torch Multinomial per gene (the previous
+implementation) and by the batched bleeding_correction.multinomial_log_prob.
+
+Usage:
+
+    python benchmarks/bleed_likelihood.py --n-genes 1 10 50 200
+"""
+import argparse
+import timeit
+
+import numpy as np
+import torch
+from torch.distributions.multinomial import Multinomial
+
+from bayestme import bleeding_correction, synthetic_data
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-rows", type=int, default=30)
+    parser.add_argument("--n-cols", type=int, default=30)
+    parser.add_argument("--n-genes", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--repeats", type=int, default=20)
+    return parser
+
+
+def make_losses(reads, tissue_mask, weights):
+    t_Y = torch.Tensor(reads.T)
+    t_Weights = torch.Tensor(weights[:, tissue_mask])
+    n_rates = tissue_mask.sum()
+    n_genes = reads.shape[1]
+    totals = reads.sum(axis=0)
+    log_normalizer = bleeding_correction.multinomial_log_normalizer(t_Y)
+
+    def expected_rates(t_x):
+        t_x = torch.nn.functional.softplus(t_x)
+        t_Beta0 = t_x[:n_genes]
+        t_Rates = t_x[n_genes:].reshape(n_rates, n_genes)
+        Mu = (t_Weights @ t_Rates + t_Beta0[None]).clip(1e-10, None)
+        return Mu / Mu.sum(dim=0, keepdim=True)
+
+    def per_gene_loss(t_x):
+        Mu = expected_rates(t_x)
+        return -torch.stack(
+            [
+                Multinomial(
+                    total_count=int(totals[i]), probs=Mu[:, i], validate_args=False
+                ).log_prob(t_Y[i])
+                for i in range(n_genes)
+            ]
+        ).mean()
+
+    def batched_loss(t_x):
+        Mu = expected_rates(t_x)
+        return -bleeding_correction.multinomial_log_prob(
+            Mu.T, t_Y, log_normalizer
+        ).mean()
+
+    return per_gene_loss, batched_loss
+
+
+def time_loss(loss, x, repeats):
+    def step():
+        t_x = torch.tensor(x, requires_grad=True)
+        loss(t_x).backward()
+
+    step()
+    return min(timeit.repeat(step, number=1, repeat=repeats))
+
+
+def main():
+    args = get_parser().parse_args()
+    np.random.seed(0)
+
+    print(
+        "{:>8} {:>16} {:>16} {:>10}".format(
+            "genes", "per gene (ms)", "batched (ms)", "speedup"
+        )
+    )
+    for n_genes in args.n_genes:
+        (
+            locations,
+            tissue_mask,
+            true_rates,
+            true_counts,
+            bleed_counts,
+        ) = synthetic_data.generate_simulated_bleeding_reads_data(
+            n_rows=args.n_rows, n_cols=args.n_cols, n_genes=n_genes
+        )
+        basis_idxs = bleeding_correction.build_compact_basis_indices(
+            locations, tissue_mask
+        )
+        weights = bleeding_correction.weights_from_basis(
+            np.full(bleeding_correction.get_compact_basis_shape(basis_idxs), -3.0),
+            basis_idxs,
+            None,
+            tissue_mask,
+            local_weight=15,
+        )
+        x = np.concatenate(
+            [np.median(bleed_counts, axis=0), bleed_counts[tissue_mask].reshape(-1)]
+        ).astype(np.float32)
+
+        per_gene_loss, batched_loss = make_losses(bleed_counts, tissue_mask, weights)
+        torch.testing.assert_close(
+            per_gene_loss(torch.tensor(x)), batched_loss(torch.tensor(x))
+        )
+
+        per_gene_time = time_loss(per_gene_loss, x, args.repeats)
+        batched_time = time_loss(batched_loss, x, args.repeats)
+        print(
+            "{:>8} {:>16.2f} {:>16.2f} {:>9.1f}x".format(
+                n_genes,
+                per_gene_time * 1e3,
+                batched_time * 1e3,
+                per_gene_time / batched_time,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
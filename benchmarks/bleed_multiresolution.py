@@ -0,0 +1,94 @@
+"""
+Time and accuracy of coarse-to-fine bleed correction.
+
+Runs clean_bleed on simulated data at full resolution, and with the basis functions
+first fit on a downsampled grid for a range of coarse_factor values, reporting wall time
+and the correlation of the corrected reads with the true reads.
+
+Usage:
+
+    python benchmarks/bleed_multiresolution.py --n-rows 40 --n-cols 40 --factors 2 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+import bayestme.common
+from bayestme import bleeding_correction, data, synthetic_data, utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-rows", type=int, default=40)
+    parser.add_argument("--n-cols", type=int, default=40)
+    parser.add_argument("--n-genes", type=int, default=10)
+    parser.add_argument("--max-steps", type=int, default=5)
+    parser.add_argument("--fine-steps", type=int, default=1)
+    parser.add_argument("--factors", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    np.random.seed(args.seed)
+
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=args.n_rows, n_cols=args.n_cols, n_genes=args.n_genes
+    )
+    dataset = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array([str(i) for i in range(args.n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        edges=utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+
+    def correlation(corrected_reads):
+        corrected_reads = corrected_reads.toarray()
+        return np.mean(
+            [
+                np.corrcoef(
+                    corrected_reads[tissue_mask, g], true_counts[tissue_mask, g]
+                )[0, 1]
+                for g in range(args.n_genes)
+                if true_counts[tissue_mask, g].std() > 0
+            ]
+        )
+
+    print(
+        "{} spots, {} in tissue, {} genes".format(
+            locations.shape[0], tissue_mask.sum(), args.n_genes
+        )
+    )
+    print("{:>14} {:>10} {:>16}".format("coarse factor", "time (s)", "corr w/ truth"))
+
+    for coarse_factor in [None] + args.factors:
+        start = time.time()
+        _, result = bleeding_correction.clean_bleed(
+            dataset,
+            n_top=args.n_genes,
+            max_steps=args.max_steps,
+            coarse_factor=coarse_factor,
+            fine_steps=args.fine_steps,
+        )
+        elapsed = time.time() - start
+        print(
+            "{:>14} {:>10.1f} {:>16.4f}".format(
+                "full" if coarse_factor is None else coarse_factor,
+                elapsed,
+                correlation(result.corrected_reads),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+File size and load time of saved bleed correction results.
+
+Saves a BleedCorrectionResult for a simulated slide in the previous layout
+(dense corrected reads and weights), with weights, and without weights, and
+reports the file size, the time to read it back, and the time of the first
+access to the weights (recomputed from the basis functions when not stored).
+
+Usage:
+
+    python benchmarks/bleed_result_storage.py --n-rows 60 --n-cols 60 --n-genes 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from bayestme import bleeding_correction, data, synthetic_data
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-rows", type=int, default=60)
+    parser.add_argument("--n-cols", type=int, default=60)
+    parser.add_argument("--n-genes", type=int, default=2000)
+    parser.add_argument("--local-weight", type=float, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def save_dense(result, path):
+    with h5py.File(path, "w") as f:
+        f["corrected_reads"] = result.corrected_reads
+        f["global_rates"] = result.global_rates
+        f["basis_functions"] = result.basis_functions
+        f["weights"] = result.weights
+
+
+def main():
+    args = get_parser().parse_args()
+    np.random.seed(args.seed)
+
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=args.n_rows, n_cols=args.n_cols, n_genes=1
+    )
+    basis_length = bleeding_correction.get_compact_basis_shape(
+        bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+    )[1]
+    basis_functions = -np.linspace(0.5, 3, basis_length)[None].repeat(8, 0)
+    weights = bleeding_correction.rebuild_bleed_weights(
+        basis_functions, locations, tissue_mask, args.local_weight
+    )
+    result = data.BleedCorrectionResult(
+        # Sparse counts, as typical of high throughput spatial data
+        corrected_reads=np.random.poisson(
+            0.3, size=(locations.shape[0], args.n_genes)
+        ).astype(float),
+        global_rates=np.ones(args.n_genes),
+        basis_functions=basis_functions,
+        weights=weights,
+        local_weight=args.local_weight,
+        positions=locations,
+        tissue_mask=tissue_mask,
+    )
+
+    print(
+        "{} spots, {} genes, {:.1%} nonzero corrected reads".format(
+            locations.shape[0], args.n_genes, np.mean(result.corrected_reads > 0)
+        )
+    )
+    print(
+        "{:>16} {:>12} {:>10} {:>16}".format(
+            "layout", "size (MB)", "read (s)", "weights (s)"
+        )
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bleed.h5")
+        for name, save in [
+            ("dense", lambda: save_dense(result, path)),
+            ("with weights", lambda: result.save(path)),
+            ("without weights", lambda: result.save(path, store_weights=False)),
+        ]:
+            save()
+            start = time.time()
+            loaded = data.BleedCorrectionResult.read_h5(path)
+            read_time = time.time() - start
+            start = time.time()
+            loaded_weights = bleeding_correction.load_bleed_weights(loaded)
+            weights_time = time.time() - start
+            np.testing.assert_allclose(loaded_weights, weights)
+            print(
+                "{:>16} {:>12.1f} {:>10.2f} {:>16.2f}".format(
+                    name,
+                    os.path.getsize(path) / 2**20,
+                    read_time,
+                    weights_time,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Time and accuracy of reusing bleed basis functions across replicate slides.
+
+Fits bleed correction on one simulated slide, then corrects a second slide
+simulated with the same bleed model from scratch and by reusing the basis
+functions of the first slide with a range of refinement steps, reporting wall
+time and the correlation of the corrected reads with the true reads.
+
+Usage:
+
+    python benchmarks/bleed_reuse_basis.py --n-rows 30 --n-cols 30 --refine-steps 0 1
+"""
+import argparse
+import time
+
+import numpy as np
+
+import bayestme.common
+from bayestme import bleeding_correction, data, synthetic_data, utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-rows", type=int, default=30)
+    parser.add_argument("--n-cols", type=int, default=30)
+    parser.add_argument("--n-genes", type=int, default=10)
+    parser.add_argument("--max-steps", type=int, default=5)
+    parser.add_argument("--refine-steps", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def simulate_slide(args):
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=args.n_rows, n_cols=args.n_cols, n_genes=args.n_genes
+    )
+    dataset = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array([str(i) for i in range(args.n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        edges=utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    return dataset, true_counts
+
+
+def main():
+    args = get_parser().parse_args()
+    np.random.seed(args.seed)
+
+    reference_dataset, _ = simulate_slide(args)
+    dataset, true_counts = simulate_slide(args)
+    tissue_mask = dataset.tissue_mask
+
+    def correlation(corrected_reads):
+        corrected_reads = corrected_reads.toarray()
+        return np.mean(
+            [
+                np.corrcoef(
+                    corrected_reads[tissue_mask, g], true_counts[tissue_mask, g]
+                )[0, 1]
+                for g in range(args.n_genes)
+                if true_counts[tissue_mask, g].std() > 0
+            ]
+        )
+
+    _, reference_result = bleeding_correction.clean_bleed(
+        reference_dataset, n_top=args.n_genes, max_steps=args.max_steps
+    )
+
+    print(
+        "{} spots, {} in tissue, {} genes".format(
+            dataset.n_spot, tissue_mask.sum(), args.n_genes
+        )
+    )
+    print("{:>16} {:>10} {:>16}".format("basis functions", "time (s)", "corr w/ truth"))
+
+    start = time.time()
+    _, result = bleeding_correction.clean_bleed(
+        dataset, n_top=args.n_genes, max_steps=args.max_steps
+    )
+    print(
+        "{:>16} {:>10.1f} {:>16.4f}".format(
+            "from scratch", time.time() - start, correlation(result.corrected_reads)
+        )
+    )
+
+    for refine_steps in args.refine_steps:
+        start = time.time()
+        _, result = bleeding_correction.clean_bleed(
+            dataset,
+            n_top=args.n_genes,
+            basis_functions=reference_result.basis_functions,
+            refine_steps=refine_steps,
+        )
+        print(
+            "{:>16} {:>10.1f} {:>16.4f}".format(
+                "reused, {} steps".format(refine_steps),
+                time.time() - start,
+                correlation(result.corrected_reads),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
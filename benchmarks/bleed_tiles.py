@@ -0,0 +1,148 @@
+"""
+Memory, time and accuracy of tiled bleed correction.
+
+Fits the spot rates of simulated data with fixed basis functions for the whole
+slide at once, with bleeding between all pairs of spots and truncated at
+max_bleed_distance, and tile by tile for a range of tile sizes, reporting the peak
+memory of building and applying the bleed model, the wall time and the difference
+from the whole slide truncated rates.
+
+Usage:
+
+    python benchmarks/bleed_tiles.py --n-rows 80 --n-cols 80 --tile-sizes 10 20 40
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from bayestme import bleeding_correction, synthetic_data
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-rows", type=int, default=80)
+    parser.add_argument("--n-cols", type=int, default=80)
+    parser.add_argument("--n-genes", type=int, default=20)
+    parser.add_argument("--max-bleed-distance", type=float, default=3)
+    parser.add_argument("--local-weight", type=float, default=15)
+    parser.add_argument("--tile-sizes", type=int, nargs="+", default=[10, 20, 40])
+    parser.add_argument("--n-workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def measure(fit):
+    tracemalloc.start()
+    start = time.time()
+    result = fit()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    args = get_parser().parse_args()
+    np.random.seed(args.seed)
+
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=args.n_rows, n_cols=args.n_cols, n_genes=args.n_genes
+    )
+    basis_length = bleeding_correction.build_truncated_basis_indices(
+        locations, tissue_mask, args.max_bleed_distance
+    ).basis_length
+    basis_functions = -np.linspace(0.5, 3, basis_length)[None].repeat(8, 0)
+
+    def fit_all_pairs():
+        basis_idxs = bleeding_correction.build_compact_basis_indices(
+            locations, tissue_mask
+        )
+        weights = bleeding_correction.weights_from_basis(
+            bleeding_correction.resize_basis_functions(
+                basis_functions,
+                bleeding_correction.get_compact_basis_shape(basis_idxs)[1],
+            ),
+            basis_idxs,
+            None,
+            tissue_mask,
+            args.local_weight,
+        )
+        return bleeding_correction.fit_spot_rates_em(
+            bleed_counts, tissue_mask, weights
+        )[1]
+
+    def fit_whole_slide():
+        basis_idxs = bleeding_correction.build_truncated_basis_indices(
+            locations, tissue_mask, args.max_bleed_distance
+        )
+        weights = bleeding_correction.weights_from_basis(
+            basis_functions, basis_idxs, None, tissue_mask, args.local_weight
+        )
+        return bleeding_correction.fit_spot_rates_em(
+            bleed_counts, tissue_mask, weights
+        )[1]
+
+    print(
+        "{} spots, {} in tissue, {} genes".format(
+            locations.shape[0], tissue_mask.sum(), args.n_genes
+        )
+    )
+    print(
+        "{:>10} {:>8} {:>14} {:>10} {:>14}".format(
+            "tile size", "tiles", "peak mem (MB)", "time (s)", "rate rel err"
+        )
+    )
+
+    _, elapsed, peak = measure(fit_all_pairs)
+    print(
+        "{:>10} {:>8} {:>14.1f} {:>10.1f} {:>14}".format(
+            "all pairs", 1, peak / 2**20, elapsed, "-"
+        )
+    )
+
+    rates, elapsed, peak = measure(fit_whole_slide)
+    print(
+        "{:>10} {:>8} {:>14.1f} {:>10.1f} {:>14}".format(
+            "whole", 1, peak / 2**20, elapsed, "-"
+        )
+    )
+
+    for tile_size in args.tile_sizes:
+        n_tiles = len(
+            bleeding_correction.tile_spots(
+                locations, tile_size, 2 * args.max_bleed_distance
+            )
+        )
+        (_, tiled_rates, _), elapsed, peak = measure(
+            lambda: bleeding_correction.fit_spot_rates_tiled(
+                bleed_counts,
+                locations,
+                tissue_mask,
+                basis_functions,
+                args.max_bleed_distance,
+                args.local_weight,
+                tile_size,
+                n_workers=args.n_workers,
+            )
+        )
+        print(
+            "{:>10} {:>8} {:>14.1f} {:>10.1f} {:>14.2e}".format(
+                tile_size,
+                n_tiles,
+                peak / 2**20,
+                elapsed,
+                np.abs(tiled_rates - rates).sum() / np.abs(rates).sum(),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Accuracy vs. radius report for distance truncated bleed correction.
+
+Runs bleed correction on simulated data with the exact (all pairs) bleed model
+and with the bleed model truncated at a range of max_bleed_distance values, and
+reports how far the truncated results are from the exact ones.
+
+Usage:
+
+    python benchmarks/bleed_truncation_accuracy.py --n-rows 30 --n-cols 30
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bayestme import bleeding_correction, synthetic_data
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-rows", type=int, default=30)
+    parser.add_argument("--n-cols", type=int, default=30)
+    parser.add_argument("--n-genes", type=int, default=5)
+    parser.add_argument("--max-steps", type=int, default=3)
+    parser.add_argument("--local-weight", type=float, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--radii", type=float, nargs="+", default=[1.5, 2, 3, 5, 8, 12, 20]
+    )
+    return parser
+
+
+def correct(reads, locations, tissue_mask, basis_idxs, args):
+    start = time.time()
+    (
+        global_rates,
+        rates,
+        basis_functions,
+        weights,
+        _,
+        _,
+    ) = bleeding_correction.decontaminate_spots(
+        reads,
+        tissue_mask,
+        basis_idxs,
+        None,
+        n_top=reads.shape[1],
+        max_steps=args.max_steps,
+        local_weight=args.local_weight,
+    )
+    return rates, basis_functions, time.time() - start
+
+
+def main():
+    args = get_parser().parse_args()
+    np.random.seed(args.seed)
+
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=args.n_rows, n_cols=args.n_cols, n_genes=args.n_genes
+    )
+
+    compact_idxs = bleeding_correction.build_compact_basis_indices(
+        locations, tissue_mask
+    )
+    exact_rates, exact_basis, exact_time = correct(
+        bleed_counts, locations, tissue_mask, compact_idxs, args
+    )
+    exact_weights = bleeding_correction.weights_from_basis(
+        exact_basis, compact_idxs, None, tissue_mask, args.local_weight
+    )
+    distances = np.linalg.norm(locations[:, None] - locations[None], axis=-1)
+
+    def rate_error(rates):
+        return np.abs(rates - exact_rates).sum() / np.abs(exact_rates).sum()
+
+    def true_correlation(rates):
+        return np.corrcoef(rates[tissue_mask].ravel(), true_rates[tissue_mask].ravel())[
+            0, 1
+        ]
+
+    print(
+        "{} spots, {} in tissue, {} genes".format(
+            locations.shape[0], tissue_mask.sum(), args.n_genes
+        )
+    )
+    print(
+        "{:>8} {:>10} {:>14} {:>14} {:>14} {:>10}".format(
+            "radius",
+            "pairs",
+            "mass outside",
+            "rate rel err",
+            "corr w/ truth",
+            "time (s)",
+        )
+    )
+    print(
+        "{:>8} {:>10} {:>14} {:>14} {:>14.4f} {:>10.1f}".format(
+            "exact",
+            locations.shape[0] ** 2,
+            "-",
+            "-",
+            true_correlation(exact_rates),
+            exact_time,
+        )
+    )
+
+    for radius in args.radii:
+        truncated_idxs = bleeding_correction.build_truncated_basis_indices(
+            locations, tissue_mask, radius
+        )
+        rates, _, elapsed = correct(
+            bleed_counts, locations, tissue_mask, truncated_idxs, args
+        )
+        # Share of the exact model's bleed mass which the truncation drops
+        mass_outside = exact_weights[distances > radius].sum() / locations.shape[0]
+        print(
+            "{:>8} {:>10} {:>14.2e} {:>14.2e} {:>14.4f} {:>10.1f}".format(
+                radius,
+                truncated_idxs.n_pairs,
+                mass_outside,
+                rate_error(rates),
+                true_correlation(rates),
+                elapsed,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Memory and time of computing the bleed vectors of plot_bleed_vectors.
+
+Compares the previous computation, which formed N x N x 2 arrays of
+directions weighted by contributions, with bleeding_correction.bleed_vectors,
+which uses two products with the bleed weights, for one gene on square grids
+of increasing size.
+
+Usage:
+
+    python benchmarks/bleed_vectors.py --sizes 30 50 70
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from bayestme import bleeding_correction
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 50, 70])
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def pairwise_bleed_vectors(locations, rates, weights):
+    contributions = rates[None] * weights
+    directions = locations[None] - locations[:, None]
+    vectors = (directions * contributions[..., None]).mean(axis=1)
+    return vectors / np.abs(vectors).max(axis=0, keepdims=True)
+
+
+def measure(compute):
+    tracemalloc.start()
+    start = time.time()
+    result = compute()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(
+        "{:>8} {:>16} {:>12} {:>16} {:>12}".format(
+            "spots", "pairwise (MB)", "pairwise (s)", "products (MB)", "products (s)"
+        )
+    )
+    for size in args.sizes:
+        locations = (
+            np.stack(np.meshgrid(np.arange(size), np.arange(size)), axis=-1)
+            .reshape(-1, 2)
+            .astype(float)
+        )
+        n_spots = locations.shape[0]
+        rates = rng.random(n_spots)
+        weights = rng.random((n_spots, n_spots))
+        weights /= weights.sum(axis=0, keepdims=True)
+
+        expected, pairwise_time, pairwise_peak = measure(
+            lambda: pairwise_bleed_vectors(locations, rates, weights)
+        )
+        vectors, products_time, products_peak = measure(
+            lambda: bleeding_correction.bleed_vectors(locations, rates, weights)
+        )
+        np.testing.assert_allclose(vectors, expected, rtol=1e-6, atol=1e-9)
+        print(
+            "{:>8} {:>16.1f} {:>12.3f} {:>16.3f} {:>12.3f}".format(
+                n_spots,
+                pairwise_peak / 2**20,
+                pairwise_time,
+                products_peak / 2**20,
+                products_time,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+SVI step time of the plain and the JIT compiled ELBO.
+
+Runs SVI steps of BayesTME_VI with Trace_ELBO and with JitTrace_ELBO, as
+selected by BayesTME_VI.deconvolution(jit=...), on random square grid datasets
+of increasing size. The first steps, which include tracing the model and guide
+and the JIT's own profiling runs, are timed separately from the rest.
+
+Usage:
+
+    python benchmarks/svi_jit.py --sizes 16 64 --n-genes 100 2000 --n-steps 200
+"""
+import argparse
+import time
+
+import numpy as np
+import pyro
+from pyro.infer import SVI, JitTrace_ELBO, Trace_ELBO
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[16, 64], help="Grid side lengths"
+    )
+    parser.add_argument(
+        "--n-genes",
+        type=int,
+        nargs="+",
+        default=[100, 2000],
+        help="Number of genes of each grid size",
+    )
+    parser.add_argument("--n-components", type=int, default=10)
+    parser.add_argument("--n-steps", type=int, default=200)
+    parser.add_argument("--n-warmup-steps", type=int, default=5)
+    parser.add_argument("--spot-batch-size", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def make_dataset(size, n_genes, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    return data.SpatialExpressionDataset.from_arrays(
+        raw_counts=rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes))),
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+
+
+def time_steps(dataset, args, loss):
+    pyro.clear_param_store()
+    pyro.set_rng_seed(args.seed)
+    vi = BayesTME_VI(stdata=dataset)
+    vi.n_celltypes = args.n_components
+    svi = SVI(vi.model, vi.spatial_guide, vi.optimizer, loss=loss)
+    kwargs = dict(
+        n_class=vi.n_celltypes,
+        n_genes=vi.n_genes,
+        spot_batch_size=args.spot_batch_size,
+    )
+
+    start = time.time()
+    for _ in range(args.n_warmup_steps):
+        svi.step(vi.counts, **kwargs)
+    warmup_time = time.time() - start
+
+    start = time.time()
+    for _ in range(args.n_steps):
+        svi.step(vi.counts, **kwargs)
+    return warmup_time, (time.time() - start) / args.n_steps
+
+
+def main():
+    args = get_parser().parse_args()
+    print(
+        "{:>8} {:>8} {:>8} {:>12} {:>12} {:>12} {:>9}".format(
+            "spots",
+            "genes",
+            "mode",
+            "warmup (s)",
+            "s/step",
+            "steps/s",
+            "speedup",
+        )
+    )
+    for size, n_genes in zip(args.sizes, args.n_genes):
+        dataset = make_dataset(size, n_genes, np.random.default_rng(args.seed))
+        plain_step_time = None
+        for mode, loss in [
+            ("plain", Trace_ELBO()),
+            ("jit", JitTrace_ELBO(ignore_jit_warnings=True)),
+        ]:
+            warmup_time, step_time = time_steps(dataset, args, loss)
+            plain_step_time = plain_step_time or step_time
+            print(
+                "{:>8} {:>8} {:>8} {:>12.2f} {:>12.4f} {:>12.1f} {:>8.2f}x".format(
+                    dataset.n_spot_in,
+                    n_genes,
+                    mode,
+                    warmup_time,
+                    step_time,
+                    1 / step_time,
+                    plain_step_time / step_time,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
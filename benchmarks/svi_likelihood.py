@@ -0,0 +1,112 @@
+"""
+SVI throughput of the Poisson likelihoods of the deconvolution model.
+
+Runs a fixed number of SVI steps of BayesTME_VI on a random square grid
+dataset with each PoissonLikelihood, reporting steps per second, the memory
+of the counts held by the model and the log joint of a shared guide sample
+under each likelihood. --density sets the fraction of nonzero counts.
+
+Usage:
+
+    python benchmarks/svi_likelihood.py --size 64 --n-genes 1000 --n-steps 100 \
+        --density 0.1
+"""
+import argparse
+import time
+
+import numpy as np
+import pyro
+from pyro import poutine
+from pyro.infer import SVI, Trace_ELBO
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI, PoissonLikelihood
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--n-genes", type=int, default=1000)
+    parser.add_argument("--n-components", type=int, default=10)
+    parser.add_argument("--n-steps", type=int, default=100)
+    parser.add_argument("--density", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def make_dataset(size, n_genes, density, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    counts = rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes)))
+    counts[rng.random(counts.shape) > density] = 0
+    return data.SpatialExpressionDataset.from_arrays(
+        raw_counts=counts,
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+
+
+def counts_nbytes(counts):
+    if counts.is_sparse:
+        return counts_nbytes(counts.indices()) + counts_nbytes(counts.values())
+    return counts.element_size() * counts.nelement()
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+    dataset = make_dataset(args.size, args.n_genes, args.density, rng)
+    print(
+        "{} spots x {} genes, {} components, {:.1%} nonzero".format(
+            dataset.n_spot_in,
+            dataset.n_gene,
+            args.n_components,
+            np.count_nonzero(dataset.counts) / dataset.counts.size,
+        )
+    )
+
+    print(
+        "{:>14} {:>10} {:>12} {:>18}".format(
+            "likelihood", "steps/s", "counts (MB)", "log joint"
+        )
+    )
+    for likelihood in PoissonLikelihood:
+        pyro.clear_param_store()
+        pyro.set_rng_seed(args.seed)
+        vi = BayesTME_VI(stdata=dataset, likelihood=likelihood)
+        vi.n_celltypes = args.n_components
+        model_args = (vi.counts, vi.n_celltypes, vi.n_genes)
+
+        guide_trace = poutine.trace(vi.guide).get_trace(*model_args)
+        log_joint = (
+            poutine.trace(poutine.replay(vi.model, guide_trace))
+            .get_trace(*model_args)
+            .log_prob_sum()
+            .item()
+        )
+
+        svi = SVI(vi.model, vi.guide, vi.optimizer, loss=Trace_ELBO())
+        svi.step(*model_args)
+        start = time.time()
+        for _ in range(args.n_steps):
+            svi.step(*model_args)
+        elapsed = time.time() - start
+        print(
+            "{:>14} {:>10.1f} {:>12.1f} {:>18.1f}".format(
+                str(likelihood),
+                args.n_steps / elapsed,
+                counts_nbytes(vi.counts) / 1e6,
+                log_joint,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+SVI step time and peak memory of minibatch deconvolution.
+
+Runs a fixed number of SVI steps of BayesTME_VI with the spatial guide on a
+random square grid dataset, once on the full slide and once for every
+requested spot batch size, each in a fresh process so that the reported peak
+resident memory belongs to that configuration alone.
+
+Usage:
+
+    python benchmarks/svi_minibatch.py --size 100 --n-genes 2000 \
+        --spot-batch-sizes 2000 500 --likelihood SPARSE
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import pyro
+from pyro.infer import SVI, Trace_ELBO
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI, PoissonLikelihood
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--n-genes", type=int, default=2000)
+    parser.add_argument("--n-components", type=int, default=10)
+    parser.add_argument("--n-steps", type=int, default=20)
+    parser.add_argument("--density", type=float, default=0.1)
+    parser.add_argument("--spot-batch-sizes", type=int, nargs="+", default=[2000, 500])
+    parser.add_argument("--gene-batch-size", type=int, default=None)
+    parser.add_argument(
+        "--likelihood",
+        type=PoissonLikelihood,
+        choices=list(PoissonLikelihood),
+        default=PoissonLikelihood.FACTOR,
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def make_dataset(size, n_genes, density, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    counts = rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes)))
+    counts[rng.random(counts.shape) > density] = 0
+    return data.SpatialExpressionDataset.from_arrays(
+        raw_counts=counts,
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+
+
+def run(args, spot_batch_size, results):
+    rng = np.random.default_rng(args.seed)
+    dataset = make_dataset(args.size, args.n_genes, args.density, rng)
+    pyro.set_rng_seed(args.seed)
+    vi = BayesTME_VI(stdata=dataset, likelihood=args.likelihood)
+    vi.n_celltypes = args.n_components
+    batch_sizes = {
+        "spot_batch_size": spot_batch_size,
+        "gene_batch_size": args.gene_batch_size,
+    }
+
+    svi = SVI(vi.model, vi.spatial_guide, vi.optimizer, loss=Trace_ELBO())
+    svi.step(vi.counts, vi.n_celltypes, vi.n_genes, **batch_sizes)
+    start = time.time()
+    for _ in range(args.n_steps):
+        svi.step(vi.counts, vi.n_celltypes, vi.n_genes, **batch_sizes)
+    elapsed = time.time() - start
+    results.put(
+        (elapsed / args.n_steps, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    )
+
+
+def main():
+    args = get_parser().parse_args()
+    print(
+        "{} spots x {} genes, {} components, {} likelihood".format(
+            args.size**2, args.n_genes, args.n_components, args.likelihood
+        )
+    )
+    print("{:>12} {:>12} {:>14}".format("spot batch", "s/step", "peak RSS (MB)"))
+
+    context = multiprocessing.get_context("spawn")
+    for spot_batch_size in [None] + args.spot_batch_sizes:
+        results = context.Queue()
+        process = context.Process(target=run, args=(args, spot_batch_size, results))
+        process.start()
+        step_time, peak_kb = results.get()
+        process.join()
+        print(
+            "{:>12} {:>12.3f} {:>14.1f}".format(
+                "all" if spot_batch_size is None else spot_batch_size,
+                step_time,
+                peak_kb / 1e3,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
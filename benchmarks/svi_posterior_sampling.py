@@ -0,0 +1,120 @@
+"""
+Time to draw posterior samples from a fitted BayesTME_VI.
+
+Compares the previous sampling loop, which traced the guide and replayed the
+full model (likelihood included) once per sample, with drawing all samples at
+once from BayesTME_VI.variational_distributions, on a random square grid
+dataset after a few SVI steps.
+
+Usage:
+
+    python benchmarks/svi_posterior_sampling.py --size 64 --n-genes 1000 \
+        --n-traces 1000
+"""
+import argparse
+import time
+from collections import defaultdict
+
+import numpy as np
+import pyro
+import torch
+from pyro import poutine
+from pyro.infer import SVI, Trace_ELBO
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--n-genes", type=int, default=1000)
+    parser.add_argument("--n-components", type=int, default=10)
+    parser.add_argument("--n-traces", type=int, default=1000)
+    parser.add_argument(
+        "--n-loop-traces",
+        type=int,
+        default=100,
+        help="Samples drawn with the per-sample loop, whose time is extrapolated "
+        "to --n-traces",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def make_dataset(size, n_genes, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    return data.SpatialExpressionDataset.from_arrays(
+        raw_counts=rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes))),
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+
+
+def loop_samples(vi, n_traces):
+    result = defaultdict(list)
+    for _ in range(n_traces):
+        guide_trace = poutine.trace(vi.spatial_guide).get_trace(
+            vi.counts, vi.n_celltypes, vi.n_genes
+        )
+        model_trace = poutine.trace(poutine.replay(vi.model, guide_trace)).get_trace(
+            vi.counts, vi.n_celltypes, vi.n_genes
+        )
+        for name, site in model_trace.nodes.items():
+            if site["type"] == "sample" and not site["is_observed"]:
+                result[name].append(site["value"].detach().numpy())
+    return {name: np.stack(values) for name, values in result.items()}
+
+
+def vectorized_samples(vi, n_traces):
+    with torch.no_grad():
+        return {
+            name: distribution.sample((n_traces,)).numpy()
+            for name, distribution in vi.variational_distributions().items()
+        }
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+    dataset = make_dataset(args.size, args.n_genes, rng)
+    pyro.set_rng_seed(args.seed)
+    vi = BayesTME_VI(stdata=dataset)
+    vi.n_celltypes = args.n_components
+    svi = SVI(vi.model, vi.spatial_guide, vi.optimizer, loss=Trace_ELBO())
+    for _ in range(5):
+        svi.step(vi.counts, vi.n_celltypes, vi.n_genes)
+
+    start = time.time()
+    loop = loop_samples(vi, args.n_loop_traces)
+    loop_time = (time.time() - start) * args.n_traces / args.n_loop_traces
+
+    start = time.time()
+    vectorized = vectorized_samples(vi, args.n_traces)
+    vectorized_time = time.time() - start
+
+    print(
+        "{} spots x {} genes, {} components, {} traces".format(
+            dataset.n_spot_in, dataset.n_gene, args.n_components, args.n_traces
+        )
+    )
+    print("per-sample loop: {:.1f} s (extrapolated)".format(loop_time))
+    print("vectorized:      {:.1f} s".format(vectorized_time))
+    for name in vectorized:
+        print(
+            "{:>16} loop mean {:.4f} vectorized mean {:.4f}".format(
+                name, loop[name].mean(), vectorized[name].mean()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Memory and time of full posterior traces versus summary-only sampling.
+
+Runs BayesTME_VI.deconvolution for a few SVI steps on a random square grid
+dataset, returning posterior samples either as full traces
+(DeconvolutionResult) or as streaming summaries (DeconvolutionSummary with
+summary_only), each in a fresh process. Reports the time of the call, the size
+of the result and how much the peak resident memory grew during the call.
+
+Usage:
+
+    python benchmarks/svi_posterior_summaries.py --size 64 --n-genes 2000 \
+        --n-samples 100 1000
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+import pyro
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--n-genes", type=int, default=2000)
+    parser.add_argument("--n-components", type=int, default=10)
+    parser.add_argument("--n-samples", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--n-steps", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def make_dataset(size, n_genes, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    return data.SpatialExpressionDataset.from_arrays(
+        raw_counts=rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes))),
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+
+
+def peak_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+
+def result_nbytes(result):
+    return sum(
+        value.nbytes for value in vars(result).values() if isinstance(value, np.ndarray)
+    )
+
+
+def run(args, n_samples, summary_only, results):
+    rng = np.random.default_rng(args.seed)
+    pyro.set_rng_seed(args.seed)
+    vi = BayesTME_VI(stdata=make_dataset(args.size, args.n_genes, rng))
+
+    baseline_kb = peak_rss_kb()
+    start = time.time()
+    result = vi.deconvolution(
+        K=args.n_components,
+        n_iter=args.n_steps,
+        n_traces=n_samples,
+        summary_only=summary_only,
+    )
+    elapsed = time.time() - start
+    results.put((elapsed, result_nbytes(result), peak_rss_kb() - baseline_kb))
+
+
+def main():
+    args = get_parser().parse_args()
+    print(
+        "{} spots x {} genes, {} components".format(
+            args.size**2, args.n_genes, args.n_components
+        )
+    )
+    print(
+        "{:>10} {:>10} {:>10} {:>14} {:>16}".format(
+            "samples", "mode", "time (s)", "result (MB)", "added RSS (MB)"
+        )
+    )
+    context = multiprocessing.get_context("spawn")
+    for n_samples in args.n_samples:
+        for summary_only in (False, True):
+            results = context.Queue()
+            process = context.Process(
+                target=run, args=(args, n_samples, summary_only, results)
+            )
+            process.start()
+            elapsed, nbytes, added_kb = results.get()
+            process.join()
+            print(
+                "{:>10} {:>10} {:>10.1f} {:>14.1f} {:>16.1f}".format(
+                    n_samples,
+                    "summary" if summary_only else "traces",
+                    elapsed,
+                    nbytes / 1e6,
+                    added_kb / 1e3,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
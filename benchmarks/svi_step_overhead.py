@@ -0,0 +1,175 @@
+"""
+Per-step cost of the step invariant tensors of the SVI model and guide.
+
+For random square grid datasets, with and without an expression truth prior,
+times building the prior hyperparameters, the expression truth concentration,
+the guide's initial param values and the directed edge index from scratch, as
+the model and guide did on every step, against reading the copies cached on
+BayesTME_VI. For scale, also times full SVI steps with the plain Trace_ELBO.
+
+Usage:
+
+    python benchmarks/svi_step_overhead.py --sizes 10 32 100 \
+        --n-genes 50 200 2000 --n-steps 100
+"""
+import argparse
+import time
+
+import numpy as np
+import pyro
+import torch
+from pyro.infer import SVI, Trace_ELBO
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 32, 100],
+        help="Grid side lengths",
+    )
+    parser.add_argument(
+        "--n-genes",
+        type=int,
+        nargs="+",
+        default=[50, 200, 2000],
+        help="Number of genes of each grid size",
+    )
+    parser.add_argument("--n-components", type=int, default=5)
+    parser.add_argument("--n-steps", type=int, default=100)
+    parser.add_argument("--n-constant-builds", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def make_dataset(size, n_genes, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    return data.SpatialExpressionDataset.from_arrays(
+        raw_counts=rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes))),
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+
+
+def rebuilt_constants(vi, edges):
+    # What the model and guide built on every step before they were cached
+    constants = [
+        torch.tensor(100.0),
+        torch.tensor(1.0),
+        torch.ones(vi.n_genes),
+        torch.ones(vi.n_celltypes),
+        torch.tensor(10.0),
+        torch.tensor(1.0),
+        torch.ones(vi.n_celltypes) * 100.0,
+        torch.tensor(1.0),
+        torch.ones(vi.n_celltypes, vi.n_genes),
+        torch.ones(vi.N, vi.n_celltypes),
+        torch.ones(vi.N) * 20,
+        torch.tensor(1.0),
+    ]
+    if vi.expression_truth is not None:
+        exp_truth_weighted = (
+            vi.expression_truth * vi.expression_truth_weight * vi.n_genes
+        )
+        for _ in range(vi.expression_truth_n_dummy_cell_types):
+            exp_truth_weighted = np.concatenate(
+                [exp_truth_weighted, np.ones(vi.n_genes)[None, :]]
+            )
+        constants.append(torch.tensor(exp_truth_weighted))
+    edges = torch.as_tensor(edges, dtype=torch.long)
+    constants.append(torch.cat([edges[:, 0], edges[:, 1]]))
+    constants.append(torch.cat([edges[:, 1], edges[:, 0]]))
+    return constants
+
+
+def cached_constants(vi):
+    return [
+        vi.exp_load_prior,
+        vi.exp_profile_concentration,
+        vi.cell_prob_concentration,
+        vi.cell_num_prior,
+        vi.expression_truth_concentration,
+        vi.edge_sources,
+        vi.edge_targets,
+    ]
+
+
+def time_calls(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n
+
+
+def time_vi(dataset, args, expression_truth):
+    pyro.clear_param_store()
+    pyro.set_rng_seed(args.seed)
+    vi = BayesTME_VI(stdata=dataset, expression_truth=expression_truth)
+    if expression_truth is not None:
+        vi.n_celltypes = (
+            expression_truth.shape[0] + vi.expression_truth_n_dummy_cell_types
+        )
+    else:
+        vi.n_celltypes = args.n_components
+
+    edges = vi.edges.numpy()
+    rebuilt_time = time_calls(
+        lambda: rebuilt_constants(vi, edges), args.n_constant_builds
+    )
+    cached_time = time_calls(lambda: cached_constants(vi), args.n_constant_builds)
+
+    svi = SVI(vi.model, vi.spatial_guide, vi.optimizer, loss=Trace_ELBO())
+    kwargs = dict(n_class=vi.n_celltypes, n_genes=vi.n_genes)
+    svi.step(vi.counts, **kwargs)
+    step_time = time_calls(lambda: svi.step(vi.counts, **kwargs), args.n_steps)
+    return rebuilt_time, cached_time, step_time
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+    print(
+        "{:>8} {:>8} {:>16} {:>14} {:>13} {:>10}".format(
+            "spots",
+            "genes",
+            "expression truth",
+            "rebuilt (us)",
+            "cached (us)",
+            "ms/step",
+        )
+    )
+    for size, n_genes in zip(args.sizes, args.n_genes):
+        dataset = make_dataset(size, n_genes, rng)
+        expression_truth = rng.gamma(1.0, 1.0, (args.n_components, n_genes))
+        expression_truth /= expression_truth.sum(axis=1, keepdims=True)
+        for with_truth in [False, True]:
+            rebuilt_time, cached_time, step_time = time_vi(
+                dataset, args, expression_truth if with_truth else None
+            )
+            print(
+                "{:>8} {:>8} {:>16} {:>14.1f} {:>13.1f} {:>10.2f}".format(
+                    dataset.n_spot_in,
+                    n_genes,
+                    "yes" if with_truth else "no",
+                    rebuilt_time * 1e6,
+                    cached_time * 1e6,
+                    step_time * 1e3,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
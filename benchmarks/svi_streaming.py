@@ -0,0 +1,151 @@
+"""
+SVI step time and peak memory of streaming counts from a backed h5ad file.
+
+Writes a random square grid dataset with sparse counts to a temporary h5ad
+file, then runs a fixed number of minibatch SVI steps in a fresh process for
+each mode, reporting how much the peak resident memory grew over the imports:
+
+    memory      read the whole file and subsample spots with spot_batch_size
+    streamed    read the file backed and stream batches with SpotBatchLoader
+    no prefetch like streamed, but read each batch in the training loop
+
+Usage:
+
+    python benchmarks/svi_streaming.py --size 100 --n-genes 2000 --batch-size 1000
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pyro
+from pyro.infer import SVI, Trace_ELBO
+from scipy.sparse import csr_matrix
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI
+from bayestme.svi.loader import SpotBatchLoader, counts_to_tensor
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--n-genes", type=int, default=2000)
+    parser.add_argument("--n-components", type=int, default=10)
+    parser.add_argument("--n-steps", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--density", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def write_dataset(path, size, n_genes, density, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    counts = rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes)))
+    counts[rng.random(counts.shape) > density] = 0
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=counts,
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+    stdata.adata.X = csr_matrix(stdata.adata.X)
+    stdata.save(path)
+
+
+def peak_rss_kb():
+    # ru_maxrss survives exec on Linux, so a spawned process would report the
+    # peak of its parent; VmHWM belongs to this process only.
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+
+def run(args, path, mode, results):
+    baseline_kb = peak_rss_kb()
+    pyro.set_rng_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    if mode == "memory":
+        stdata = data.SpatialExpressionDataset.read_h5(path)
+        vi = BayesTME_VI(stdata=stdata)
+    else:
+        stdata = data.SpatialExpressionDataset.read_h5(path, backed=True)
+        loader = SpotBatchLoader(stdata, batch_size=args.batch_size, rng=rng)
+        vi = BayesTME_VI(stdata=stdata, loader=loader)
+        batches = loader.batches()
+    vi.n_celltypes = args.n_components
+    svi = SVI(vi.model, vi.spatial_guide, vi.optimizer, loss=Trace_ELBO())
+
+    def step():
+        if mode == "memory":
+            counts, spot_idxs = vi.counts, None
+            spot_batch_size = args.batch_size
+        elif mode == "streamed":
+            spot_idxs, counts = next(batches)
+            spot_batch_size = None
+        else:
+            start = rng.integers(len(loader.chunks))
+            spot_idxs = loader.chunks[start]
+            counts = counts_to_tensor(loader.read_chunk(spot_idxs))
+            spot_batch_size = None
+        svi.step(
+            counts,
+            vi.n_celltypes,
+            vi.n_genes,
+            spot_batch_size=spot_batch_size,
+            spot_idxs=spot_idxs,
+        )
+
+    step()
+    start = time.time()
+    for _ in range(args.n_steps):
+        step()
+    elapsed = time.time() - start
+    if mode != "memory":
+        batches.close()
+    results.put((elapsed / args.n_steps, peak_rss_kb() - baseline_kb))
+
+
+def main():
+    args = get_parser().parse_args()
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "data.h5")
+    try:
+        write_dataset(
+            path, args.size, args.n_genes, args.density, np.random.default_rng(0)
+        )
+        print(
+            "{} spots x {} genes, batches of {} spots, {:.1f} MB on disk".format(
+                args.size**2,
+                args.n_genes,
+                args.batch_size,
+                os.path.getsize(path) / 1e6,
+            )
+        )
+        print("{:>12} {:>12} {:>16}".format("mode", "s/step", "added RSS (MB)"))
+
+        context = multiprocessing.get_context("spawn")
+        for mode in ["memory", "streamed", "no prefetch"]:
+            results = context.Queue()
+            process = context.Process(target=run, args=(args, path, mode, results))
+            process.start()
+            step_time, peak_kb = results.get()
+            process.join()
+            print("{:>12} {:>12.3f} {:>16.1f}".format(mode, step_time, peak_kb / 1e3))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
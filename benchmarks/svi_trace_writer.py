@@ -0,0 +1,142 @@
+"""
+Peak memory of writing posterior traces in one piece versus while sampling.
+
+Runs BayesTME_VI.deconvolution for a few SVI steps on a random square grid
+dataset in a fresh process for each mode, then writes the posterior traces to
+a temporary h5 file, reporting the time of the call, the size of the file and
+how much the peak resident memory grew during the call:
+
+    in memory   draw all samples into a DeconvolutionResult, then write its
+                traces to h5
+    streamed    pass trace_path (with summary_only), writing each batch of
+                samples as it is drawn
+
+reads_trace, which DeconvolutionResult.save also writes, is left out of both:
+it is larger than the other traces by a factor of the number of genes.
+
+Usage:
+
+    python benchmarks/svi_trace_writer.py --size 64 --n-genes 2000 \
+        --n-samples 100 1000 2000
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import h5py
+import numpy as np
+import pyro
+
+from bayestme import data
+from bayestme.common import Layout
+from bayestme.svi.deconvolution import BayesTME_VI
+from bayestme.utils import get_edges
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--n-genes", type=int, default=2000)
+    parser.add_argument("--n-components", type=int, default=10)
+    parser.add_argument("--n-samples", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--n-steps", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def make_dataset(size, n_genes, rng):
+    locations = np.stack(
+        np.meshgrid(np.arange(size), np.arange(size)), axis=-1
+    ).reshape(-1, 2)
+    n_spots = locations.shape[0]
+    return data.SpatialExpressionDataset.from_arrays(
+        raw_counts=rng.poisson(rng.gamma(0.5, 4.0, (n_spots, n_genes))),
+        positions=locations,
+        tissue_mask=np.ones(n_spots, dtype=bool),
+        gene_names=np.array(["gene{}".format(i) for i in range(n_genes)]),
+        layout=Layout.SQUARE,
+        edges=get_edges(locations, Layout.SQUARE),
+    )
+
+
+def peak_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+
+def run(args, path, n_samples, mode, results):
+    rng = np.random.default_rng(args.seed)
+    pyro.set_rng_seed(args.seed)
+    vi = BayesTME_VI(stdata=make_dataset(args.size, args.n_genes, rng))
+
+    baseline_kb = peak_rss_kb()
+    start = time.time()
+    if mode == "streamed":
+        vi.deconvolution(
+            K=args.n_components,
+            n_iter=args.n_steps,
+            n_traces=n_samples,
+            summary_only=True,
+            trace_path=path,
+        )
+    else:
+        result = vi.deconvolution(
+            K=args.n_components, n_iter=args.n_steps, n_traces=n_samples
+        )
+        with h5py.File(path, "w") as f:
+            f["cell_prob_trace"] = result.cell_prob_trace
+            f["expression_trace"] = result.expression_trace
+            f["beta_trace"] = result.beta_trace
+            f["cell_num_total_trace"] = result.cell_num_total_trace
+            f["losses"] = result.losses
+            f.attrs["lam2"] = result.lam2
+            f.attrs["n_components"] = result.n_components
+    elapsed = time.time() - start
+    results.put((elapsed, peak_rss_kb() - baseline_kb))
+
+
+def main():
+    args = get_parser().parse_args()
+    print(
+        "{} spots x {} genes, {} components".format(
+            args.size**2, args.n_genes, args.n_components
+        )
+    )
+    print(
+        "{:>10} {:>10} {:>10} {:>12} {:>16}".format(
+            "samples", "mode", "time (s)", "file (MB)", "added RSS (MB)"
+        )
+    )
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "deconvolve.h5")
+    context = multiprocessing.get_context("spawn")
+    try:
+        for n_samples in args.n_samples:
+            for mode in ["in memory", "streamed"]:
+                results = context.Queue()
+                process = context.Process(
+                    target=run, args=(args, path, n_samples, mode, results)
+                )
+                process.start()
+                elapsed, added_kb = results.get()
+                process.join()
+                print(
+                    "{:>10} {:>10} {:>10.1f} {:>12.1f} {:>16.1f}".format(
+                        n_samples,
+                        mode,
+                        elapsed,
+                        os.path.getsize(path) / 1e6,
+                        added_kb / 1e3,
+                    )
+                )
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,12 @@ The hope is that this enables us to account for tissue friction which seems to b
 """
 import logging
 import math
+import multiprocessing
 import os.path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from multiprocessing.shared_memory import SharedMemory
 from typing import Optional
 
 import matplotlib.cm as cm
@@ -14,9 +19,12 @@ import numpy as np
 import torch
 import tqdm
 from autograd_minimize import minimize
+from scipy import sparse
+from scipy.optimize import OptimizeResult
+from scipy.sparse.linalg import LinearOperator
+from scipy.spatial import cKDTree
 from scipy.stats import multinomial
-from torch.distributions.multinomial import Multinomial
-from torch.nn import Softmax
+from torch.distributions.utils import clamp_probs
 from torch.nn import Softplus
 from matplotlib.colors import TwoSlopeNorm, Normalize
 
@@ -26,6 +34,68 @@ from bayestme.utils import stable_softmax
 
 logger = logging.getLogger(__name__)
 
+NORTH = 0
+SOUTH = 1
+EAST = 2
+WEST = 3
+
+# Number of spot pairs processed at a time when building or evaluating
+# compact basis indices, this bounds the size of temporary arrays
+BASIS_INDEX_CHUNK_SIZE = 2**18
+
+# Maximum number of elements in the intermediates of a chunked mixing of spot rates
+MIXING_CHUNK_SIZE = 2**24
+
+# Maximum number of elements of the dense corrected read counts computed at a time
+CORRECTED_READS_CHUNK_SIZE = 2**20
+
+
+class SpotRateSolver(Enum):
+    """
+    How the per-gene spot rates are fit once the bleed weights are known.
+
+    EM fits all genes at once with multiplicative (Richardson-Lucy) updates.
+    LBFGS fits every gene separately with L-BFGS.
+    """
+
+    EM = "EM"
+    LBFGS = "LBFGS"
+
+    def __str__(self):
+        return self.value
+
+
+class OptimizerBackend(Enum):
+    """
+    Optimizer used for the L-BFGS fits in bleed correction.
+
+    SCIPY runs scipy's L-BFGS-B through autograd_minimize, copying the parameters
+    between numpy and torch on every evaluation.
+    TORCH runs torch.optim.LBFGS with the parameters kept as torch tensors.
+    """
+
+    SCIPY = "SCIPY"
+    TORCH = "TORCH"
+
+    def __str__(self):
+        return self.value
+
+
+class BleedCorrectionEngine(Enum):
+    """
+    How the bleed weight matrix is evaluated.
+
+    EXACT evaluates the full N x N matrix of pairwise weights.
+    SEPARABLE evaluates the same model from per-spot row and column factors,
+    which needs O(N * (rows + columns)) memory instead of O(N^2).
+    """
+
+    EXACT = "EXACT"
+    SEPARABLE = "SEPARABLE"
+
+    def __str__(self):
+        return self.value
+
 
 def imshow_matrix(reads, locations, fill=False):
     to_plot = np.full(locations.max(axis=0).astype(int) + 1, np.nan)
@@ -65,6 +135,63 @@ def calculate_pairwise_coordinate_differences(locations):
     return (locations[None] - locations[:, None]).astype(int)
 
 
+def cumulative_tissue_counts(locations, tissue_mask):
+    """
+    Cumulative in-tissue spot counts along each row and column of the tissue grid.
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :return: (cumulative_rows, cumulative_columns), where cumulative_rows[r, c] is the
+             number of tissue spots in tissue_grid[:r, c] and cumulative_columns[r, c]
+             is the number of tissue spots in tissue_grid[r, :c]
+    """
+    tissue_grid = tissue_mask_to_grid(tissue_mask, locations).astype(int)
+    cumulative_rows = np.pad(tissue_grid.cumsum(axis=0), ((1, 0), (0, 0)))
+    cumulative_columns = np.pad(tissue_grid.cumsum(axis=1), ((0, 0), (1, 0)))
+    return cumulative_rows, cumulative_columns
+
+
+def count_tissue_spots_between(locations, tissue_mask, sources=None):
+    """
+    Count the in-tissue spots passed when walking from each location towards
+    every other location along the two grid axes.
+
+    The walk from location_i towards location_j along the first dimension stays
+    in the column of location_i, and includes location_i but not the row of location_j
+    (and vice versa for the second dimension). Counts are looked up from cumulative
+    in-tissue counts along each row and column of the grid, so no per-pair slicing is needed.
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,), True for in-tissue spots
+    :param sources: Optional index or slice selecting which locations to walk from,
+                    defaults to all N locations.
+    :return: Tuple of two np.ndarray of shape (N sources, N): (counts along first dimension,
+             counts along second dimension)
+    """
+    cumulative_rows, cumulative_columns = cumulative_tissue_counts(
+        locations, tissue_mask
+    )
+
+    rows = locations[:, 0]
+    columns = locations[:, 1]
+
+    if sources is None:
+        sources = slice(None)
+    source_rows = rows[sources]
+    source_columns = columns[sources]
+
+    n_tissue_rows = np.abs(
+        cumulative_rows[rows[None, :], source_columns[:, None]]
+        - cumulative_rows[source_rows, source_columns][:, None]
+    )
+    n_tissue_columns = np.abs(
+        cumulative_columns[source_rows[:, None], columns[None, :]]
+        - cumulative_columns[source_rows, source_columns][:, None]
+    )
+
+    return n_tissue_rows, n_tissue_columns
+
+
 def build_basis_indices(locations, tissue_mask):
     """
     Creates 8 sets of basis functions: north, south, east, west, for in- and out-tissue.
@@ -107,97 +234,877 @@ def build_basis_indices(locations, tissue_mask):
     :param tissue_mask:
     :return: (basis_idxs, basis_mask)
     """
-    NORTH = 0
-    SOUTH = 1
-    EAST = 2
-    WEST = 3
     pairwise_coordinate_differences = calculate_pairwise_coordinate_differences(
         locations
     )
+    row_differences = pairwise_coordinate_differences[:, :, 0]
+    column_differences = pairwise_coordinate_differences[:, :, 1]
+
+    n_tissue_north_south, n_tissue_east_west = count_tissue_spots_between(
+        locations, tissue_mask
+    )
 
     basis_idxs = np.zeros((locations.shape[0], locations.shape[0], 8), dtype=int)
     basis_mask = np.zeros((locations.shape[0], locations.shape[0], 8), dtype=bool)
 
-    tissue_grid = tissue_mask_to_grid(tissue_mask, locations)
+    north = row_differences >= 0
+    east = column_differences >= 0
 
-    for location_index, location in enumerate(locations):
-        # North
-        for j in np.flatnonzero(
-            pairwise_coordinate_differences[location_index, :, 0] >= 0
-        ):
-            # Calculate the amount of in-tissue spots from the 1st to 2nd element going north
-            basis_idxs[location_index, j, NORTH + 4] = tissue_grid[
-                location[0] : location[0]
-                + pairwise_coordinate_differences[location_index, j, 0],
-                location[1],
-            ].sum()
-            basis_mask[location_index, j, NORTH + 4] = True
-
-            basis_idxs[location_index, j, NORTH] = (
-                pairwise_coordinate_differences[location_index, j, 0]
-                - basis_idxs[location_index, j, NORTH + 4]
-            )
-            basis_mask[location_index, j, NORTH] = True
+    for direction, selector, n_tissue, distance in [
+        (NORTH, north, n_tissue_north_south, row_differences),
+        (SOUTH, ~north, n_tissue_north_south, -row_differences),
+        (EAST, east, n_tissue_east_west, column_differences),
+        (WEST, ~east, n_tissue_east_west, -column_differences),
+    ]:
+        basis_idxs[:, :, direction + 4] = np.where(selector, n_tissue, 0)
+        basis_idxs[:, :, direction] = np.where(selector, distance - n_tissue, 0)
+        basis_mask[:, :, direction + 4] = selector
+        basis_mask[:, :, direction] = selector
 
-        # South
-        for j in np.flatnonzero(
-            pairwise_coordinate_differences[location_index, :, 0] < 0
-        ):
-            # Calculate the amount of in-tissue spots from the 1st to 2nd element going south
-            basis_idxs[location_index, j, SOUTH + 4] = tissue_grid[
-                location[0]
-                + pairwise_coordinate_differences[location_index, j, 0] : location[0],
-                location[1],
-            ].sum()
-            basis_mask[location_index, j, SOUTH + 4] = True
-
-            basis_idxs[location_index, j, SOUTH] = (
-                -pairwise_coordinate_differences[location_index, j, 0]
-                - basis_idxs[location_index, j, SOUTH + 4]
-            )
-            basis_mask[location_index, j, SOUTH] = True
+    # Treat the local spot specially
+    diagonal = np.arange(locations.shape[0])
+    basis_mask[diagonal, diagonal] = False
 
-        # East
-        for j in np.flatnonzero(
-            pairwise_coordinate_differences[location_index, :, 1] >= 0
-        ):
-            # Calculate the amount of in-tissue spots from the 1st to 2nd element going east
-            basis_idxs[location_index, j, EAST + 4] = tissue_grid[
-                location[0],
-                location[1] : location[1]
-                + pairwise_coordinate_differences[location_index, j, 1],
-            ].sum()
-            basis_mask[location_index, j, EAST + 4] = True
-
-            basis_idxs[location_index, j, EAST] = (
-                pairwise_coordinate_differences[location_index, j, 1]
-                - basis_idxs[location_index, j, EAST + 4]
-            )
-            basis_mask[location_index, j, EAST] = True
+    return basis_idxs, basis_mask
 
-        # West
-        for j in np.flatnonzero(
-            pairwise_coordinate_differences[location_index, :, 1] < 0
-        ):
-            # Calculate the amount of in-tissue spots from the 1st to 2nd element going west
-            basis_idxs[location_index, j, WEST + 4] = tissue_grid[
-                location[0],
-                location[1]
-                + pairwise_coordinate_differences[location_index, j, 1] : location[1],
-            ].sum()
-            basis_mask[location_index, j, WEST + 4] = True
-
-            # Calculate the amount of out-tissue
-            basis_idxs[location_index, j, WEST] = (
-                -pairwise_coordinate_differences[location_index, j, 1]
-                - basis_idxs[location_index, j, WEST + 4]
+
+def get_index_dtype(max_value):
+    """
+    Return the smallest integer dtype which can hold values up to max_value
+    and which torch can use directly (torch has no uint16/uint32 support).
+    """
+    for dtype in (np.uint8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _iter_chunks(n_spots):
+    chunk_size = max(1, BASIS_INDEX_CHUNK_SIZE // n_spots)
+    for start in range(0, n_spots, chunk_size):
+        yield slice(start, start + chunk_size)
+
+
+def _iter_compact_basis_chunks(locations, tissue_mask):
+    for sources in _iter_chunks(locations.shape[0]):
+        differences = locations[None] - locations[sources, None]
+        n_tissue_rows, n_tissue_columns = count_tissue_spots_between(
+            locations, tissue_mask, sources=sources
+        )
+        yield sources, differences, n_tissue_rows, n_tissue_columns
+
+
+def build_compact_basis_indices(locations, tissue_mask):
+    """
+    Memory efficient equivalent of build_basis_indices.
+
+    For any pair of spots only one of north/south and one of east/west is active,
+    so instead of 8 indices and 8 mask values per pair we store 4 indices, one for each
+    of the channels
+
+    [out-tissue north/south, out-tissue east/west, in-tissue north/south, in-tissue east/west]
+
+    Each channel indexes its own pair of basis functions, the rows of
+    basis_functions.reshape(4, 2 * L), where L is the basis function length, so the
+    indices only range up to 2 * L and fit in uint8 for grids up to 127 spots across.
+    The direction is folded into the index from the sign of the coordinate difference,
+    so no mask needs to be stored. The local spot, which is masked out entirely in
+    build_basis_indices, has index 2 * L in every channel, where a zero is appended to
+    each row before lookup (see _compact_lookup_table).
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :return: np.ndarray of shape (N, N, 4), in the smallest integer dtype that fits
+    """
+    n_spots = locations.shape[0]
+
+    # First pass to find the basis function length, which determines the dtype
+    basis_length = 1
+    for _, differences, n_tissue_rows, n_tissue_columns in _iter_compact_basis_chunks(
+        locations, tissue_mask
+    ):
+        basis_length = max(
+            basis_length,
+            n_tissue_rows.max() + 1,
+            n_tissue_columns.max() + 1,
+            (np.abs(differences[..., 0]) - n_tissue_rows).max() + 1,
+            (np.abs(differences[..., 1]) - n_tissue_columns).max() + 1,
+        )
+
+    missing_index = 2 * basis_length
+    basis_idxs = np.empty((n_spots, n_spots, 4), dtype=get_index_dtype(missing_index))
+
+    for (
+        sources,
+        differences,
+        n_tissue_rows,
+        n_tissue_columns,
+    ) in _iter_compact_basis_chunks(locations, tissue_mask):
+        north = differences[..., 0] >= 0
+        east = differences[..., 1] >= 0
+        # Offsets within the rows of the north/south and east/west channels
+        north_south_offset = (np.where(north, NORTH, SOUTH) - NORTH) * basis_length
+        east_west_offset = (np.where(east, EAST, WEST) - EAST) * basis_length
+
+        basis_idxs[sources, :, 0] = (
+            north_south_offset + np.abs(differences[..., 0]) - n_tissue_rows
+        )
+        basis_idxs[sources, :, 1] = (
+            east_west_offset + np.abs(differences[..., 1]) - n_tissue_columns
+        )
+        basis_idxs[sources, :, 2] = north_south_offset + n_tissue_rows
+        basis_idxs[sources, :, 3] = east_west_offset + n_tissue_columns
+
+    diagonal = np.arange(n_spots)
+    basis_idxs[diagonal, diagonal] = missing_index
+
+    return basis_idxs
+
+
+def compact_basis_indices(basis_idxs, basis_mask):
+    """
+    Convert the (basis_idxs, basis_mask) output of build_basis_indices
+    to the representation returned by build_compact_basis_indices.
+
+    :param basis_idxs: np.ndarray of shape (N, N, 8)
+    :param basis_mask: np.ndarray of shape (N, N, 8)
+    :return: np.ndarray of shape (N, N, 4)
+    """
+    basis_length = basis_idxs.max() + 1
+    missing_index = 2 * basis_length
+    compact = np.full(
+        basis_idxs.shape[:2] + (4,),
+        missing_index,
+        dtype=get_index_dtype(missing_index),
+    )
+    for channel, directions in enumerate(
+        [(NORTH, SOUTH), (EAST, WEST), (NORTH + 4, SOUTH + 4), (EAST + 4, WEST + 4)]
+    ):
+        for d in directions:
+            selector = basis_mask[:, :, d]
+            offset = (d - directions[0]) * basis_length
+            compact[selector, channel] = offset + basis_idxs[selector, d]
+    return compact
+
+
+def get_compact_basis_shape(basis_idxs):
+    """
+    :param basis_idxs: Output of build_compact_basis_indices (np.ndarray or torch.Tensor)
+    :return: Shape of the basis functions indexed by basis_idxs
+    """
+    # Every spot is paired with itself, which has the largest index
+    return 8, int(basis_idxs.max()) // 2
+
+
+def _compact_lookup_table(flat_basis):
+    """
+    Flattened basis functions with a zero appended (as passed to _CompactBleedMixing),
+    rearranged into the 4 x (2 * L + 1) lookup table of the channels of
+    build_compact_basis_indices, flattened, and the offset of each channel in it.
+    """
+    channels = flat_basis[:-1].reshape(4, -1)
+    if isinstance(channels, torch.Tensor):
+        table = torch.cat([channels, channels.new_zeros((4, 1))], dim=1)
+    else:
+        table = np.pad(channels, ((0, 0), (0, 1)))
+    offsets = np.arange(4) * table.shape[1]
+    return table.reshape(-1), offsets
+
+
+def _compact_basis_logits(basis_functions, basis_idxs):
+    table, offsets = _compact_lookup_table(np.append(basis_functions.reshape(-1), 0))
+    W = np.empty(basis_idxs.shape[:2], dtype=table.dtype)
+    for chunk in _iter_chunks(W.shape[0]):
+        values = table[basis_idxs[chunk] + offsets]
+        W[chunk] = values[..., 0] + values[..., 1] + values[..., 2] + values[..., 3]
+    return W
+
+
+def _compact_logits_forward(flat_basis, basis_idxs):
+    """
+    Sum of the basis values for every pair of spots, looked up in chunks from the
+    compact basis indices (torch version of _compact_basis_logits).
+    """
+    table, offsets = _compact_lookup_table(flat_basis)
+    offsets = torch.as_tensor(offsets)
+    W = flat_basis.new_empty(basis_idxs.shape[:2])
+    for chunk in _iter_chunks(W.shape[0]):
+        values = table[basis_idxs[chunk].long() + offsets]
+        W[chunk] = values[..., 0] + values[..., 1] + values[..., 2] + values[..., 3]
+    return W
+
+
+def _compact_logits_backward(grad_W, basis_idxs, n_basis):
+    """
+    Gradient of _compact_logits_forward with respect to flat_basis, scattered back
+    from grad_W in chunks with index_add.
+    """
+    row_length = (n_basis - 1) // 4 + 1
+    offsets = torch.as_tensor(np.arange(4) * row_length)
+    grad_table = grad_W.new_zeros(4 * row_length)
+    for chunk in _iter_chunks(grad_W.shape[0]):
+        idxs = basis_idxs[chunk].long() + offsets
+        grad_table.index_add_(
+            0,
+            idxs.reshape(-1),
+            grad_W[chunk, :, None].expand(idxs.shape).reshape(-1),
+        )
+    # Drop the appended zero of each channel, and restore the one of flat_basis
+    grad_basis = grad_table.reshape(4, -1)[:, :-1].reshape(-1)
+    return torch.cat([grad_basis, grad_basis.new_zeros(1)])
+
+
+class _CompactBleedMixing(torch.autograd.Function):
+    """
+    softmax(W, dim=0) @ Rates, where W holds the sum of the basis values for every pair
+    of spots, looked up in chunks from the compact basis indices, plus the local logits
+    on the diagonal.
+
+    The softmax is taken in place and is the only N x N matrix kept for the backward
+    pass, which computes the gradient of W in place in one more N x N buffer and scatters
+    it back onto the basis with index_add, so no more than two N x N matrices are alive
+    at once.
+    """
+
+    @staticmethod
+    def forward(ctx, flat_basis, basis_idxs, local_logits, Rates):
+        W = _compact_logits_forward(flat_basis, basis_idxs)
+        diagonal = torch.arange(W.shape[0])
+        W[diagonal, diagonal] += local_logits
+        W -= W.max(dim=0, keepdim=True).values
+        W.exp_()
+        W /= W.sum(dim=0, keepdim=True)
+
+        ctx.save_for_backward(basis_idxs, W, Rates)
+        ctx.n_basis = flat_basis.shape[0]
+        return W @ Rates
+
+    @staticmethod
+    def backward(ctx, grad_Mu):
+        basis_idxs, S, Rates = ctx.saved_tensors
+        grad_Rates = S.T @ grad_Mu if ctx.needs_input_grad[3] else None
+
+        # Softmax backward, grad_W = S * (G - sum_i S[i] * G[i]) with G = grad_Mu @ Rates.T
+        grad_W = grad_Mu @ Rates.T
+        column_sums = grad_W.new_zeros(grad_W.shape[1])
+        for chunk in _iter_chunks(grad_W.shape[0]):
+            column_sums += (S[chunk] * grad_W[chunk]).sum(dim=0)
+        grad_W -= column_sums[None]
+        grad_W *= S
+
+        grad_local_logits = (
+            torch.diagonal(grad_W).clone() if ctx.needs_input_grad[2] else None
+        )
+        grad_basis = _compact_logits_backward(grad_W, basis_idxs, ctx.n_basis)
+        return grad_basis, None, grad_local_logits, grad_Rates
+
+
+class SeparableBasisIndices:
+    """
+    Basis indices for the separable evaluation of the bleed model.
+
+    The logit for a pair of spots (i, j) is a north/south term plus an east/west term.
+    For a fixed spot i, the north/south term only depends on the row of j and the
+    east/west term only depends on the column of j, so instead of N x N pairs we store
+    indices into the flattened basis functions for every (spot, grid row) and every
+    (spot, grid column).
+    """
+
+    def __init__(
+        self,
+        row_idxs: np.ndarray,
+        column_idxs: np.ndarray,
+        spot_rows: np.ndarray,
+        spot_columns: np.ndarray,
+        basis_length: int,
+    ):
+        """
+        :param row_idxs: <N spots> x <N grid rows> x 2 matrix of
+                         [out-tissue north/south, in-tissue north/south] indices
+        :param column_idxs: <N spots> x <N grid columns> x 2 matrix of
+                            [out-tissue east/west, in-tissue east/west] indices
+        :param spot_rows: <N spots> array, grid row of each spot
+        :param spot_columns: <N spots> array, grid column of each spot
+        :param basis_length: Length of each basis function
+        """
+        self.row_idxs = row_idxs
+        self.column_idxs = column_idxs
+        self.spot_rows = spot_rows
+        self.spot_columns = spot_columns
+        self.basis_length = basis_length
+
+    @property
+    def basis_shape(self):
+        return 8, self.basis_length
+
+    @property
+    def n_spots(self):
+        return self.spot_rows.shape[0]
+
+
+def build_separable_basis_indices(locations, tissue_mask) -> SeparableBasisIndices:
+    """
+    Build the basis indices for the separable bleed model, which is equivalent
+    to the model defined by build_basis_indices but never enumerates pairs of spots.
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :return: SeparableBasisIndices
+    """
+    grid_rows, spot_rows = np.unique(locations[:, 0], return_inverse=True)
+    grid_columns, spot_columns = np.unique(locations[:, 1], return_inverse=True)
+
+    cumulative_rows, cumulative_columns = cumulative_tissue_counts(
+        locations, tissue_mask
+    )
+    rows = locations[:, 0]
+    columns = locations[:, 1]
+
+    row_differences = grid_rows[None, :] - rows[:, None]
+    n_tissue_rows = np.abs(
+        cumulative_rows[grid_rows[None, :], columns[:, None]]
+        - cumulative_rows[rows, columns][:, None]
+    )
+    column_differences = grid_columns[None, :] - columns[:, None]
+    n_tissue_columns = np.abs(
+        cumulative_columns[rows[:, None], grid_columns[None, :]]
+        - cumulative_columns[rows, columns][:, None]
+    )
+
+    basis_length = max(
+        n_tissue_rows.max() + 1,
+        n_tissue_columns.max() + 1,
+        (np.abs(row_differences) - n_tissue_rows).max() + 1,
+        (np.abs(column_differences) - n_tissue_columns).max() + 1,
+    )
+    dtype = get_index_dtype(8 * basis_length)
+
+    north_south_offset = np.where(row_differences >= 0, NORTH, SOUTH) * basis_length
+    row_idxs = np.stack(
+        [
+            north_south_offset + np.abs(row_differences) - n_tissue_rows,
+            north_south_offset + 4 * basis_length + n_tissue_rows,
+        ],
+        axis=-1,
+    ).astype(dtype)
+
+    east_west_offset = np.where(column_differences >= 0, EAST, WEST) * basis_length
+    column_idxs = np.stack(
+        [
+            east_west_offset + np.abs(column_differences) - n_tissue_columns,
+            east_west_offset + 4 * basis_length + n_tissue_columns,
+        ],
+        axis=-1,
+    ).astype(dtype)
+
+    return SeparableBasisIndices(
+        row_idxs=row_idxs,
+        column_idxs=column_idxs,
+        spot_rows=spot_rows,
+        spot_columns=spot_columns,
+        basis_length=int(basis_length),
+    )
+
+
+def _separable_factors(flat_basis, basis_idxs: SeparableBasisIndices, local_logits):
+    """
+    Factor the bleed weights such that
+
+    Weights[i, j] = row_factors[i, row of j] * column_factors[i, column of j] * source_scale[j]
+
+    for i != j, and Weights[j, j] = local_scale[j].
+
+    :return: (row_factors, column_factors, self_factors, source_scale, local_scale), where
+             self_factors[j] = row_factors[j, row of j] * column_factors[j, column of j]
+    """
+    spots = torch.arange(basis_idxs.n_spots)
+    spot_rows = torch.as_tensor(basis_idxs.spot_rows)
+    spot_columns = torch.as_tensor(basis_idxs.spot_columns)
+    row_idxs = torch.as_tensor(basis_idxs.row_idxs).long()
+    column_idxs = torch.as_tensor(basis_idxs.column_idxs).long()
+
+    row_logits = flat_basis[row_idxs[..., 0]] + flat_basis[row_idxs[..., 1]]
+    column_logits = flat_basis[column_idxs[..., 0]] + flat_basis[column_idxs[..., 1]]
+
+    # Shift the logits before exponentiating, this cancels out in the normalization
+    row_shift = row_logits.max().detach()
+    column_shift = column_logits.max().detach()
+    row_factors = torch.exp(row_logits - row_shift)
+    column_factors = torch.exp(column_logits - column_shift)
+
+    # Sum over all target spots of the (shifted) non-local weights for each source spot
+    self_factors = row_factors[spots, spot_rows] * column_factors[spots, spot_columns]
+    normalizer = (row_factors.T @ column_factors)[
+        spot_rows, spot_columns
+    ] - self_factors
+    normalizer = normalizer.clamp_min(torch.finfo(normalizer.dtype).tiny)
+
+    log_normalizer = torch.logaddexp(
+        torch.log(normalizer) + row_shift + column_shift, local_logits
+    )
+    source_scale = torch.exp(row_shift + column_shift - log_normalizer)
+    local_scale = torch.exp(local_logits - log_normalizer)
+
+    return row_factors, column_factors, self_factors, source_scale, local_scale
+
+
+def _iter_feature_chunks(n_elements_per_feature, n_features, max_chunk_elements=None):
+    if max_chunk_elements is None:
+        max_chunk_elements = MIXING_CHUNK_SIZE
+    chunk_size = max(1, max_chunk_elements // n_elements_per_feature)
+    for start in range(0, n_features, chunk_size):
+        yield slice(start, start + chunk_size)
+
+
+def _separable_matmul(factors, basis_idxs: SeparableBasisIndices, X):
+    """
+    Weights @ X for the weights represented by the output of _separable_factors.
+
+    The intermediates hold N x (N grid columns) elements per column of X, so the columns
+    of X are mixed in chunks of at most MIXING_CHUNK_SIZE intermediate elements. If
+    gradients are needed each chunk is checkpointed, so its intermediates are
+    recomputed during the backward pass instead of being kept for every chunk.
+    """
+    n_elements_per_feature = X.shape[0] * factors[1].shape[1]
+    chunks = list(_iter_feature_chunks(n_elements_per_feature, X.shape[1]))
+    if len(chunks) == 1:
+        return _separable_matmul_chunk(factors, basis_idxs, X)
+
+    checkpoint = torch.is_grad_enabled() and (
+        X.requires_grad or any(factor.requires_grad for factor in factors)
+    )
+    mixed = []
+    for chunk in chunks:
+        if checkpoint:
+            mixed.append(
+                torch.utils.checkpoint.checkpoint(
+                    _separable_matmul_chunk,
+                    factors,
+                    basis_idxs,
+                    X[:, chunk],
+                    use_reentrant=False,
+                )
             )
-            basis_mask[location_index, j, WEST] = True
+        else:
+            mixed.append(_separable_matmul_chunk(factors, basis_idxs, X[:, chunk]))
+    return torch.cat(mixed, dim=1)
+
+
+def _separable_matmul_chunk(factors, basis_idxs: SeparableBasisIndices, X):
+    row_factors, column_factors, self_factors, source_scale, local_scale = factors
+    n_rows = row_factors.shape[1]
+    n_columns = column_factors.shape[1]
+    n_features = X.shape[1]
+
+    scaled = X * source_scale[:, None]
+    grid = scaled.new_zeros((n_rows, n_columns, n_features)).index_put(
+        (
+            torch.as_tensor(basis_idxs.spot_rows),
+            torch.as_tensor(basis_idxs.spot_columns),
+        ),
+        scaled,
+        accumulate=True,
+    )
+    mixed = (
+        (row_factors @ grid.reshape(n_rows, n_columns * n_features)).reshape(
+            -1, n_columns, n_features
+        )
+        * column_factors[:, :, None]
+    ).sum(dim=1)
 
-        # Treat the local spot specially
-        basis_mask[location_index, location_index] = False
+    return mixed + (local_scale - self_factors * source_scale)[:, None] * X
 
-    return basis_idxs, basis_mask
+
+def _separable_rmatmul(factors, basis_idxs: SeparableBasisIndices, Y):
+    """
+    Weights.T @ Y for the weights represented by the output of _separable_factors,
+    computed in chunks of columns of Y like _separable_matmul.
+    """
+    n_elements_per_feature = Y.shape[0] * factors[1].shape[1]
+    return torch.cat(
+        [
+            _separable_rmatmul_chunk(factors, basis_idxs, Y[:, chunk])
+            for chunk in _iter_feature_chunks(n_elements_per_feature, Y.shape[1])
+        ],
+        dim=1,
+    )
+
+
+def _separable_rmatmul_chunk(factors, basis_idxs: SeparableBasisIndices, Y):
+    row_factors, column_factors, self_factors, source_scale, local_scale = factors
+    n_rows = row_factors.shape[1]
+    n_columns = column_factors.shape[1]
+    n_features = Y.shape[1]
+
+    grid = (
+        row_factors.T
+        @ (column_factors[:, :, None] * Y[:, None, :]).reshape(
+            -1, n_columns * n_features
+        )
+    ).reshape(n_rows, n_columns, n_features)
+    mixed = grid[
+        torch.as_tensor(basis_idxs.spot_rows), torch.as_tensor(basis_idxs.spot_columns)
+    ]
+
+    return (
+        mixed * source_scale[:, None]
+        + (local_scale - self_factors * source_scale)[:, None] * Y
+    )
+
+
+class SeparableBleedWeights(LinearOperator):
+    """
+    N x N bleed weight matrix of the separable bleed model, stored as per-spot row and
+    column factors. Supports products with dense matrices (Weights @ X, Weights.T @ Y)
+    without ever forming the full matrix.
+    """
+
+    def __init__(
+        self,
+        basis_functions: np.ndarray,
+        basis_idxs: SeparableBasisIndices,
+        tissue_mask: np.ndarray,
+        local_weight: float,
+    ):
+        flat_basis = torch.as_tensor(
+            np.append(basis_functions.reshape(-1), 0), dtype=torch.float64
+        )
+        local_logits = torch.as_tensor(
+            local_weight * tissue_mask.astype(float), dtype=torch.float64
+        )
+        self.basis_idxs = basis_idxs
+        self.factors = _separable_factors(flat_basis, basis_idxs, local_logits)
+        super().__init__(
+            dtype=np.float64, shape=(basis_idxs.n_spots, basis_idxs.n_spots)
+        )
+
+    def _matmat(self, X):
+        return _separable_matmul(
+            self.factors, self.basis_idxs, torch.as_tensor(X, dtype=torch.float64)
+        ).numpy()
+
+    def _matvec(self, x):
+        return self._matmat(x.reshape(-1, 1)).reshape(-1)
+
+    def _rmatmat(self, Y):
+        return _separable_rmatmul(
+            self.factors, self.basis_idxs, torch.as_tensor(Y, dtype=torch.float64)
+        ).numpy()
+
+    def _rmatvec(self, y):
+        return self._rmatmat(y.reshape(-1, 1)).reshape(-1)
+
+    def toarray(self):
+        """
+        :return: The dense N x N weight matrix
+        """
+        return self._matmat(np.eye(self.shape[1]))
+
+
+class _LinearOperatorMatmul(torch.autograd.Function):
+    """
+    operator @ X for a fixed scipy LinearOperator (or sparse matrix),
+    differentiable with respect to X.
+    """
+
+    @staticmethod
+    def forward(ctx, X, operator):
+        ctx.operator = operator
+        return torch.as_tensor(operator @ X.detach().double().numpy(), dtype=X.dtype)
+
+    @staticmethod
+    def backward(ctx, grad):
+        return (
+            torch.as_tensor(
+                ctx.operator.T @ grad.detach().double().numpy(), dtype=grad.dtype
+            ),
+            None,
+        )
+
+
+class TruncatedBasisIndices:
+    """
+    Basis indices for the bleed model truncated to pairs of spots within
+    max_bleed_distance of each other.
+
+    Pairs are stored sorted by (target, source), and every spot is paired with itself.
+    The channels of each pair are those of build_compact_basis_indices, but the indices
+    point directly into the flattened basis functions (with a zero appended at 8 * L for
+    the local spot), as the sparse pairs take little memory.
+    """
+
+    def __init__(
+        self,
+        pair_idxs: np.ndarray,
+        targets: np.ndarray,
+        sources: np.ndarray,
+        n_spots: int,
+        basis_length: int,
+        max_bleed_distance: float,
+    ):
+        """
+        :param pair_idxs: <N pairs> x 4 matrix of indices into the flattened basis functions
+        :param targets: <N pairs> array, spot where the bleed is observed
+        :param sources: <N pairs> array, spot the bleed originates from
+        :param n_spots: Total number of spots
+        :param basis_length: Length of each basis function
+        :param max_bleed_distance: Distance (in grid units) the pairs were truncated at
+        """
+        self.pair_idxs = pair_idxs
+        self.targets = targets
+        self.sources = sources
+        self.n_spots = n_spots
+        self.basis_length = basis_length
+        self.max_bleed_distance = max_bleed_distance
+
+    @property
+    def basis_shape(self):
+        return 8, self.basis_length
+
+    @property
+    def n_pairs(self):
+        return self.targets.shape[0]
+
+
+def build_truncated_basis_indices(
+    locations, tissue_mask, max_bleed_distance: float
+) -> TruncatedBasisIndices:
+    """
+    Build the basis indices of build_compact_basis_indices, but only for
+    pairs of spots within max_bleed_distance of each other.
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :param max_bleed_distance: Maximum euclidean distance (in grid units) bleeding is modeled over
+    :return: TruncatedBasisIndices
+    """
+    n_spots = locations.shape[0]
+
+    pairs = cKDTree(locations).query_pairs(max_bleed_distance, output_type="ndarray")
+    diagonal = np.arange(n_spots)
+    targets = np.concatenate([pairs[:, 0], pairs[:, 1], diagonal])
+    sources = np.concatenate([pairs[:, 1], pairs[:, 0], diagonal])
+    order = np.lexsort((sources, targets))
+    targets = targets[order]
+    sources = sources[order]
+
+    cumulative_rows, cumulative_columns = cumulative_tissue_counts(
+        locations, tissue_mask
+    )
+    rows = locations[:, 0]
+    columns = locations[:, 1]
+
+    differences = locations[sources] - locations[targets]
+    n_tissue_rows = np.abs(
+        cumulative_rows[rows[sources], columns[targets]]
+        - cumulative_rows[rows[targets], columns[targets]]
+    )
+    n_tissue_columns = np.abs(
+        cumulative_columns[rows[targets], columns[sources]]
+        - cumulative_columns[rows[targets], columns[targets]]
+    )
+
+    basis_length = max(
+        n_tissue_rows.max() + 1,
+        n_tissue_columns.max() + 1,
+        (np.abs(differences[:, 0]) - n_tissue_rows).max() + 1,
+        (np.abs(differences[:, 1]) - n_tissue_columns).max() + 1,
+    )
+    missing_index = 8 * basis_length
+
+    north_south_offset = np.where(differences[:, 0] >= 0, NORTH, SOUTH) * basis_length
+    east_west_offset = np.where(differences[:, 1] >= 0, EAST, WEST) * basis_length
+    pair_idxs = np.stack(
+        [
+            north_south_offset + np.abs(differences[:, 0]) - n_tissue_rows,
+            east_west_offset + np.abs(differences[:, 1]) - n_tissue_columns,
+            north_south_offset + 4 * basis_length + n_tissue_rows,
+            east_west_offset + 4 * basis_length + n_tissue_columns,
+        ],
+        axis=-1,
+    ).astype(get_index_dtype(missing_index))
+    pair_idxs[targets == sources] = missing_index
+
+    return TruncatedBasisIndices(
+        pair_idxs=pair_idxs,
+        targets=targets,
+        sources=sources,
+        n_spots=n_spots,
+        basis_length=int(basis_length),
+        max_bleed_distance=max_bleed_distance,
+    )
+
+
+def _pair_softmax(logits, groups, n_groups):
+    """
+    Softmax of logits over the pairs sharing the same entry of groups.
+    """
+    shift = logits.new_full((n_groups,), -np.inf).scatter_reduce(
+        0, groups, logits.detach(), reduce="amax"
+    )
+    values = torch.exp(logits - shift[groups])
+    totals = values.new_zeros(n_groups).index_add(0, groups, values)
+    return values / totals[groups]
+
+
+def _truncated_pair_logits(
+    flat_basis, basis_idxs: TruncatedBasisIndices, local_logits, pairs=None
+):
+    """
+    Bleed logits of the pairs in basis_idxs (or of the subset of pairs given by index).
+    """
+    pair_idxs = basis_idxs.pair_idxs
+    targets = basis_idxs.targets
+    sources = basis_idxs.sources
+    if pairs is not None:
+        pair_idxs = pair_idxs[pairs]
+        targets = targets[pairs]
+        sources = sources[pairs]
+    targets = torch.as_tensor(targets)
+
+    logits = flat_basis[torch.as_tensor(pair_idxs).long()].sum(dim=-1)
+    return logits + torch.where(
+        targets == torch.as_tensor(sources), local_logits[targets], logits.new_zeros(1)
+    )
+
+
+def _truncated_weight_values(
+    flat_basis, basis_idxs: TruncatedBasisIndices, local_logits
+):
+    """
+    Bleed weight of every pair in basis_idxs, normalized over the
+    targets within max_bleed_distance of each source.
+    """
+    logits = _truncated_pair_logits(flat_basis, basis_idxs, local_logits)
+    # Softmax over the truncated support of each source
+    return _pair_softmax(
+        logits, torch.as_tensor(basis_idxs.sources), basis_idxs.n_spots
+    )
+
+
+def _truncated_weights(values, basis_idxs: TruncatedBasisIndices):
+    """
+    Sparse N x N torch tensor of the bleed weights from _truncated_weight_values
+    """
+    return torch.sparse_coo_tensor(
+        torch.as_tensor(np.stack([basis_idxs.targets, basis_idxs.sources])),
+        values,
+        (basis_idxs.n_spots, basis_idxs.n_spots),
+        is_coalesced=True,
+        check_invariants=False,
+    )
+
+
+def multinomial_log_normalizer(t_Y):
+    """
+    Constant term of the multinomial log-likelihood of each row of t_Y,
+    log(n!) - sum(log(y_i!)). It depends only on the observed counts, so it is
+    computed once per fit rather than on every loss evaluation.
+
+    :param t_Y: torch.Tensor of shape (G, N) of observed counts
+    :return: torch.Tensor of shape (G,)
+    """
+    return torch.lgamma(t_Y.sum(dim=-1) + 1) - torch.lgamma(t_Y + 1).sum(dim=-1)
+
+
+def multinomial_log_prob(probs, t_Y, log_normalizer):
+    """
+    Multinomial log-likelihood of every row of t_Y in a single batched operation.
+
+    Equivalent to stacking Multinomial(total_count=t_Y[g].sum(), probs=probs[g]).log_prob(t_Y[g])
+    over g, without constructing a distribution per row.
+
+    :param probs: torch.Tensor of shape (G, N) of (unnormalized) probabilities
+    :param t_Y: torch.Tensor of shape (G, N) of observed counts
+    :param log_normalizer: Output of multinomial_log_normalizer(t_Y)
+    :return: torch.Tensor of shape (G,)
+    """
+    probs = probs / probs.sum(dim=-1, keepdim=True)
+    return log_normalizer + (torch.log(clamp_probs(probs)) * t_Y).sum(dim=-1)
+
+
+TORCH_LBFGS_MAX_ITERATIONS = 15000
+
+
+def _optimizer_dtype(x_init):
+    """
+    dtype the loss of a fit is evaluated in, see minimize_torch
+    """
+    if isinstance(x_init, torch.Tensor):
+        return x_init.dtype
+    return torch.float32
+
+
+def _minimize(loss, x_init, optimizer_backend, max_iterations=None):
+    if optimizer_backend is OptimizerBackend.TORCH:
+        if max_iterations is None:
+            return minimize_torch(loss, x_init)
+        return minimize_torch(loss, x_init, max_iterations=max_iterations)
+
+    if isinstance(x_init, torch.Tensor):
+        x_init = x_init.double().numpy()
+    # Optimize using a 2nd order method with autograd for gradient calculation. Amazing times we live in.
+    return minimize(
+        loss,
+        x_init,
+        method="L-BFGS-B",
+        backend="torch",
+        options=None if max_iterations is None else {"maxiter": max_iterations},
+    )
+
+
+def _result_x(res):
+    if isinstance(res.x, torch.Tensor):
+        return res.x.double().numpy()
+    return res.x
+
+
+def minimize_torch(loss, x_init, max_iterations=TORCH_LBFGS_MAX_ITERATIONS):
+    """
+    Minimize loss with torch.optim.LBFGS, keeping the parameters as a torch tensor.
+
+    :param loss: Function of a 1-D (or N-D) parameter tensor returning a scalar tensor
+    :param x_init: Initial parameters. A torch.Tensor is optimized in its own dtype
+                   (e.g. the result of a previous call), anything else is converted to float32.
+    :param max_iterations: Maximum number of L-BFGS iterations
+    :return: scipy.optimize.OptimizeResult with x (torch.Tensor), fun, nit (iterations),
+             nfev (loss evaluations), success and message
+    """
+    if isinstance(x_init, torch.Tensor):
+        x = x_init.detach().clone()
+    else:
+        x = torch.as_tensor(np.asarray(x_init), dtype=torch.float32).clone()
+    x.requires_grad_(True)
+
+    optimizer = torch.optim.LBFGS(
+        [x],
+        max_iter=max_iterations,
+        tolerance_grad=1e-5,
+        tolerance_change=1e-9,
+        line_search_fn="strong_wolfe",
+    )
+
+    def closure():
+        optimizer.zero_grad()
+        value = loss(x)
+        value.backward()
+        return value
+
+    optimizer.step(closure)
+    state = optimizer.state[optimizer.param_groups[0]["params"][0]]
+
+    with torch.no_grad():
+        fun = loss(x).item()
+    nit = state["n_iter"]
+
+    return OptimizeResult(
+        x=x.detach(),
+        fun=fun,
+        nit=nit,
+        nfev=state["func_evals"] + 1,
+        success=nit < max_iterations,
+        message="Converged" if nit < max_iterations else "Maximum iterations reached",
+    )
 
 
 def softplus(x):
@@ -207,18 +1114,85 @@ def softplus(x):
 def weights_from_basis(
     basis_functions, basis_idxs, basis_mask, tissue_mask, local_weight
 ):
-    W = np.sum(
-        [
-            basis_functions[d, basis_idxs[:, :, d]] * basis_mask[:, :, d]
-            for d in range(basis_functions.shape[0])
-        ],
-        axis=0,
-    )
+    """
+    Calculate the N x N bleed weight matrix, where Weights[i, j] is the probability
+    a read originating at spot j is observed at spot i.
+
+    :param basis_functions: np.ndarray of shape (8, L)
+    :param basis_idxs: Output of build_basis_indices, or of build_compact_basis_indices,
+                       build_separable_basis_indices or build_truncated_basis_indices
+                       if basis_mask is None.
+    :param basis_mask: Output of build_basis_indices, or None
+    :param tissue_mask: np.ndarray of shape (N,)
+    :param local_weight: Weight for the local spot
+    :return: np.ndarray of shape (N, N), SeparableBleedWeights for separable basis indices
+             or scipy.sparse.csr_matrix of shape (N, N) for truncated basis indices
+    """
+    if isinstance(basis_idxs, SeparableBasisIndices):
+        return SeparableBleedWeights(
+            basis_functions, basis_idxs, tissue_mask, local_weight
+        )
+
+    if isinstance(basis_idxs, TruncatedBasisIndices):
+        values = _truncated_weight_values(
+            torch.as_tensor(np.append(basis_functions.reshape(-1), 0)),
+            basis_idxs,
+            torch.as_tensor(local_weight * tissue_mask.astype(float)),
+        )
+        return sparse.csr_matrix(
+            (values.numpy(), (basis_idxs.targets, basis_idxs.sources)),
+            shape=(basis_idxs.n_spots, basis_idxs.n_spots),
+        )
+
+    if basis_mask is None:
+        W = _compact_basis_logits(basis_functions, np.asarray(basis_idxs))
+    else:
+        W = np.sum(
+            [
+                basis_functions[d, basis_idxs[:, :, d]] * basis_mask[:, :, d]
+                for d in range(basis_functions.shape[0])
+            ],
+            axis=0,
+        )
     W[
         np.arange(tissue_mask.shape[0]), np.arange(tissue_mask.shape[0])
     ] += local_weight * tissue_mask.astype(float)
-    Weights = stable_softmax(W, axis=0)
-    return Weights
+
+    # Same as stable_softmax(W, axis=0), but in place to avoid N x N temporaries
+    W -= W.max(axis=0, keepdims=True)
+    np.exp(W, out=W)
+    W /= W.sum(axis=0, keepdims=True)
+    return W
+
+
+def basis_functions_from_x(x):
+    """
+    Basis functions for the (unconstrained) parameters optimized by fit_basis_functions,
+    reverse cumulative sums of the softplus of x.
+
+    :param x: np.ndarray of shape (8, L)
+    :return: np.ndarray of shape (8, L)
+    """
+    return softplus(np.asarray(x))[:, ::-1].cumsum(axis=1)[:, ::-1]
+
+
+def basis_functions_to_x(basis_functions):
+    """
+    Inverse of the parameterization used by fit_basis_functions, for use as x_init.
+
+    The basis functions are reverse cumulative sums of positive increments, so the curves
+    are made non-increasing (and the increments at least slightly positive) first.
+
+    :param basis_functions: np.ndarray of shape (8, L)
+    :return: np.ndarray of shape (8, L)
+    """
+    curves = np.minimum.accumulate(np.asarray(basis_functions, dtype=float), axis=1)
+    increments = curves - np.append(
+        curves[:, 1:], np.zeros((curves.shape[0], 1)), axis=1
+    )
+    increments = increments.clip(1e-4, None)
+    # Inverse of softplus
+    return increments + np.log(-np.expm1(-increments))
 
 
 BASIS_FUNCTION_INITIALIZATION_VALUE = -3
@@ -235,17 +1209,31 @@ def fit_basis_functions(
     lam=0,
     local_weight=100,
     x_init=None,
+    optimizer_backend=OptimizerBackend.SCIPY,
 ):
+    """
+    Fit the bleed basis functions given the current spot rates.
+
+    :param basis_idxs: Output of build_basis_indices, or of build_compact_basis_indices
+                       (as np.ndarray or torch.Tensor), build_separable_basis_indices
+                       or build_truncated_basis_indices if basis_mask is None.
+    :param basis_mask: Output of build_basis_indices, or None
+    :param x_init: Initial (unconstrained) parameters, e.g. res.x of a previous fit
+    :param optimizer_backend: OptimizerBackend used for the fit
+    :return: (basis_functions, Weights, optimization result)
+    """
     # local_weight = 100
-    N = Reads.sum(axis=0)
-    t_Y = torch.Tensor(Reads.T)
-    t_Rates = torch.Tensor(Rates)
-    t_Beta0 = torch.Tensor(global_rates)
-    t_basis_idxs = torch.LongTensor(basis_idxs)
-    t_basis_mask = torch.Tensor(basis_mask)
-    t_local_mask = torch.Tensor(tissue_mask.astype(float))
-    t_local_idxs = torch.LongTensor(np.arange(Reads.shape[0]))
-    sm = Softmax(dim=0)
+    if basis_mask is not None:
+        basis_idxs = compact_basis_indices(basis_idxs, basis_mask)
+    separable = isinstance(basis_idxs, SeparableBasisIndices)
+    truncated = isinstance(basis_idxs, TruncatedBasisIndices)
+
+    dtype = _optimizer_dtype(x_init)
+    t_Y = torch.as_tensor(Reads.T, dtype=dtype)
+    t_log_normalizer = multinomial_log_normalizer(t_Y)
+    t_Rates = torch.as_tensor(Rates, dtype=dtype)
+    t_Beta0 = torch.as_tensor(global_rates, dtype=dtype)
+    t_local_mask = torch.as_tensor(tissue_mask, dtype=dtype)
     sp = Softplus()
 
     # We have a set of basis functions with mappings from spots to locations in each basis
@@ -254,7 +1242,12 @@ def fit_basis_functions(
     # cardinal direction out of tissue, the first dimension will always be 8.
     # The second dimension depends on the shape of the reads matrix and the tissue mask,
     # in most cases it will be equal to the longest dimension of the reads array
-    basis_shape = (basis_idxs.shape[2], basis_idxs.max() + 1)
+    if separable or truncated:
+        basis_shape = basis_idxs.basis_shape
+    else:
+        # Shares memory with basis_idxs, no copy is made
+        t_basis_idxs = torch.as_tensor(basis_idxs)
+        basis_shape = get_compact_basis_shape(t_basis_idxs)
     t_reverse = torch.LongTensor(np.arange(basis_shape[1])[::-1].copy())
 
     if x_init is None:
@@ -267,35 +1260,37 @@ def fit_basis_functions(
         # Exponentiate and sum each basis element from N down to the current entry j for each j
         t_Basis = t_Betas[:, t_reverse].cumsum(dim=1)[:, t_reverse]
 
-        # Add all the basis values for this spot
-        W = torch.sum(
-            torch.stack(
-                [
-                    t_Basis[d, t_basis_idxs[:, :, d]] * t_basis_mask[:, :, d]
-                    for d in range(basis_shape[0])
-                ],
-                dim=0,
-            ),
-            dim=0,
-        )
+        t_flat_basis = torch.cat([t_Basis.reshape(-1), t_Basis.new_zeros(1)])
 
-        # Set the value of each local spot to 1
-        W[t_local_idxs, t_local_idxs] += local_weight * t_local_mask
-
-        # Normalize across target spots to get a probability
-        t_Weights = sm(W)
-
-        # Rate for each spot is bleed prob * spot rate plus the global read prob
-        t_Mu = (t_Rates[None] * t_Weights[..., None]).sum(dim=1) + t_Beta0[None]
+        if separable:
+            # Rate for each spot is bleed prob * spot rate plus the global read prob,
+            # evaluated from row and column factors without forming the weight matrix
+            factors = _separable_factors(
+                t_flat_basis, basis_idxs, local_weight * t_local_mask
+            )
+            t_Mu = _separable_matmul(factors, basis_idxs, t_Rates) + t_Beta0[None]
+        elif truncated:
+            # Only pairs of spots within max_bleed_distance are evaluated
+            t_Weights = _truncated_weights(
+                _truncated_weight_values(
+                    t_flat_basis, basis_idxs, local_weight * t_local_mask
+                ),
+                basis_idxs,
+            )
+            t_Mu = torch.sparse.mm(t_Weights, t_Rates) + t_Beta0[None]
+        else:
+            # Add all the basis values for this spot and the local weight of each
+            # local spot, normalize across target spots to get a probability, and
+            # rate for each spot is bleed prob * spot rate plus the global read prob
+            t_Mu = (
+                _CompactBleedMixing.apply(
+                    t_flat_basis, t_basis_idxs, local_weight * t_local_mask, t_Rates
+                )
+                + t_Beta0[None]
+            )
 
         # Calculate the negative log-likelihood of the data
-        L = -torch.stack(
-            [
-                Multinomial(total_count=int(N[i]), probs=t_Mu[:, i]).log_prob(t_Y[i])
-                for i in range(Reads.shape[1])
-            ],
-            dim=0,
-        ).mean()
+        L = -multinomial_log_prob(t_Mu.T, t_Y, t_log_normalizer).mean()
 
         if lam > 0:
             # Apply a fused lasso penalty to enforce piecewise linear curves
@@ -306,22 +1301,255 @@ def fit_basis_functions(
 
         return L
 
-    # Optimize using a 2nd order method with autograd for gradient calculation. Amazing times we live in.
-    res = minimize(
-        loss,
-        x_init,
-        method="L-BFGS-B",
-        backend="torch",
-        options={"maxiter": BASIS_FUNCTION_OPTIMIZATION_MAX_ITERATIONS},
-    )
+    res = _minimize(
+        loss,
+        x_init,
+        optimizer_backend,
+        max_iterations=BASIS_FUNCTION_OPTIMIZATION_MAX_ITERATIONS,
+    )
+
+    basis_functions = basis_functions_from_x(_result_x(res).reshape(basis_shape))
+
+    Weights = weights_from_basis(
+        basis_functions, basis_idxs, None, tissue_mask, local_weight
+    )
+    return basis_functions, Weights, res
+
+
+def _gather_ranges(order, offsets, spots):
+    """
+    Concatenation of order[offsets[i]:offsets[i + 1]] for every i in spots,
+    and the length of each range.
+    """
+    starts = offsets[spots]
+    counts = offsets[spots + 1] - starts
+    ends = np.cumsum(counts)
+    positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(
+        starts - (ends - counts), counts
+    )
+    return order[positions], counts
+
+
+class _TruncatedPairIndex:
+    """
+    The pairs of TruncatedBasisIndices whose source is in the tissue, grouped by target
+    and by source, so that the pairs of a minibatch of target spots are gathered
+    without touching the rest of the slide.
+    """
+
+    def __init__(self, basis_idxs: TruncatedBasisIndices, tissue_mask):
+        self.basis_idxs = basis_idxs
+        in_tissue = np.flatnonzero(tissue_mask[basis_idxs.sources])
+        spots = np.arange(basis_idxs.n_spots + 1)
+
+        # The pairs are sorted by target already
+        self.by_target = in_tissue
+        self.target_offsets = np.searchsorted(basis_idxs.targets[in_tissue], spots)
+        self.by_source = in_tissue[
+            np.argsort(basis_idxs.sources[in_tissue], kind="stable")
+        ]
+        self.source_offsets = np.searchsorted(basis_idxs.sources[self.by_source], spots)
+
+    def batch(self, targets):
+        """
+        :param targets: np.ndarray of target spot indices
+        :return: (pairs, groups, n_groups, selected, rows) where pairs are all pairs
+                 sharing a source with a pair of targets, groups numbers the source of
+                 each of those pairs, selected are the positions in pairs of the pairs of
+                 targets and rows the position in targets of their target.
+        """
+        basis_idxs = self.basis_idxs
+        target_pairs, _ = _gather_ranges(self.by_target, self.target_offsets, targets)
+        batch_sources = np.unique(basis_idxs.sources[target_pairs])
+        pairs, counts = _gather_ranges(
+            self.by_source, self.source_offsets, batch_sources
+        )
+        groups = np.repeat(np.arange(len(batch_sources)), counts)
+
+        order = np.argsort(targets)
+        pair_targets = basis_idxs.targets[pairs]
+        positions = np.searchsorted(targets[order], pair_targets).clip(
+            None, len(targets) - 1
+        )
+        selected = np.flatnonzero(targets[order][positions] == pair_targets)
+        rows = order[positions[selected]]
+        return pairs, groups, len(batch_sources), selected, rows
+
+
+def _expected_rates_batch(
+    flat_basis,
+    pair_index: _TruncatedPairIndex,
+    local_logits,
+    targets,
+    t_Rates,
+    genes,
+):
+    """
+    (Weights @ t_Rates[:, genes])[targets], evaluating only the pairs of targets plus
+    the pairs in the normalizer of each of their sources, so the cost is proportional to
+    the number of targets times the size of the bleed neighborhood.
+
+    :param targets: np.ndarray of target spot indices
+    :param t_Rates: Rates of all spots, torch.Tensor of shape (N, G)
+    :param genes: torch.Tensor of gene indices
+    """
+    basis_idxs = pair_index.basis_idxs
+    pairs, groups, n_groups, selected, rows = pair_index.batch(targets)
+    values = _pair_softmax(
+        _truncated_pair_logits(flat_basis, basis_idxs, local_logits, pairs),
+        torch.as_tensor(groups),
+        n_groups,
+    )
+    sources = torch.as_tensor(basis_idxs.sources[pairs[selected]])
+    return t_Rates.new_zeros((targets.shape[0], genes.shape[0])).index_add(
+        0,
+        torch.as_tensor(rows),
+        values[torch.as_tensor(selected), None]
+        * t_Rates[sources[:, None], genes[None]],
+    )
+
+
+BASIS_FUNCTION_STOCHASTIC_STEPS = 500
+BASIS_FUNCTION_STOCHASTIC_LEARNING_RATE = 0.1
+
+
+def fit_basis_functions_stochastic(
+    Reads,
+    tissue_mask,
+    Rates,
+    global_rates,
+    basis_idxs,
+    local_weight=100,
+    x_init=None,
+    n_steps=BASIS_FUNCTION_STOCHASTIC_STEPS,
+    batch_size=256,
+    gene_batch_size=10,
+    learning_rate=BASIS_FUNCTION_STOCHASTIC_LEARNING_RATE,
+    seed=0,
+):
+    """
+    Fit the bleed basis functions given the current spot rates with Adam, using a random
+    minibatch of target spots and genes for every step.
+
+    Because every column of the weights sums to one, the total expected reads of gene g,
+    sum_i Mu[i, g] = sum_j Rates[j, g] + N * global_rates[g], does not depend on the basis
+    functions. The multinomial log-likelihood of a gene is therefore a plain sum over
+    target spots of Reads[i, g] * log(Mu[i, g] / sum_i Mu[i, g]), which is estimated
+    without bias from a subset of the spots and genes.
+
+    Only the sampled rows of the weights are mixed with the sampled genes, so the cost of
+    a step does not grow with the number of genes, and the weights of the other spots only
+    enter through the softmax normalizer of each source spot.
+
+    The normalizers are evaluated exactly on every step. That requires the distance
+    truncated weights, whose normalizers only sum over the spots within
+    max_bleed_distance: a step gathers the pairs of the sampled targets and the pairs in
+    the normalizers of their sources, so it costs time proportional to batch_size times
+    the size of the bleed neighborhood, independent of the number of spots. With the
+    exact engine every step would build the logits of all N x (in-tissue spots) pairs.
+
+    :param basis_idxs: Output of build_truncated_basis_indices
+    :param x_init: Initial (unconstrained) parameters, e.g. res.x of a previous fit
+    :param n_steps: Number of Adam steps
+    :param batch_size: Number of target spots sampled for each step
+    :param gene_batch_size: Number of genes sampled for each step
+    :param learning_rate: Initial Adam learning rate, decayed linearly to zero over n_steps
+    :param seed: Seed of the minibatch sampling
+    :return: (basis_functions, Weights, optimization result)
+    """
+    if not isinstance(basis_idxs, TruncatedBasisIndices):
+        raise ValueError(
+            "fit_basis_functions_stochastic requires the output of "
+            "build_truncated_basis_indices"
+        )
+
+    n_spots, n_genes = Reads.shape
+    batch_size = min(batch_size, n_spots)
+    gene_batch_size = min(gene_batch_size, n_genes)
+
+    # Only spots in the tissue have a nonzero rate to bleed from
+    pair_index = _TruncatedPairIndex(basis_idxs, tissue_mask)
+
+    basis_shape = basis_idxs.basis_shape
+    t_reverse = torch.LongTensor(np.arange(basis_shape[1])[::-1].copy())
+
+    if x_init is None:
+        x_init = np.full(basis_shape, BASIS_FUNCTION_INITIALIZATION_VALUE)
+    dtype = _optimizer_dtype(x_init)
+
+    t_Y = torch.as_tensor(Reads, dtype=dtype)
+    t_Rates = torch.as_tensor(Rates, dtype=dtype)
+    t_Beta0 = torch.as_tensor(global_rates, dtype=dtype)
+    t_local_logits = local_weight * torch.as_tensor(tissue_mask, dtype=dtype)
+    t_log_totals = torch.log(
+        torch.as_tensor(Rates[tissue_mask].sum(axis=0), dtype=dtype) + n_spots * t_Beta0
+    )
+    sp = Softplus()
+
+    if isinstance(x_init, torch.Tensor):
+        t_x = x_init.detach().clone()
+    else:
+        t_x = torch.as_tensor(np.asarray(x_init), dtype=dtype).clone()
+    t_x = t_x.reshape(basis_shape).requires_grad_(True)
+    optimizer = torch.optim.Adam([t_x], lr=learning_rate)
+    # Decay the learning rate linearly to zero over the step budget
+    scheduler = torch.optim.lr_scheduler.LambdaLR(
+        optimizer, lambda step: 1 - step / n_steps
+    )
+    generator = torch.Generator().manual_seed(seed)
+
+    losses = []
+    for step in range(n_steps):
+        targets = torch.randperm(n_spots, generator=generator)[:batch_size]
+        genes = torch.randperm(n_genes, generator=generator)[:gene_batch_size]
+
+        optimizer.zero_grad()
+        t_Betas = sp(t_x)
+        # Exponentiate and sum each basis element from N down to the current entry j for each j
+        t_Basis = t_Betas[:, t_reverse].cumsum(dim=1)[:, t_reverse]
+        t_flat_basis = torch.cat([t_Basis.reshape(-1), t_Basis.new_zeros(1)])
+
+        t_Mu = (
+            _expected_rates_batch(
+                t_flat_basis,
+                pair_index,
+                t_local_logits,
+                targets.numpy(),
+                t_Rates,
+                genes,
+            )
+            + t_Beta0[genes][None]
+        )
+
+        # Minibatch estimate of the negative log-likelihood, up to the constant term
+        L = (
+            -(t_Y[targets][:, genes] * (torch.log(t_Mu) - t_log_totals[genes][None]))
+            .sum(dim=0)
+            .mean()
+            * n_spots
+            / batch_size
+        )
+
+        # Add a tiny bit of ridge penalty
+        L += 1e-1 * (t_Basis**2).sum()
+
+        L.backward()
+        optimizer.step()
+        scheduler.step()
+        losses.append(L.item())
 
-    optimized_betas = softplus(res.x)
-    basis_functions = optimized_betas.reshape(basis_shape)[:, ::-1].cumsum(axis=1)[
-        :, ::-1
-    ]
+    basis_functions = basis_functions_from_x(t_x.detach().double().numpy())
 
     Weights = weights_from_basis(
-        basis_functions, basis_idxs, basis_mask, tissue_mask, local_weight
+        basis_functions, basis_idxs, None, tissue_mask, local_weight
+    )
+    res = OptimizeResult(
+        x=t_x.detach(),
+        fun=np.mean(losses[-max(1, n_steps // 10) :]),
+        nit=n_steps,
+        nfev=n_steps,
+        success=True,
+        message="Step budget reached",
     )
     return basis_functions, Weights, res
 
@@ -338,17 +1566,45 @@ def rates_from_raw(x, tissue_mask, Reads_shape):
 RATE_INITIALIZATION_FACTOR = 1.1
 
 
-def fit_spot_rates(Reads, tissue_mask, Weights, x_init=None):
-    # Filter down the weights to only the nonzero rates
-    Weights = Weights[:, tissue_mask]
+def fit_spot_rates(
+    Reads,
+    tissue_mask,
+    Weights,
+    x_init=None,
+    optimizer_backend=OptimizerBackend.SCIPY,
+):
+    """
+    Fit the spot rates and global rates given fixed bleed weights.
+
+    :param Weights: N x N bleed weights, either a dense np.ndarray, a scipy sparse
+                    matrix or a scipy LinearOperator such as SeparableBleedWeights
+    :param x_init: Initial (unconstrained) parameters, e.g. res.x of a previous fit
+    :param optimizer_backend: OptimizerBackend used for the fit
+    :return: (global_rates, Rates, optimization result)
+    """
     n_Rates = tissue_mask.sum()
 
-    N = Reads.sum(axis=0)
-    t_Y = torch.Tensor(Reads.T)
+    dtype = _optimizer_dtype(x_init)
+    t_Y = torch.as_tensor(Reads.T, dtype=dtype)
+    t_log_normalizer = multinomial_log_normalizer(t_Y)
     # t_Beta0 = torch.Tensor(global_rates)
-    t_Weights = torch.Tensor(Weights)
     sp = Softplus()
 
+    if isinstance(Weights, np.ndarray):
+        # Filter down the weights to only the nonzero rates
+        t_Weights = torch.as_tensor(Weights[:, tissue_mask], dtype=dtype)
+
+        def mix(t_Rates):
+            return t_Weights @ t_Rates
+
+    else:
+        t_tissue_idxs = torch.as_tensor(np.flatnonzero(tissue_mask))
+
+        def mix(t_Rates):
+            t_all_Rates = t_Rates.new_zeros((Reads.shape[0], t_Rates.shape[1]))
+            t_all_Rates = t_all_Rates.index_put((t_tissue_idxs,), t_Rates)
+            return _LinearOperatorMatmul.apply(t_all_Rates, Weights)
+
     if x_init is None:
         x_init = np.concatenate(
             [
@@ -364,35 +1620,224 @@ def fit_spot_rates(Reads, tissue_mask, Weights, x_init=None):
         t_Beta0 = t_Rates[: Reads.shape[1]]
         t_Rates = t_Rates[Reads.shape[1] :]
         t_Rates = t_Rates.reshape(n_Rates, Reads.shape[1])
-        Mu = (t_Rates[None] * t_Weights[..., None]).sum(dim=1) + t_Beta0[None]
+        Mu = mix(t_Rates) + t_Beta0[None]
         clipped_mu = torch.clip(Mu, 1e-10, None)
         # force clipped_mu to be simplex
         clipped_mu = clipped_mu / clipped_mu.sum(dim=0, keepdim=True)
 
         # Calculate the negative log-likelihood of the data
-        L = -torch.stack(
-            [
-                Multinomial(
-                    total_count=int(N[i]), probs=clipped_mu[:, i], validate_args=False
-                ).log_prob(t_Y[i])
-                for i in range(Reads.shape[1])
-            ],
-            dim=0,
-        ).mean()
+        L = -multinomial_log_prob(clipped_mu.T, t_Y, t_log_normalizer).mean()
 
         # Add a small amount of L2 penalty to reduce variance between spots
         L += 1e-1 * (t_Rates**2).mean()
 
         return L
 
-    # Optimize using a 2nd order method with autograd for gradient calculation. Amazing times we live in.
-    res = minimize(loss, x_init, method="L-BFGS-B", backend="torch")
+    res = _minimize(loss, x_init, optimizer_backend)
 
-    global_rates, Rates = rates_from_raw(res.x, tissue_mask, Reads.shape)
+    global_rates, Rates = rates_from_raw(_result_x(res), tissue_mask, Reads.shape)
 
     return global_rates, Rates, res
 
 
+# Arrays shared with the worker processes of fit_spot_rates_parallel
+def _share_arrays(arrays, shared_memories):
+    """
+    Copy arrays into new shared memory blocks, which are appended to shared_memories
+    so the caller can close and unlink them.
+
+    :param arrays: dict of np.ndarray
+    :return: dict of (shared memory name, shape, dtype) for _attach_shared_arrays
+    """
+    shared_arrays = {}
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        shared_memory = SharedMemory(create=True, size=max(1, array.nbytes))
+        shared_memories.append(shared_memory)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shared_memory.buf)[:] = array
+        shared_arrays[key] = (shared_memory.name, array.shape, array.dtype)
+    return shared_arrays
+
+
+def _attach_shared_arrays(shared_arrays, worker_arrays):
+    for key, (name, shape, dtype) in shared_arrays.items():
+        shared_memory = SharedMemory(name=name)
+        worker_arrays[key + "_shared_memory"] = shared_memory
+        worker_arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shared_memory.buf)
+
+
+_spot_rate_worker_arrays = {}
+
+
+def _init_spot_rate_worker(shared_arrays, Weights, optimizer_backend):
+    # Each worker fits one gene at a time, parallelism comes from the pool
+    torch.set_num_threads(1)
+    _attach_shared_arrays(shared_arrays, _spot_rate_worker_arrays)
+    if Weights is not None:
+        _spot_rate_worker_arrays["Weights"] = Weights
+    _spot_rate_worker_arrays["optimizer_backend"] = optimizer_backend
+
+
+def _fit_spot_rates_worker(g):
+    Reads = _spot_rate_worker_arrays["Reads"]
+    tissue_mask = _spot_rate_worker_arrays["tissue_mask"]
+    global_rates, Rates, _ = fit_spot_rates(
+        Reads[:, g : g + 1],
+        tissue_mask,
+        _spot_rate_worker_arrays["Weights"],
+        optimizer_backend=_spot_rate_worker_arrays["optimizer_backend"],
+    )
+    return global_rates, Rates[tissue_mask, 0]
+
+
+def fit_spot_rates_parallel(
+    Reads,
+    tissue_mask,
+    Weights,
+    n_workers,
+    optimizer_backend=OptimizerBackend.SCIPY,
+):
+    """
+    Run fit_spot_rates for every gene separately, fanned out over a pool of processes.
+
+    The reads, the tissue mask and dense weights are copied once into shared memory
+    which every worker maps, so they are not pickled for each gene. Other weight types
+    are sent once to each worker. Every gene is fit exactly as in the serial loop and
+    results are collected in gene order.
+
+    :param Reads: np.ndarray of shape (N, G)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :param Weights: N x N bleed weights, as for fit_spot_rates
+    :param n_workers: Number of worker processes
+    :param optimizer_backend: OptimizerBackend used for each fit
+    :return: (global_rates, Rates)
+    """
+    arrays = {"Reads": Reads, "tissue_mask": tissue_mask}
+    if isinstance(Weights, np.ndarray):
+        arrays["Weights"] = Weights
+
+    shared_memories = []
+    try:
+        shared_arrays = _share_arrays(arrays, shared_memories)
+
+        Rates = np.zeros(Reads.shape)
+        global_rates = np.zeros(Reads.shape[1])
+        # Spawn rather than fork, forking after torch has started its thread pools is unsafe
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_spot_rate_worker,
+            initargs=(
+                shared_arrays,
+                None if isinstance(Weights, np.ndarray) else Weights,
+                optimizer_backend,
+            ),
+        ) as executor:
+            results = executor.map(
+                _fit_spot_rates_worker,
+                range(Reads.shape[1]),
+                chunksize=max(1, Reads.shape[1] // (4 * n_workers)),
+            )
+            for g, (gene_global_rates, gene_rates) in enumerate(
+                tqdm.tqdm(
+                    results, total=Reads.shape[1], desc="Fitting bleed spot rates"
+                )
+            ):
+                global_rates[g] = gene_global_rates[0]
+                Rates[tissue_mask, g] = gene_rates
+    finally:
+        for shared_memory in shared_memories:
+            shared_memory.close()
+            shared_memory.unlink()
+
+    return global_rates, Rates
+
+
+SPOT_RATE_EM_MAX_ITERATIONS = 5000
+
+
+def fit_spot_rates_em(
+    Reads,
+    tissue_mask,
+    Weights,
+    rel_tol=1e-8,
+    max_iterations=SPOT_RATE_EM_MAX_ITERATIONS,
+    global_rates=None,
+    Rates_init=None,
+):
+    """
+    Fit the spot rates and global rates of all genes at once, given fixed bleed weights.
+
+    The reads of each gene are modeled as Poisson(Weights @ Rates + global_rates), whose
+    maximum likelihood rates are (up to scale) also the maximum likelihood rates of the
+    multinomial model used by fit_spot_rates. The rates are fit with the multiplicative
+    Richardson-Lucy / EM updates
+
+    Rates <- Rates * (Weights.T @ (Reads / Mu)) / (Weights.T @ 1)
+
+    which keep the rates non-negative and never decrease the likelihood.
+
+    :param Reads: np.ndarray of shape (N, G)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :param Weights: N x N bleed weights, either a dense np.ndarray, a scipy sparse
+                    matrix or a scipy LinearOperator such as SeparableBleedWeights
+    :param rel_tol: Stop once the relative improvement in log-likelihood of every gene
+                    is below this value
+    :param max_iterations: Maximum number of updates
+    :param global_rates: np.ndarray of shape (G,), if given the global rates are held
+                         fixed at these values rather than fit
+    :param Rates_init: np.ndarray of shape (N, G), if given the updates start from these
+                       rates, e.g. the Rates of a previous fit, rather than from the reads
+    :return: (global_rates, Rates, number of iterations)
+    """
+    n_spots = Reads.shape[0]
+    dense = isinstance(Weights, np.ndarray)
+
+    if Rates_init is None:
+        Rates_init = (Reads * RATE_INITIALIZATION_FACTOR).clip(1e-2, None)
+    # Rates of spots outside the tissue are zero and stay zero under the updates
+    Rates = Rates_init * tissue_mask[:, None]
+    if dense:
+        # Filter down the weights to only the nonzero rates
+        Weights = Weights[:, tissue_mask]
+        Rates = Rates[tissue_mask]
+    fit_global_rates = global_rates is None
+    if fit_global_rates:
+        global_rates = np.median(Reads, axis=0).astype(float).clip(1e-2, None)
+
+    rate_scale = Weights.T @ np.ones(n_spots)
+    rate_scale[rate_scale == 0] = 1
+
+    log_likelihood = None
+    for iteration in range(1, max_iterations + 1):
+        Mu = (Weights @ Rates + global_rates[None]).clip(1e-10, None)
+        ratio = Reads / Mu
+
+        Rates *= (Weights.T @ ratio) / rate_scale[:, None]
+        if fit_global_rates:
+            global_rates *= ratio.sum(axis=0) / n_spots
+
+        # Poisson log-likelihood of each gene (up to a constant) before this update
+        previous_log_likelihood = log_likelihood
+        log_likelihood = (Reads * np.log(Mu)).sum(axis=0) - Mu.sum(axis=0)
+        if previous_log_likelihood is not None and np.all(
+            np.abs(log_likelihood - previous_log_likelihood)
+            <= rel_tol * np.abs(log_likelihood)
+        ):
+            break
+    else:
+        logger.warning(
+            "Spot rates did not converge after {} iterations".format(max_iterations)
+        )
+
+    if dense:
+        full_Rates = np.zeros(Reads.shape)
+        full_Rates[tissue_mask] = Rates
+        Rates = full_Rates
+
+    return global_rates, Rates, iteration
+
+
 def decontaminate_spots(
     Reads,
     tissue_mask,
@@ -404,8 +1849,47 @@ def decontaminate_spots(
     local_weight=15,
     basis_init=None,
     Rates_init=None,
+    rate_solver=SpotRateSolver.LBFGS,
+    n_workers=1,
+    optimizer_backend=OptimizerBackend.SCIPY,
+    stochastic_basis_fit=False,
+    basis_functions=None,
 ):
+    """
+    Fit the bleed basis functions on the top n_top genes by alternating between
+    fit_basis_functions and fit_spot_rates, then fit the spot rates of every gene.
+
+    :param rate_solver: SpotRateSolver used for the final spot rates of every gene,
+                        see clean_bleed. None skips the final fit and returns the
+                        spot rates of the top n_top genes from the last step, for
+                        callers that only need the basis functions.
+    :param n_workers: Number of processes fitting the final spot rates of each gene
+                      in parallel. SpotRateSolver.EM fits all genes at once, so it
+                      requires n_workers=1.
+    :param optimizer_backend: OptimizerBackend used for the L-BFGS fits. With
+                              OptimizerBackend.TORCH the parameters stay torch tensors
+                              from one EM step to the next.
+    :param stochastic_basis_fit: Fit the basis functions with fit_basis_functions_stochastic
+                                 instead of full batch L-BFGS, requires the output of
+                                 build_truncated_basis_indices as basis_idxs.
+    :param basis_functions: Basis functions used as they are when max_steps is 0,
+                            instead of the ones recovered from basis_init.
+    :return: (global_rates, Rates, basis_functions, Weights, basis_init, Rates_init)
+    """
+    if rate_solver is SpotRateSolver.EM and n_workers > 1:
+        raise ValueError(
+            "n_workers > 1 requires SpotRateSolver.LBFGS, "
+            "SpotRateSolver.EM fits all genes at once"
+        )
+
     logger.info("Calling decontaminate_spots with n_top={}".format(n_top))
+    if basis_mask is not None:
+        basis_idxs = compact_basis_indices(basis_idxs, basis_mask)
+
+    if not isinstance(basis_idxs, (SeparableBasisIndices, TruncatedBasisIndices)):
+        # A single tensor view of the compact basis indices is shared by every EM step
+        basis_idxs = torch.as_tensor(basis_idxs)
+
     # Handle case where n_top is larger than the number of genes in the experiment
     n_top = min(n_top, Reads.shape[1])
 
@@ -426,35 +1910,90 @@ def decontaminate_spots(
             Rates_init, tissue_mask, (Reads.shape[0], n_top)
         )
 
+    if max_steps == 0:
+        if basis_functions is None:
+            if basis_init is None:
+                raise ValueError(
+                    "basis_functions or basis_init is required when max_steps is 0"
+                )
+            if isinstance(basis_init, torch.Tensor):
+                basis_init = basis_init.double().numpy()
+            basis_functions = basis_functions_from_x(
+                np.reshape(basis_init, get_basis_shape(basis_idxs))
+            )
+        Weights = weights_from_basis(
+            basis_functions, basis_idxs, None, tissue_mask, local_weight
+        )
+
     logger.info(f"Fitting basis functions to first {n_top} genes")
     for step in tqdm.trange(max_steps, desc="Fitting bleed correction basis functions"):
-        basis_functions, Weights, res = fit_basis_functions(
-            Reads[:, top_gene_selector],
-            tissue_mask,
-            Rates,
-            global_rates,
-            basis_idxs,
-            basis_mask,
-            lam=0,
-            local_weight=local_weight,
-            x_init=basis_init,
-        )
+        if stochastic_basis_fit:
+            basis_functions, Weights, res = fit_basis_functions_stochastic(
+                Reads[:, top_gene_selector],
+                tissue_mask,
+                Rates,
+                global_rates,
+                basis_idxs,
+                local_weight=local_weight,
+                x_init=basis_init,
+                seed=step,
+            )
+        else:
+            basis_functions, Weights, res = fit_basis_functions(
+                Reads[:, top_gene_selector],
+                tissue_mask,
+                Rates,
+                global_rates,
+                basis_idxs,
+                None,
+                lam=0,
+                local_weight=local_weight,
+                x_init=basis_init,
+                optimizer_backend=optimizer_backend,
+            )
         basis_init = res.x
+        logger.debug(
+            f"Step {step} basis functions: {res.nit} iterations, {res.nfev} evaluations"
+        )
 
         global_rates, Rates, res = fit_spot_rates(
-            Reads[:, top_gene_selector], tissue_mask, Weights, x_init=Rates_init
+            Reads[:, top_gene_selector],
+            tissue_mask,
+            Weights,
+            x_init=Rates_init,
+            optimizer_backend=optimizer_backend,
         )
         Rates_init = res.x
         loss = res.fun
+        logger.debug(
+            f"Step {step} spot rates: {res.nit} iterations, {res.nfev} evaluations"
+        )
 
         logger.debug(f"Step {step} loss: {loss:.2f}")
 
-    Rates = np.zeros(Reads.shape)
-    global_rates = np.zeros(Reads.shape[1])
-    for g in tqdm.trange(Reads.shape[1], desc="Fitting bleed spot rates"):
-        global_rates[g], Rates[:, g : g + 1], res = fit_spot_rates(
-            Reads[:, g : g + 1], tissue_mask, Weights, x_init=None
+    if rate_solver is None:
+        logger.info("Skipping the final spot rate fit of every gene")
+    elif rate_solver is SpotRateSolver.EM:
+        logger.info("Fitting bleed spot rates of all genes")
+        global_rates, Rates, n_iterations = fit_spot_rates_em(
+            Reads, tissue_mask, Weights
         )
+        logger.info(f"Spot rates fit after {n_iterations} iterations")
+    elif n_workers > 1:
+        global_rates, Rates = fit_spot_rates_parallel(
+            Reads, tissue_mask, Weights, n_workers, optimizer_backend=optimizer_backend
+        )
+    else:
+        Rates = np.zeros(Reads.shape)
+        global_rates = np.zeros(Reads.shape[1])
+        for g in tqdm.trange(Reads.shape[1], desc="Fitting bleed spot rates"):
+            global_rates[g], Rates[:, g : g + 1], res = fit_spot_rates(
+                Reads[:, g : g + 1],
+                tissue_mask,
+                Weights,
+                x_init=None,
+                optimizer_backend=optimizer_backend,
+            )
 
     return global_rates, Rates, basis_functions, Weights, basis_init, Rates_init
 
@@ -487,6 +2026,31 @@ def plot_basis_functions(basis_functions, output_dir, output_format="pdf"):
     plt.close()
 
 
+def bleed_vectors(locations, rates, weights):
+    """
+    Mean direction reads bleed into each spot from, weighted by how many reads
+    bleed in from each other spot.
+
+    Vector i is the mean over spots j of
+    (locations[j] - locations[i]) * weights[i, j] * rates[j], computed as
+    weights @ (rates * locations) - (weights @ rates) * locations[i],
+    so that memory is linear in the number of spots.
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param rates: np.ndarray of shape (N,)
+    :param weights: N x N bleed weights, either a dense np.ndarray, a scipy
+                    sparse matrix or a scipy LinearOperator
+    :return: np.ndarray of shape (N, 2), normalized to a maximum absolute
+             value of 1 along each axis
+    """
+    locations = np.asarray(locations, dtype=float)
+    vectors = (
+        np.asarray(weights @ (rates[:, None] * locations))
+        - np.asarray(weights @ rates).reshape(-1, 1) * locations
+    ) / locations.shape[0]
+    return vectors / np.abs(vectors).max(axis=0, keepdims=True)
+
+
 def plot_bleed_vectors(
     stdata: data.SpatialExpressionDataset,
     bleed_result: data.BleedCorrectionResult,
@@ -495,7 +2059,10 @@ def plot_bleed_vectors(
     colormap=cm.Set2_r,
 ):
     gene_idx = np.argwhere(stdata.gene_names == gene_name)[0][0]
-    rates = np.copy(stdata.raw_counts) * stdata.tissue_mask[:, None]
+    gene_counts = stdata.adata.X[:, gene_idx]
+    if sparse.issparse(gene_counts):
+        gene_counts = gene_counts.toarray()
+    rates = np.asarray(gene_counts, dtype=float).reshape(-1) * stdata.tissue_mask
     locations = stdata.positions
 
     fig, ax = plt.subplots()
@@ -528,14 +2095,25 @@ def plot_bleed_vectors(
     plotted_locations = np.row_stack([vcoord_plotted, hcoord_plotted]).T
 
     # Plot the general directionality of where reads come from in each spot
-    contributions = rates[None, :, gene_idx] * bleed_result.weights
-    directions = plotted_locations[None] - plotted_locations[:, None]
-    vectors = (directions * contributions[..., None]).mean(axis=1)
-    vectors = vectors / np.abs(vectors).max(
-        axis=0, keepdims=True
-    )  # Normalize everything to show relative bleed
-    for i, ((y, x), (dy, dx)) in enumerate(zip(plotted_locations, vectors)):
-        ax.arrow(x, y, dx, dy, width=0.05, head_width=0.1, color="black")
+    vectors = bleed_vectors(plotted_locations, rates, load_bleed_weights(bleed_result))
+    ax.quiver(
+        plotted_locations[:, 1],
+        plotted_locations[:, 0],
+        vectors[:, 1],
+        vectors[:, 0],
+        angles="xy",
+        scale_units="xy",
+        scale=1,
+        units="xy",
+        width=0.05,
+        headwidth=2,
+        headlength=3,
+        headaxislength=3,
+        minlength=0,
+        color="black",
+        edgecolor="black",
+        linewidth=1,
+    )
 
     ax.set_axis_off()
 
@@ -554,7 +2132,7 @@ def plot_before_after_cleanup(
     gene_idx_before = np.argwhere(before_correction.gene_names == gene)[0][0]
     gene_idx_after = np.argwhere(after_correction.gene_names == gene)[0][0]
 
-    after_correction_counts = after_correction.raw_counts.copy()
+    after_correction_counts = after_correction.raw_counts.astype(float)
 
     after_correction_counts[~after_correction.tissue_mask] = np.nan
 
@@ -682,11 +2260,641 @@ def plot_bleeding(
     plt.close(fig)
 
 
+def build_bleed_basis_indices(
+    locations,
+    tissue_mask,
+    engine: BleedCorrectionEngine = BleedCorrectionEngine.EXACT,
+    max_bleed_distance: Optional[float] = None,
+):
+    """
+    Build the basis indices for the given engine and (optional) bleed distance truncation.
+
+    :return: Output of build_compact_basis_indices, build_separable_basis_indices
+             or build_truncated_basis_indices
+    """
+    if max_bleed_distance is not None:
+        if engine is not BleedCorrectionEngine.EXACT:
+            raise ValueError(
+                "max_bleed_distance is only supported with the {} engine".format(
+                    BleedCorrectionEngine.EXACT
+                )
+            )
+        return build_truncated_basis_indices(locations, tissue_mask, max_bleed_distance)
+    elif engine is BleedCorrectionEngine.SEPARABLE:
+        return build_separable_basis_indices(locations, tissue_mask)
+    else:
+        return build_compact_basis_indices(locations, tissue_mask)
+
+
+def get_basis_shape(basis_idxs):
+    """
+    :param basis_idxs: Output of build_bleed_basis_indices
+    :return: Shape of the basis functions indexed by basis_idxs
+    """
+    if isinstance(basis_idxs, (SeparableBasisIndices, TruncatedBasisIndices)):
+        return basis_idxs.basis_shape
+    return get_compact_basis_shape(basis_idxs)
+
+
+def downsample_spots(locations, tissue_mask, Reads, factor: int):
+    """
+    Pool the spots in each block of factor x factor grid positions into a single spot.
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :param Reads: np.ndarray of shape (N, G)
+    :param factor: Size of the pooled blocks along each grid axis
+    :return: (coarse_locations, coarse_tissue_mask, coarse_reads), where the reads of a block
+             are summed and a block is in the tissue if at least half of its spots are
+    """
+    blocks = locations // factor
+    coarse_locations, block_idxs = np.unique(blocks, axis=0, return_inverse=True)
+    block_idxs = block_idxs.reshape(-1)
+    n_blocks = coarse_locations.shape[0]
+
+    pooling = sparse.csr_matrix(
+        (np.ones(locations.shape[0]), (block_idxs, np.arange(locations.shape[0]))),
+        shape=(n_blocks, locations.shape[0]),
+    )
+    coarse_reads = pooling @ Reads
+    coarse_tissue_mask = 2 * (pooling @ tissue_mask.astype(float)) >= np.bincount(
+        block_idxs, minlength=n_blocks
+    )
+
+    return coarse_locations, coarse_tissue_mask, coarse_reads
+
+
+def upsample_basis_functions(basis_functions, factor: int, basis_length: int):
+    """
+    Stretch basis functions fit on a grid downsampled by factor back to the original grid,
+    entry k of the upsampled curves is the coarse curves interpolated at k / factor.
+
+    :param basis_functions: np.ndarray of shape (8, L coarse)
+    :param factor: Downsampling factor the basis functions were fit at
+    :param basis_length: Length of the upsampled basis functions
+    :return: np.ndarray of shape (8, basis_length)
+    """
+    coarse_positions = np.arange(basis_functions.shape[1])
+    fine_positions = np.arange(basis_length) / factor
+    return np.stack(
+        [
+            np.interp(fine_positions, coarse_positions, curve)
+            for curve in basis_functions
+        ]
+    )
+
+
+def resize_basis_functions(basis_functions, basis_length: int):
+    """
+    Truncate basis functions to basis_length, or extend them by repeating their last value.
+
+    :param basis_functions: np.ndarray of shape (8, L)
+    :param basis_length: Length of the resized basis functions
+    :return: np.ndarray of shape (8, basis_length)
+    """
+    if basis_length <= basis_functions.shape[1]:
+        return basis_functions[:, :basis_length]
+    return np.pad(
+        basis_functions,
+        ((0, 0), (0, basis_length - basis_functions.shape[1])),
+        mode="edge",
+    )
+
+
+def rebuild_bleed_weights(
+    basis_functions,
+    locations,
+    tissue_mask,
+    local_weight,
+    max_bleed_distance: Optional[float] = None,
+    engine: BleedCorrectionEngine = BleedCorrectionEngine.EXACT,
+):
+    """
+    Recompute the bleed weights of a slide from its fitted basis functions.
+
+    :param basis_functions: np.ndarray of shape (8, L)
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :param local_weight: Weight for the local spot
+    :param max_bleed_distance: Distance (in grid units) the weights were truncated at,
+                               or None if bleeding between all pairs of spots is modeled
+    :param engine: BleedCorrectionEngine the weights were evaluated with
+    :return: np.ndarray of shape (N, N), scipy.sparse.csr_matrix of shape (N, N)
+             if max_bleed_distance is given, or SeparableBleedWeights for the
+             SEPARABLE engine
+    """
+    basis_idxs = build_bleed_basis_indices(
+        locations, tissue_mask, engine, max_bleed_distance
+    )
+    return weights_from_basis(
+        resize_basis_functions(basis_functions, get_basis_shape(basis_idxs)[1]),
+        basis_idxs,
+        None,
+        tissue_mask,
+        local_weight,
+    )
+
+
+def load_bleed_weights(bleed_result: data.BleedCorrectionResult):
+    """
+    Bleed weights of a BleedCorrectionResult, rebuilt from its basis functions and
+    tissue geometry (and kept on the result) if they were not stored with it.
+
+    :param bleed_result: BleedCorrectionResult
+    :return: The weights, in any of the forms returned by rebuild_bleed_weights, or None
+             if the result has neither the weights nor what is needed to rebuild them
+    """
+    if (
+        bleed_result.weights is None
+        and bleed_result.positions is not None
+        and bleed_result.tissue_mask is not None
+        and bleed_result.local_weight is not None
+    ):
+        bleed_result.weights = rebuild_bleed_weights(
+            bleed_result.basis_functions,
+            bleed_result.positions,
+            bleed_result.tissue_mask,
+            bleed_result.local_weight,
+            bleed_result.max_bleed_distance,
+            engine=BleedCorrectionEngine(
+                bleed_result.engine or BleedCorrectionEngine.EXACT
+            ),
+        )
+    return bleed_result.weights
+
+
+def tile_spots(locations, tile_size: int, halo: float):
+    """
+    Split the spots into square tiles of tile_size x tile_size grid positions,
+    each extended by a margin of halo grid positions on every side.
+
+    :param locations: np.ndarray of shape (N, 2)
+    :param tile_size: Size of the tiles along each grid axis
+    :param halo: Width of the margin around each tile
+    :return: List of (spot indices, core mask) tuples, one for each non-empty tile, where
+             core mask marks which of the spots of the tile lie inside it rather than in
+             its margin. Every spot is in the core of exactly one tile.
+    """
+    tile_idxs = locations // tile_size
+    tiles = []
+    for tile_idx in np.unique(tile_idxs, axis=0):
+        start = tile_idx * tile_size
+        in_tile = np.all(
+            (locations >= start - halo) & (locations <= start + tile_size - 1 + halo),
+            axis=1,
+        )
+        spot_idxs = np.flatnonzero(in_tile)
+        core_mask = np.all(tile_idxs[spot_idxs] == tile_idx, axis=1)
+        tiles.append((spot_idxs, core_mask))
+    return tiles
+
+
+TILED_GLOBAL_RATE_MAX_ROUNDS = 50
+TILED_TASKS_PER_WORKER = 2
+
+
+def _fit_tile_spot_rates(state, tile_id, global_rates, return_weights):
+    """
+    Fit the spot rates of one tile with the global rates held fixed.
+
+    The bleed weights of the tile are built the first time it is fit and kept in
+    state, keyed by tile_id, as are its rates, which the next round starts from.
+    """
+    spot_idxs, core_mask = state["tiles"][tile_id]
+    Reads = state["Reads"][spot_idxs]
+    tissue_mask = state["tissue_mask"][spot_idxs]
+
+    Weights = state["weights"].get(tile_id)
+    if Weights is None:
+        basis_idxs = build_truncated_basis_indices(
+            state["locations"][spot_idxs], tissue_mask, state["max_bleed_distance"]
+        )
+        Weights = weights_from_basis(
+            resize_basis_functions(state["basis_functions"], basis_idxs.basis_length),
+            basis_idxs,
+            None,
+            tissue_mask,
+            state["local_weight"],
+        )
+        state["weights"][tile_id] = Weights
+
+    _, Rates, _ = fit_spot_rates_em(
+        Reads,
+        tissue_mask,
+        Weights,
+        global_rates=global_rates,
+        Rates_init=state["rates"].get(tile_id),
+    )
+    state["rates"][tile_id] = Rates
+
+    Weights = Weights[core_mask]
+    Mu = (Weights @ Rates + global_rates[None]).clip(1e-10, None)
+    return (
+        Rates[core_mask],
+        (Reads[core_mask] / Mu).sum(axis=0),
+        Weights if return_weights else None,
+    )
+
+
+_tile_worker_state = {}
+
+
+def _init_tile_worker(
+    shared_arrays, tiles, basis_functions, max_bleed_distance, local_weight
+):
+    # Each worker corrects one tile at a time, parallelism comes from the pool
+    torch.set_num_threads(1)
+    _attach_shared_arrays(shared_arrays, _tile_worker_state)
+    _tile_worker_state.update(
+        tiles=tiles,
+        basis_functions=basis_functions,
+        max_bleed_distance=max_bleed_distance,
+        local_weight=local_weight,
+        weights={},
+        rates={},
+    )
+
+
+def _fit_tile_worker(tile_id, global_rates, return_weights):
+    return _fit_tile_spot_rates(
+        _tile_worker_state, tile_id, global_rates, return_weights
+    )
+
+
+def _iter_results(futures, max_in_flight):
+    """
+    Results of the futures in order, drawing from the (lazy) iterable of futures
+    only while fewer than max_in_flight of them are unfinished or unconsumed.
+    """
+    pending = deque()
+    for future in futures:
+        pending.append(future)
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def fit_spot_rates_tiled(
+    Reads,
+    locations,
+    tissue_mask,
+    basis_functions,
+    max_bleed_distance: float,
+    local_weight,
+    tile_size: int,
+    n_workers: int = 1,
+    rel_tol=1e-4,
+    max_rounds=TILED_GLOBAL_RATE_MAX_ROUNDS,
+):
+    """
+    Fit the spot rates of every gene with fit_spot_rates_em one tile at a time,
+    so that no process holds dense arrays larger than one tile.
+
+    The bleed weights of a spot only involve sources within max_bleed_distance of it,
+    whose weights are normalized over targets within max_bleed_distance of them,
+    so with a margin of twice max_bleed_distance around each tile the weights of the
+    spots in the tile are the same as for the whole slide. Rates of the spots in the
+    margins are discarded, every spot takes its rates from the tile it lies in.
+
+    The global rates are shared by all tiles, so the tiles are fit in rounds with the
+    global rates held fixed, and the global rates are updated between rounds with the
+    EM update of fit_spot_rates_em summed over the whole slide. The (sparse) bleed
+    weights of each tile are built once, and every round starts from the rates the
+    tile reached in the previous round.
+
+    With n_workers > 1 the reads are shared with the workers once, and the tiles are
+    dealt out to the workers round robin, so the weights and rates of each tile are
+    kept by a single process. At most TILED_TASKS_PER_WORKER tiles per worker are
+    queued at any time.
+
+    :param Reads: np.ndarray of shape (N, G)
+    :param locations: np.ndarray of shape (N, 2)
+    :param tissue_mask: np.ndarray of shape (N,)
+    :param basis_functions: np.ndarray of shape (8, L)
+    :param max_bleed_distance: Distance (in grid units) bleeding is modeled over
+    :param local_weight: Weight for the local spot
+    :param tile_size: Size of the tiles along each grid axis
+    :param n_workers: Number of processes correcting tiles in parallel
+    :param rel_tol: Stop once the relative update of every global rate is below
+                    this value
+    :param max_rounds: Maximum number of rounds
+    :return: (global_rates, Rates, Weights), where Weights is the N x N
+             scipy.sparse.csr_matrix of bleed weights stitched from the tiles
+    """
+    n_spots = Reads.shape[0]
+    tiles = tile_spots(locations, tile_size, 2 * max_bleed_distance)
+    logger.info("Fitting bleed spot rates on {} tiles".format(len(tiles)))
+
+    executors = []
+    shared_memories = []
+    try:
+        if n_workers > 1:
+            shared_arrays = _share_arrays(
+                {"Reads": Reads, "locations": locations, "tissue_mask": tissue_mask},
+                shared_memories,
+            )
+            # One single process pool per worker, so every tile is always fit by the
+            # same process. Spawn rather than fork, forking after torch has started
+            # its thread pools is unsafe
+            executors = [
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_tile_worker,
+                    initargs=(
+                        shared_arrays,
+                        tiles,
+                        basis_functions,
+                        max_bleed_distance,
+                        local_weight,
+                    ),
+                )
+                for _ in range(n_workers)
+            ]
+
+            def fit_tiles(global_rates, return_weights):
+                return _iter_results(
+                    (
+                        executors[tile_id % n_workers].submit(
+                            _fit_tile_worker, tile_id, global_rates, return_weights
+                        )
+                        for tile_id in range(len(tiles))
+                    ),
+                    TILED_TASKS_PER_WORKER * n_workers,
+                )
+
+        else:
+            state = dict(
+                Reads=Reads,
+                locations=locations,
+                tissue_mask=tissue_mask,
+                tiles=tiles,
+                basis_functions=basis_functions,
+                max_bleed_distance=max_bleed_distance,
+                local_weight=local_weight,
+                weights={},
+                rates={},
+            )
+
+            def fit_tiles(global_rates, return_weights):
+                return (
+                    _fit_tile_spot_rates(state, tile_id, global_rates, return_weights)
+                    for tile_id in range(len(tiles))
+                )
+
+        Rates = np.zeros(Reads.shape)
+        global_rates = np.median(Reads, axis=0).astype(float).clip(1e-2, None)
+        Weights = None
+        for _ in tqdm.trange(max_rounds, desc="Fitting bleed tiles"):
+            ratio_sum = np.zeros(Reads.shape[1])
+            weights = []
+            for (spot_idxs, core_mask), (
+                tile_rates,
+                tile_ratio_sum,
+                tile_weights,
+            ) in zip(tiles, fit_tiles(global_rates, Weights is None)):
+                Rates[spot_idxs[core_mask]] = tile_rates
+                ratio_sum += tile_ratio_sum
+                if tile_weights is not None:
+                    tile_weights = tile_weights.tocoo()
+                    weights.append(
+                        (
+                            spot_idxs[core_mask][tile_weights.row],
+                            spot_idxs[tile_weights.col],
+                            tile_weights.data,
+                        )
+                    )
+
+            if Weights is None:
+                targets, sources, values = zip(*weights)
+                Weights = sparse.csr_matrix(
+                    (
+                        np.concatenate(values),
+                        (np.concatenate(targets), np.concatenate(sources)),
+                    ),
+                    shape=(n_spots, n_spots),
+                )
+
+            update = ratio_sum / n_spots
+            global_rates = global_rates * update
+            if np.all(np.abs(update - 1) <= rel_tol):
+                break
+        else:
+            logger.warning(
+                "Tiled global rates did not converge after {} rounds".format(max_rounds)
+            )
+    finally:
+        for executor in executors:
+            executor.shutdown()
+        for shared_memory in shared_memories:
+            shared_memory.close()
+            shared_memory.unlink()
+
+    return global_rates, Rates, Weights
+
+
+def corrected_read_counts(fit_rates, read_totals):
+    """
+    Scale the fit rates of each gene to its total number of reads and round them
+    to integer read counts, one chunk of genes at a time, so that only one chunk
+    of the counts is ever held as a dense array.
+
+    :param fit_rates: np.ndarray of shape (N, G)
+    :param read_totals: np.ndarray of shape (G,), total number of reads of each gene
+    :return: scipy.sparse.csc_matrix of shape (N, G)
+    """
+    rate_totals = fit_rates.sum(axis=0)
+    # Genes without any fit rate have no corrected reads
+    rate_totals[rate_totals == 0] = 1
+
+    chunks = []
+    for genes in _iter_feature_chunks(
+        fit_rates.shape[0], fit_rates.shape[1], CORRECTED_READS_CHUNK_SIZE
+    ):
+        chunk = fit_rates[:, genes] / rate_totals[genes]
+        chunk *= read_totals[genes]
+        np.round(chunk, out=chunk)
+        chunks.append(sparse.csc_matrix(chunk.astype(np.int32)))
+    # Stacking column compressed chunks side by side only concatenates them
+    return sparse.hstack(chunks, format="csc")
+
+
+def _clean_bleed_whole_slide(
+    dataset: data.SpatialExpressionDataset,
+    n_top: int,
+    local_weight,
+    max_steps: int,
+    engine: BleedCorrectionEngine,
+    max_bleed_distance: Optional[float],
+    rate_solver: SpotRateSolver,
+    n_workers: int,
+    optimizer_backend: OptimizerBackend,
+    stochastic_basis_fit: bool,
+    coarse_factor: Optional[int],
+    fine_steps: int,
+    basis_functions: Optional[np.ndarray],
+):
+    basis_idxs = build_bleed_basis_indices(
+        dataset.positions, dataset.tissue_mask, engine, max_bleed_distance
+    )
+
+    basis_init = None
+    if basis_functions is not None:
+        basis_functions = resize_basis_functions(
+            basis_functions, get_basis_shape(basis_idxs)[1]
+        )
+        basis_init = basis_functions_to_x(basis_functions)
+    elif coarse_factor is not None:
+        top_genes = utils.get_stddev_ordering(dataset.raw_counts)[:n_top]
+        (
+            coarse_locations,
+            coarse_tissue_mask,
+            coarse_reads,
+        ) = downsample_spots(
+            dataset.positions,
+            dataset.tissue_mask,
+            dataset.raw_counts[:, top_genes],
+            coarse_factor,
+        )
+        logger.info(
+            "Fitting basis functions on {} spots downsampled by {}".format(
+                coarse_locations.shape[0], coarse_factor
+            )
+        )
+        coarse_basis_idxs = build_bleed_basis_indices(
+            coarse_locations,
+            coarse_tissue_mask,
+            engine,
+            None if max_bleed_distance is None else max_bleed_distance / coarse_factor,
+        )
+        _, _, coarse_basis_functions, _, _, _ = decontaminate_spots(
+            coarse_reads,
+            coarse_tissue_mask,
+            coarse_basis_idxs,
+            None,
+            n_top=n_top,
+            max_steps=max_steps,
+            local_weight=local_weight,
+            # Only the basis functions are used
+            rate_solver=None,
+            optimizer_backend=optimizer_backend,
+            stochastic_basis_fit=stochastic_basis_fit,
+        )
+        basis_init = basis_functions_to_x(
+            upsample_basis_functions(
+                coarse_basis_functions,
+                coarse_factor,
+                get_basis_shape(basis_idxs)[1],
+            )
+        )
+        max_steps = fine_steps
+
+    global_rates, fit_rates, basis_functions, weights, _, _ = decontaminate_spots(
+        dataset.raw_counts,
+        dataset.tissue_mask,
+        basis_idxs,
+        None,
+        n_top=n_top,
+        max_steps=max_steps,
+        local_weight=local_weight,
+        rate_solver=rate_solver,
+        n_workers=n_workers,
+        optimizer_backend=optimizer_backend,
+        stochastic_basis_fit=stochastic_basis_fit,
+        basis_init=basis_init,
+        # Without refinement the supplied basis functions are used unchanged
+        basis_functions=basis_functions,
+    )
+
+    return global_rates, fit_rates, basis_functions, weights
+
+
+def _clean_bleed_tiled(
+    dataset: data.SpatialExpressionDataset,
+    n_top: int,
+    local_weight,
+    max_steps: int,
+    engine: BleedCorrectionEngine,
+    max_bleed_distance: float,
+    n_workers: int,
+    optimizer_backend: OptimizerBackend,
+    stochastic_basis_fit: bool,
+    tile_size: int,
+    basis_functions: Optional[np.ndarray],
+):
+    if basis_functions is None or max_steps > 0:
+        # Fit the basis functions on the tile with the most tissue spots
+        # which also has spots outside the tissue
+        tiles = tile_spots(dataset.positions, tile_size, 2 * max_bleed_distance)
+        spot_idxs, _ = max(
+            tiles,
+            key=lambda tile: dataset.tissue_mask[tile[0]].sum()
+            if not dataset.tissue_mask[tile[0]].all()
+            else -1,
+        )
+        logger.info(
+            "Fitting basis functions on a tile of {} spots".format(len(spot_idxs))
+        )
+
+        basis_idxs = build_bleed_basis_indices(
+            dataset.positions[spot_idxs],
+            dataset.tissue_mask[spot_idxs],
+            engine,
+            max_bleed_distance,
+        )
+        basis_init = None
+        if basis_functions is not None:
+            basis_init = basis_functions_to_x(
+                resize_basis_functions(basis_functions, get_basis_shape(basis_idxs)[1])
+            )
+
+        top_genes = utils.get_stddev_ordering(dataset.raw_counts)[:n_top]
+        _, _, basis_functions, _, _, _ = decontaminate_spots(
+            dataset.raw_counts[spot_idxs][:, top_genes],
+            dataset.tissue_mask[spot_idxs],
+            basis_idxs,
+            None,
+            n_top=n_top,
+            max_steps=max_steps,
+            local_weight=local_weight,
+            # Only the basis functions are used, the tiles fit the spot rates
+            rate_solver=None,
+            optimizer_backend=optimizer_backend,
+            stochastic_basis_fit=stochastic_basis_fit,
+            basis_init=basis_init,
+        )
+
+    global_rates, fit_rates, weights = fit_spot_rates_tiled(
+        dataset.raw_counts,
+        dataset.positions,
+        dataset.tissue_mask,
+        basis_functions,
+        max_bleed_distance,
+        local_weight,
+        tile_size,
+        n_workers=n_workers,
+    )
+
+    return global_rates, fit_rates, basis_functions, weights
+
+
 def clean_bleed(
     dataset: data.SpatialExpressionDataset,
     n_top: int,
     local_weight: Optional[int] = None,
     max_steps: int = 5,
+    engine: BleedCorrectionEngine = BleedCorrectionEngine.EXACT,
+    max_bleed_distance: Optional[float] = None,
+    rate_solver: SpotRateSolver = SpotRateSolver.LBFGS,
+    n_workers: int = 1,
+    optimizer_backend: OptimizerBackend = OptimizerBackend.SCIPY,
+    stochastic_basis_fit: bool = False,
+    coarse_factor: Optional[int] = None,
+    fine_steps: int = 1,
+    tile_size: Optional[int] = None,
+    basis_functions: Optional[np.ndarray] = None,
+    refine_steps: int = 0,
 ) -> (data.SpatialExpressionDataset, data.BleedCorrectionResult):
     """
     :param dataset: SpatialExpressionDataset
@@ -694,6 +2902,44 @@ def clean_bleed(
                   Will use the top n genes by standard deviation for building basis functions.
     :param local_weight: Tuning parameter (optional, a reasonable value will be chosen if not provided)
     :param max_steps: Number of Expectation Maximization iterations to use.
+    :param engine: How to evaluate the bleed weights. BleedCorrectionEngine.SEPARABLE never forms
+                   the N x N weight matrix, which makes large arrays feasible.
+    :param max_bleed_distance: Only model bleeding between spots within this distance
+                               (in grid units) of each other, using sparse weights.
+                               By default bleeding between all pairs of spots is modeled.
+    :param rate_solver: How to fit the corrected spot rates of every gene. The default
+                        SpotRateSolver.LBFGS fits each gene separately with the penalized
+                        multinomial model. SpotRateSolver.EM fits all genes at once and is much
+                        faster, but drops the penalty, so its corrected counts differ slightly.
+    :param n_workers: Number of processes to fit genes in parallel with SpotRateSolver.LBFGS,
+                      or tiles in parallel with tile_size. Without tile_size,
+                      SpotRateSolver.EM requires n_workers=1.
+    :param optimizer_backend: OptimizerBackend used for the L-BFGS fits.
+    :param stochastic_basis_fit: Fit the basis functions on random minibatches of spots and genes,
+                                 which makes larger values of n_top affordable. Requires
+                                 max_bleed_distance.
+    :param coarse_factor: If given, first run max_steps EM iterations on a grid downsampled by
+                          this factor (pooling blocks of coarse_factor x coarse_factor spots),
+                          then upsample the basis functions as the warm start for
+                          fine_steps iterations at full resolution.
+    :param fine_steps: Number of full resolution EM iterations when coarse_factor is given,
+                       with 0 the upsampled basis functions are used as they are.
+                       A full resolution iteration costs as much as one without
+                       coarse_factor, so the default of 1 is only about 3x faster than
+                       max_steps full resolution iterations. 0 is an order of magnitude
+                       faster, at a cost in accuracy.
+    :param tile_size: If given, fit the basis functions on a single tile of
+                      tile_size x tile_size grid positions (plus a margin of twice
+                      max_bleed_distance), then fit the spot rates of every gene tile by tile
+                      with SpotRateSolver.EM, in n_workers parallel processes.
+                      This bounds memory by the tile size rather than the slide size,
+                      and requires max_bleed_distance and rate_solver=SpotRateSolver.EM.
+    :param basis_functions: Basis functions to reuse, such as the basis_functions of the
+                            BleedCorrectionResult of a slide from the same chip design and
+                            protocol. They are truncated or extended to the basis length of
+                            this dataset, and max_steps is ignored in favor of refine_steps.
+    :param refine_steps: Number of EM iterations refining the reused basis_functions,
+                         with 0 the spot rates are fit with them as they are.
     :return: Tuple of (SpatialExpressionDataset, BleedCorrectionResult), the SpatialExpressionDataset
              returned will contain the bleed corrected read counts.
     """
@@ -703,24 +2949,60 @@ def clean_bleed(
     if local_weight is None:
         local_weight = get_suggested_initial_local_weight(dataset)
 
-    basis_idxs, basis_mask = build_basis_indices(dataset.positions, dataset.tissue_mask)
-
     n_top = min(n_top, dataset.n_gene)
 
-    global_rates, fit_rates, basis_functions, weights, _, _ = decontaminate_spots(
-        dataset.raw_counts,
-        dataset.tissue_mask,
-        basis_idxs,
-        basis_mask,
-        n_top=n_top,
-        max_steps=max_steps,
-        local_weight=local_weight,
-    )
+    if basis_functions is not None:
+        if coarse_factor is not None:
+            raise ValueError("basis_functions and coarse_factor cannot be combined")
+        logger.info(
+            "Reusing basis functions with {} refinement steps".format(refine_steps)
+        )
+        max_steps = refine_steps
+
+    if stochastic_basis_fit and max_bleed_distance is None:
+        raise ValueError("stochastic_basis_fit requires max_bleed_distance")
+
+    if tile_size is not None:
+        if max_bleed_distance is None:
+            raise ValueError("tile_size requires max_bleed_distance")
+        if rate_solver is not SpotRateSolver.EM:
+            raise ValueError(
+                "tile_size requires rate_solver {}".format(SpotRateSolver.EM)
+            )
+        if coarse_factor is not None:
+            raise ValueError("tile_size and coarse_factor cannot be combined")
+        global_rates, fit_rates, basis_functions, weights = _clean_bleed_tiled(
+            dataset,
+            n_top=n_top,
+            local_weight=local_weight,
+            max_steps=max_steps,
+            engine=engine,
+            max_bleed_distance=max_bleed_distance,
+            n_workers=n_workers,
+            optimizer_backend=optimizer_backend,
+            stochastic_basis_fit=stochastic_basis_fit,
+            tile_size=tile_size,
+            basis_functions=basis_functions,
+        )
+    else:
+        global_rates, fit_rates, basis_functions, weights = _clean_bleed_whole_slide(
+            dataset,
+            n_top=n_top,
+            local_weight=local_weight,
+            max_steps=max_steps,
+            engine=engine,
+            max_bleed_distance=max_bleed_distance,
+            rate_solver=rate_solver,
+            n_workers=n_workers,
+            optimizer_backend=optimizer_backend,
+            stochastic_basis_fit=stochastic_basis_fit,
+            coarse_factor=coarse_factor,
+            fine_steps=fine_steps,
+            basis_functions=basis_functions,
+        )
 
-    corrected_reads = np.round(
-        fit_rates
-        / fit_rates.sum(axis=0, keepdims=True)
-        * dataset.raw_counts.sum(axis=0, keepdims=True)
+    corrected_reads = corrected_read_counts(
+        fit_rates, np.asarray(dataset.adata.X.sum(axis=0)).reshape(-1)
     )
 
     cleaned_dataset = data.SpatialExpressionDataset.from_arrays(
@@ -738,6 +3020,11 @@ def clean_bleed(
         basis_functions=basis_functions,
         weights=weights,
         corrected_reads=corrected_reads,
+        local_weight=local_weight,
+        positions=dataset.positions,
+        tissue_mask=dataset.tissue_mask,
+        max_bleed_distance=max_bleed_distance,
+        engine=engine,
     )
 
     return cleaned_dataset, bleed_correction_result
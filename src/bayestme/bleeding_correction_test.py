@@ -3,12 +3,56 @@ import shutil
 import tempfile
 
 import numpy as np
+import pytest
 
 import bayestme.common
 import bayestme.synthetic_data
 from bayestme import bleeding_correction, data, utils
 
 
+def build_basis_indices_reference(locations, tissue_mask):
+    """
+    Straightforward per-spot implementation of build_basis_indices,
+    used to check the vectorized implementation.
+    """
+    pairwise_coordinate_differences = (
+        bleeding_correction.calculate_pairwise_coordinate_differences(locations)
+    )
+
+    basis_idxs = np.zeros((locations.shape[0], locations.shape[0], 8), dtype=int)
+    basis_mask = np.zeros((locations.shape[0], locations.shape[0], 8), dtype=bool)
+
+    tissue_grid = bleeding_correction.tissue_mask_to_grid(tissue_mask, locations)
+
+    for i, location in enumerate(locations):
+        for j in range(locations.shape[0]):
+            d_row, d_col = pairwise_coordinate_differences[i, j]
+            if d_row >= 0:
+                n_tissue = tissue_grid[location[0] : location[0] + d_row, location[1]]
+                basis_idxs[i, j, 4] = n_tissue.sum()
+                basis_idxs[i, j, 0] = d_row - basis_idxs[i, j, 4]
+                basis_mask[i, j, [0, 4]] = True
+            else:
+                n_tissue = tissue_grid[location[0] + d_row : location[0], location[1]]
+                basis_idxs[i, j, 5] = n_tissue.sum()
+                basis_idxs[i, j, 1] = -d_row - basis_idxs[i, j, 5]
+                basis_mask[i, j, [1, 5]] = True
+            if d_col >= 0:
+                n_tissue = tissue_grid[location[0], location[1] : location[1] + d_col]
+                basis_idxs[i, j, 6] = n_tissue.sum()
+                basis_idxs[i, j, 2] = d_col - basis_idxs[i, j, 6]
+                basis_mask[i, j, [2, 6]] = True
+            else:
+                n_tissue = tissue_grid[location[0], location[1] + d_col : location[1]]
+                basis_idxs[i, j, 7] = n_tissue.sum()
+                basis_idxs[i, j, 3] = -d_col - basis_idxs[i, j, 7]
+                basis_mask[i, j, [3, 7]] = True
+
+        basis_mask[i, i] = False
+
+    return basis_idxs, basis_mask
+
+
 def test_calculate_pairwise_coordinate_differences():
     result = bleeding_correction.calculate_pairwise_coordinate_differences(
         np.array([[0, 0], [1, 1], [2, 2]])
@@ -73,6 +117,323 @@ def test_build_basis_indices():
     np.testing.assert_equal(basis_mask_observed, basis_mask_expected)
 
 
+def test_build_basis_indices_matches_reference():
+    np.random.seed(100)
+    for n_rows, n_cols in [(5, 5), (9, 7), (12, 16)]:
+        (
+            locations,
+            tissue_mask,
+            true_rates,
+            true_counts,
+            bleed_counts,
+        ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+            n_rows=n_rows, n_cols=n_cols, n_genes=1
+        )
+
+        # Also check an irregular tissue region with missing spots
+        random_mask = np.random.random(tissue_mask.shape[0]) < 0.5
+        keep = np.random.random(tissue_mask.shape[0]) < 0.8
+
+        for observed_locations, observed_tissue_mask in [
+            (locations, tissue_mask),
+            (locations[keep], random_mask[keep]),
+        ]:
+            basis_idxs, basis_mask = bleeding_correction.build_basis_indices(
+                observed_locations, observed_tissue_mask
+            )
+            expected_idxs, expected_mask = build_basis_indices_reference(
+                observed_locations, observed_tissue_mask
+            )
+
+            np.testing.assert_equal(basis_idxs, expected_idxs)
+            np.testing.assert_equal(basis_mask, expected_mask)
+
+
+def test_build_compact_basis_indices():
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=9, n_cols=7, n_genes=1
+    )
+    keep = np.random.random(tissue_mask.shape[0]) < 0.8
+
+    for observed_locations, observed_tissue_mask in [
+        (locations, tissue_mask),
+        (locations[keep], np.random.random(keep.sum()) < 0.5),
+    ]:
+        basis_idxs, basis_mask = bleeding_correction.build_basis_indices(
+            observed_locations, observed_tissue_mask
+        )
+        compact_idxs = bleeding_correction.build_compact_basis_indices(
+            observed_locations, observed_tissue_mask
+        )
+
+        assert compact_idxs.dtype == np.uint8
+        assert bleeding_correction.get_compact_basis_shape(compact_idxs) == (
+            8,
+            basis_idxs.max() + 1,
+        )
+        np.testing.assert_equal(
+            compact_idxs,
+            bleeding_correction.compact_basis_indices(basis_idxs, basis_mask),
+        )
+
+        basis_functions = np.random.random((8, basis_idxs.max() + 1))
+        np.testing.assert_equal(
+            bleeding_correction.weights_from_basis(
+                basis_functions,
+                compact_idxs,
+                None,
+                observed_tissue_mask,
+                local_weight=5,
+            ),
+            bleeding_correction.weights_from_basis(
+                basis_functions,
+                basis_idxs,
+                basis_mask,
+                observed_tissue_mask,
+                local_weight=5,
+            ),
+        )
+
+    # Each channel only indexes its own pair of basis functions, so the indices of
+    # grids up to 127 spots across fit in uint8
+    line_idxs = bleeding_correction.build_compact_basis_indices(
+        np.stack([np.zeros(120, dtype=int), np.arange(120)], axis=1),
+        np.arange(120) % 3 == 0,
+    )
+    assert line_idxs.dtype == np.uint8
+    assert bleeding_correction.get_compact_basis_shape(line_idxs)[1] >= 32
+
+
+def test_compact_bleed_mixing_gradient():
+    import torch
+
+    locations = np.array([[0, 0], [0, 1], [1, 3], [2, 1], [3, 3]])
+    tissue_mask = np.array([False, True, True, False, True])
+    basis_idxs, basis_mask = bleeding_correction.build_basis_indices(
+        locations, tissue_mask
+    )
+    compact_idxs = torch.as_tensor(
+        bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+    )
+    basis_shape = bleeding_correction.get_compact_basis_shape(compact_idxs)
+    basis = torch.rand(basis_shape, dtype=torch.float64, requires_grad=True)
+    local_logits = 3.0 * torch.as_tensor(tissue_mask, dtype=torch.float64)
+    local_logits.requires_grad_(True)
+    rates = torch.rand((5, 2), dtype=torch.float64, requires_grad=True)
+
+    def mixing(b, local_logits, rates):
+        return bleeding_correction._CompactBleedMixing.apply(
+            torch.cat([b.reshape(-1), b.new_zeros(1)]),
+            compact_idxs,
+            local_logits,
+            rates,
+        )
+
+    W = sum(
+        basis[d, basis_idxs[:, :, d]] * torch.as_tensor(basis_mask[:, :, d])
+        for d in range(8)
+    )
+    expected = torch.softmax(W + torch.diag(local_logits), dim=0) @ rates
+    torch.testing.assert_close(mixing(basis, local_logits, rates), expected)
+
+    assert torch.autograd.gradcheck(mixing, (basis, local_logits, rates))
+
+
+def test_separable_bleed_weights():
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=9, n_cols=7, n_genes=1
+    )
+    keep = np.random.random(tissue_mask.shape[0]) < 0.8
+
+    for observed_locations, observed_tissue_mask in [
+        (locations, tissue_mask),
+        (locations[keep], np.random.random(keep.sum()) < 0.5),
+    ]:
+        compact_idxs = bleeding_correction.build_compact_basis_indices(
+            observed_locations, observed_tissue_mask
+        )
+        separable_idxs = bleeding_correction.build_separable_basis_indices(
+            observed_locations, observed_tissue_mask
+        )
+        assert separable_idxs.basis_shape == (
+            bleeding_correction.get_compact_basis_shape(compact_idxs)
+        )
+
+        basis_functions = np.random.random(separable_idxs.basis_shape)
+        expected = bleeding_correction.weights_from_basis(
+            basis_functions, compact_idxs, None, observed_tissue_mask, local_weight=5
+        )
+        weights = bleeding_correction.weights_from_basis(
+            basis_functions, separable_idxs, None, observed_tissue_mask, local_weight=5
+        )
+
+        np.testing.assert_allclose(weights.toarray(), expected, rtol=1e-10)
+        X = np.random.random((observed_tissue_mask.shape[0], 3))
+        np.testing.assert_allclose(weights @ X, expected @ X, rtol=1e-10)
+        np.testing.assert_allclose(weights.T @ X, expected.T @ X, rtol=1e-10)
+
+
+def test_separable_mixing_gradient():
+    import torch
+
+    locations = np.array([[0, 0], [0, 1], [1, 3], [2, 1], [3, 3], [2, 2]])
+    tissue_mask = np.array([False, True, True, False, True, True])
+    compact_idxs = torch.as_tensor(
+        bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+    )
+    separable_idxs = bleeding_correction.build_separable_basis_indices(
+        locations, tissue_mask
+    )
+    local_logits = 3.0 * torch.as_tensor(tissue_mask, dtype=torch.float64)
+    rates = torch.rand((6, 2), dtype=torch.float64)
+
+    def exact(b):
+        return bleeding_correction._CompactBleedMixing.apply(
+            torch.cat([b.reshape(-1), b.new_zeros(1)]),
+            compact_idxs,
+            local_logits,
+            rates,
+        )
+
+    def separable(b):
+        factors = bleeding_correction._separable_factors(
+            torch.cat([b.reshape(-1), b.new_zeros(1)]), separable_idxs, local_logits
+        )
+        return bleeding_correction._separable_matmul(factors, separable_idxs, rates)
+
+    basis = torch.rand(
+        separable_idxs.basis_shape, dtype=torch.float64, requires_grad=True
+    )
+    torch.testing.assert_close(separable(basis), exact(basis))
+    assert torch.autograd.gradcheck(separable, (basis,))
+
+
+def test_separable_mixing_chunked():
+    import torch
+    from unittest import mock
+
+    locations = np.array([[0, 0], [0, 1], [1, 3], [2, 1], [3, 3], [2, 2]])
+    tissue_mask = np.array([False, True, True, False, True, True])
+    separable_idxs = bleeding_correction.build_separable_basis_indices(
+        locations, tissue_mask
+    )
+    local_logits = 3.0 * torch.as_tensor(tissue_mask, dtype=torch.float64)
+    basis = torch.rand(separable_idxs.basis_shape, dtype=torch.float64)
+    factors = bleeding_correction._separable_factors(
+        torch.cat([basis.reshape(-1), basis.new_zeros(1)]),
+        separable_idxs,
+        local_logits,
+    )
+    rates = torch.rand((6, 5), dtype=torch.float64, requires_grad=True)
+    expected = bleeding_correction._separable_matmul(factors, separable_idxs, rates)
+    expected_transpose = bleeding_correction._separable_rmatmul(
+        factors, separable_idxs, rates
+    )
+
+    # Force one column of rates per chunk
+    with mock.patch.object(bleeding_correction, "MIXING_CHUNK_SIZE", 1):
+        mixed = bleeding_correction._separable_matmul(factors, separable_idxs, rates)
+        torch.testing.assert_close(mixed, expected)
+        torch.testing.assert_close(
+            bleeding_correction._separable_rmatmul(factors, separable_idxs, rates),
+            expected_transpose,
+        )
+        assert torch.autograd.gradcheck(
+            lambda r: bleeding_correction._separable_matmul(factors, separable_idxs, r),
+            (rates,),
+        )
+
+
+def test_truncated_bleed_weights():
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=9, n_cols=7, n_genes=1
+    )
+    compact_idxs = bleeding_correction.build_compact_basis_indices(
+        locations, tissue_mask
+    )
+    basis_functions = np.random.random(
+        bleeding_correction.get_compact_basis_shape(compact_idxs)
+    )
+    expected = bleeding_correction.weights_from_basis(
+        basis_functions, compact_idxs, None, tissue_mask, local_weight=5
+    )
+
+    # A radius covering the whole grid is the exact model
+    truncated_idxs = bleeding_correction.build_truncated_basis_indices(
+        locations, tissue_mask, max_bleed_distance=100
+    )
+    assert truncated_idxs.n_pairs == locations.shape[0] ** 2
+    assert truncated_idxs.basis_shape == basis_functions.shape
+    weights = bleeding_correction.weights_from_basis(
+        basis_functions, truncated_idxs, None, tissue_mask, local_weight=5
+    )
+    np.testing.assert_allclose(weights.toarray(), expected, rtol=1e-10)
+
+    # Otherwise the exact weights are renormalized over the truncated support
+    truncated_idxs = bleeding_correction.build_truncated_basis_indices(
+        locations, tissue_mask, max_bleed_distance=2
+    )
+    weights = bleeding_correction.weights_from_basis(
+        basis_functions[:, : truncated_idxs.basis_length],
+        truncated_idxs,
+        None,
+        tissue_mask,
+        local_weight=5,
+    ).toarray()
+    distances = np.linalg.norm(locations[:, None] - locations[None], axis=-1)
+    support = distances <= 2
+    np.testing.assert_equal(weights != 0, support)
+    np.testing.assert_allclose(
+        weights,
+        expected * support / (expected * support).sum(axis=0, keepdims=True),
+        rtol=1e-10,
+    )
+
+
+def test_truncated_mixing_gradient():
+    import torch
+
+    locations = np.array([[0, 0], [0, 1], [1, 3], [2, 1], [3, 3], [2, 2]])
+    tissue_mask = np.array([False, True, True, False, True, True])
+    basis_idxs = bleeding_correction.build_truncated_basis_indices(
+        locations, tissue_mask, max_bleed_distance=1.5
+    )
+    local_logits = 3.0 * torch.as_tensor(tissue_mask, dtype=torch.float64)
+    rates = torch.rand((6, 2), dtype=torch.float64)
+
+    def mix(b):
+        values = bleeding_correction._truncated_weight_values(
+            torch.cat([b.reshape(-1), b.new_zeros(1)]), basis_idxs, local_logits
+        )
+        return torch.sparse.mm(
+            bleeding_correction._truncated_weights(values, basis_idxs), rates
+        )
+
+    basis = torch.rand(basis_idxs.basis_shape, dtype=torch.float64, requires_grad=True)
+    assert torch.autograd.gradcheck(mix, (basis,))
+
+
 def test_decontaminate_spots():
     np.random.seed(100)
 
@@ -106,6 +467,35 @@ def test_decontaminate_spots():
         n_top=1,
     )
 
+    (global_rates, rates, *_) = bleeding_correction.decontaminate_spots(
+        Reads=bleed_counts,
+        tissue_mask=tissue_mask,
+        basis_idxs=basis_idx,
+        basis_mask=basis_mask,
+        n_top=1,
+        max_steps=1,
+        rate_solver=bleeding_correction.SpotRateSolver.LBFGS,
+    )
+    assert rates.shape == bleed_counts.shape
+
+    # Without the final fit only the rates of the top genes are returned
+    (
+        global_rates,
+        rates,
+        basis_functions,
+        *_,
+    ) = bleeding_correction.decontaminate_spots(
+        Reads=bleed_counts,
+        tissue_mask=tissue_mask,
+        basis_idxs=basis_idx,
+        basis_mask=basis_mask,
+        n_top=1,
+        max_steps=1,
+        rate_solver=None,
+    )
+    assert rates.shape == (bleed_counts.shape[0], 1)
+    assert global_rates.shape == (1,)
+
 
 def test_fit_basis_functions():
     np.random.seed(100)
@@ -134,6 +524,517 @@ def test_fit_basis_functions():
     )
 
 
+def test_fit_spot_rates_em():
+    import torch
+
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=12, n_cols=12, n_genes=3
+    )
+    basis_idxs = bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+    basis_length = bleeding_correction.get_compact_basis_shape(basis_idxs)[1]
+    basis_functions = -np.linspace(0.5, 3, basis_length)[None].repeat(8, 0)
+    weights = bleeding_correction.weights_from_basis(
+        basis_functions, basis_idxs, None, tissue_mask, local_weight=15
+    )
+
+    global_rates, rates, n_iterations = bleeding_correction.fit_spot_rates_em(
+        bleed_counts, tissue_mask, weights
+    )
+    assert rates.shape == bleed_counts.shape
+    assert np.all(rates[~tissue_mask] == 0)
+
+    lbfgs_rates = np.zeros(bleed_counts.shape)
+    lbfgs_global_rates = np.zeros(bleed_counts.shape[1])
+    for g in range(bleed_counts.shape[1]):
+        (
+            lbfgs_global_rates[g],
+            lbfgs_rates[:, g : g + 1],
+            _,
+        ) = bleeding_correction.fit_spot_rates(
+            bleed_counts[:, g : g + 1], tissue_mask, weights
+        )
+
+    # The multiplicative updates reach at least the likelihood of the L-BFGS fit
+    t_Y = torch.tensor(bleed_counts.T, dtype=torch.float64)
+
+    def log_likelihood(global_rates, rates):
+        return bleeding_correction.multinomial_log_prob(
+            torch.tensor((weights @ rates + global_rates[None]).T),
+            t_Y,
+            bleeding_correction.multinomial_log_normalizer(t_Y),
+        ).numpy()
+
+    assert np.all(
+        log_likelihood(global_rates, rates)
+        >= log_likelihood(lbfgs_global_rates, lbfgs_rates) - 1e-2
+    )
+    for g in range(bleed_counts.shape[1]):
+        assert (
+            np.corrcoef(rates[tissue_mask, g], lbfgs_rates[tissue_mask, g])[0, 1] > 0.95
+        )
+
+    # Weights given as an operator give the same fit
+    separable_weights = bleeding_correction.weights_from_basis(
+        basis_functions,
+        bleeding_correction.build_separable_basis_indices(locations, tissue_mask),
+        None,
+        tissue_mask,
+        local_weight=15,
+    )
+    separable_global_rates, separable_rates, _ = bleeding_correction.fit_spot_rates_em(
+        bleed_counts, tissue_mask, separable_weights
+    )
+    np.testing.assert_allclose(separable_rates, rates, rtol=1e-6, atol=1e-8)
+    np.testing.assert_allclose(separable_global_rates, global_rates, rtol=1e-6)
+
+
+def test_fit_spot_rates_parallel():
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=6, n_cols=6, n_genes=3
+    )
+    basis_idxs = bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+    weights = bleeding_correction.weights_from_basis(
+        np.full(bleeding_correction.get_compact_basis_shape(basis_idxs), -1.0),
+        basis_idxs,
+        None,
+        tissue_mask,
+        local_weight=15,
+    )
+
+    global_rates, rates = bleeding_correction.fit_spot_rates_parallel(
+        bleed_counts, tissue_mask, weights, n_workers=2
+    )
+
+    for g in range(bleed_counts.shape[1]):
+        expected_global_rates, expected_rates, _ = bleeding_correction.fit_spot_rates(
+            bleed_counts[:, g : g + 1], tissue_mask, weights
+        )
+        assert global_rates[g] == expected_global_rates[0]
+        np.testing.assert_equal(rates[:, g], expected_rates[:, 0])
+
+
+def test_minimize_torch():
+    import torch
+
+    target = torch.tensor([1.0, -2.0, 3.0], dtype=torch.float64)
+
+    res = bleeding_correction.minimize_torch(
+        lambda x: ((x - target) ** 2).sum(), np.zeros(3)
+    )
+    assert res.x.dtype == torch.float32
+    torch.testing.assert_close(res.x, target.float())
+    assert res.success
+    assert res.nit > 0
+    assert res.nfev >= res.nit
+
+    # Tensor initial values keep their dtype
+    res = bleeding_correction.minimize_torch(
+        lambda x: ((x - target) ** 2).sum(), torch.zeros(3, dtype=torch.float64)
+    )
+    assert res.x.dtype == torch.float64
+    torch.testing.assert_close(res.x, target)
+
+
+def test_fit_basis_functions_torch_backend():
+    import torch
+
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=9, n_cols=9, n_genes=2
+    )
+    basis_idxs = bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+    rates = bleed_counts * tissue_mask[:, None] * 1.1
+    global_rates = np.median(bleed_counts, axis=0)
+
+    basis_functions, weights, res = bleeding_correction.fit_basis_functions(
+        bleed_counts,
+        tissue_mask,
+        rates,
+        global_rates,
+        basis_idxs,
+        None,
+        optimizer_backend=bleeding_correction.OptimizerBackend.TORCH,
+    )
+    assert isinstance(res.x, torch.Tensor)
+    assert res.nit > 0 and res.nfev > 0
+    assert basis_functions.shape == bleeding_correction.get_compact_basis_shape(
+        basis_idxs
+    )
+
+    global_rates, rates, res = bleeding_correction.fit_spot_rates(
+        bleed_counts,
+        tissue_mask,
+        weights,
+        x_init=torch.as_tensor(np.zeros(2 + 2 * tissue_mask.sum())),
+        optimizer_backend=bleeding_correction.OptimizerBackend.TORCH,
+    )
+    assert res.x.dtype == torch.float64
+    assert rates.shape == bleed_counts.shape
+
+
+def test_expected_rates_batch():
+    import torch
+
+    np.random.seed(100)
+    locations = np.array([[0, 0], [0, 1], [1, 3], [2, 1], [3, 3], [2, 2], [1, 1]])
+    tissue_mask = np.array([False, True, True, False, True, True, True])
+    rates = np.random.random((7, 3)) * tissue_mask[:, None]
+    genes = torch.tensor([2, 0])
+    local_logits = 3.0 * torch.as_tensor(tissue_mask, dtype=torch.float64)
+
+    for max_bleed_distance in [1.5, 2, 5]:
+        basis_idxs = bleeding_correction.build_truncated_basis_indices(
+            locations, tissue_mask, max_bleed_distance=max_bleed_distance
+        )
+        pair_index = bleeding_correction._TruncatedPairIndex(basis_idxs, tissue_mask)
+        basis_functions = np.random.random(basis_idxs.basis_shape)
+        weights = bleeding_correction.weights_from_basis(
+            basis_functions, basis_idxs, None, tissue_mask, local_weight=3
+        ).toarray()
+
+        for targets in [np.array([5, 0, 3]), np.array([6]), np.arange(7)[::-1]]:
+            np.testing.assert_allclose(
+                bleeding_correction._expected_rates_batch(
+                    torch.as_tensor(np.append(basis_functions.reshape(-1), 0)),
+                    pair_index,
+                    local_logits,
+                    targets,
+                    torch.as_tensor(rates),
+                    genes,
+                ).numpy(),
+                (weights @ rates[:, genes.numpy()])[targets],
+                rtol=1e-10,
+            )
+
+
+def test_fit_basis_functions_stochastic():
+    import torch
+
+    np.random.seed(1)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=12, n_cols=12, n_genes=6, bleeding="anisotropic"
+    )
+    rates = true_rates.astype(float)
+    global_rates = np.median(bleed_counts, axis=0).clip(1e-2, None)
+    t_Y = torch.tensor(bleed_counts.T, dtype=torch.float64)
+
+    def negative_log_likelihood(weights):
+        return -bleeding_correction.multinomial_log_prob(
+            torch.tensor((weights @ rates + global_rates[None]).T),
+            t_Y,
+            bleeding_correction.multinomial_log_normalizer(t_Y),
+        ).mean()
+
+    for max_bleed_distance in [3, 6]:
+        basis_idxs = bleeding_correction.build_truncated_basis_indices(
+            locations, tissue_mask, max_bleed_distance
+        )
+        _, weights, _ = bleeding_correction.fit_basis_functions(
+            bleed_counts, tissue_mask, rates, global_rates, basis_idxs, None
+        )
+        (
+            basis_functions,
+            stochastic_weights,
+            res,
+        ) = bleeding_correction.fit_basis_functions_stochastic(
+            bleed_counts,
+            tissue_mask,
+            rates,
+            global_rates,
+            basis_idxs,
+            n_steps=300,
+            batch_size=64,
+            gene_batch_size=3,
+        )
+        assert res.nit == 300
+        weights = weights.toarray()
+        stochastic_weights = stochastic_weights.toarray()
+
+        # The minibatch fit reaches nearly the likelihood of the full batch fit
+        assert negative_log_likelihood(stochastic_weights) < 1.02 * (
+            negative_log_likelihood(weights)
+        )
+        mixed = weights @ rates
+        assert (
+            np.abs(stochastic_weights @ rates - mixed).sum() < 0.1 * np.abs(mixed).sum()
+        )
+
+    # The normalizers of the exact weights cost N x (in-tissue spots) on every step
+    with pytest.raises(ValueError):
+        bleeding_correction.fit_basis_functions_stochastic(
+            bleed_counts,
+            tissue_mask,
+            rates,
+            global_rates,
+            bleeding_correction.build_compact_basis_indices(locations, tissue_mask),
+        )
+
+
+def test_downsample_spots():
+    locations = np.array([[0, 0], [0, 1], [1, 0], [1, 1], [2, 0], [3, 3]])
+    tissue_mask = np.array([True, True, True, False, False, True])
+    reads = np.arange(12).reshape(6, 2)
+
+    (
+        coarse_locations,
+        coarse_tissue_mask,
+        coarse_reads,
+    ) = bleeding_correction.downsample_spots(locations, tissue_mask, reads, 2)
+
+    np.testing.assert_equal(coarse_locations, np.array([[0, 0], [1, 0], [1, 1]]))
+    np.testing.assert_equal(coarse_tissue_mask, np.array([True, False, True]))
+    np.testing.assert_equal(coarse_reads, np.array([[12, 16], [8, 9], [10, 11]]))
+
+
+def test_basis_functions_to_x():
+    basis_functions = np.sort(np.random.random((8, 6)), axis=1)[:, ::-1] + 0.1
+    x = bleeding_correction.basis_functions_to_x(basis_functions)
+    np.testing.assert_allclose(
+        bleeding_correction.basis_functions_from_x(x), basis_functions, rtol=1e-6
+    )
+
+    upsampled = bleeding_correction.upsample_basis_functions(basis_functions, 2, 11)
+    np.testing.assert_allclose(upsampled[:, ::2], basis_functions)
+    np.testing.assert_allclose(
+        upsampled[:, 1::2], (basis_functions[:, :-1] + basis_functions[:, 1:]) / 2
+    )
+
+
+def test_tile_spots():
+    locations = np.array([(i, j) for i in range(10) for j in range(7)])
+    tiles = bleeding_correction.tile_spots(locations, tile_size=4, halo=1.5)
+
+    assert len(tiles) == 3 * 2
+    core_counts = np.zeros(locations.shape[0], dtype=int)
+    for spot_idxs, core_mask in tiles:
+        core_counts[spot_idxs[core_mask]] += 1
+        core = locations[spot_idxs[core_mask]]
+        # The tile holds exactly the spots within the halo of its core
+        in_margin = np.all(
+            (locations >= core.min(axis=0) - 1.5)
+            & (locations <= core.max(axis=0) + 1.5),
+            axis=1,
+        )
+        np.testing.assert_equal(np.flatnonzero(in_margin), spot_idxs)
+    np.testing.assert_equal(core_counts, 1)
+
+
+def test_fit_spot_rates_tiled():
+    from unittest import mock
+
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=16, n_cols=16, n_genes=3
+    )
+    basis_idxs = bleeding_correction.build_truncated_basis_indices(
+        locations, tissue_mask, max_bleed_distance=2
+    )
+    basis_functions = -np.linspace(0.5, 3, basis_idxs.basis_length)[None].repeat(8, 0)
+    weights = bleeding_correction.weights_from_basis(
+        basis_functions, basis_idxs, None, tissue_mask, local_weight=15
+    )
+    global_rates, rates, _ = bleeding_correction.fit_spot_rates_em(
+        bleed_counts, tissue_mask, weights
+    )
+
+    with mock.patch.object(
+        bleeding_correction,
+        "weights_from_basis",
+        wraps=bleeding_correction.weights_from_basis,
+    ) as build_weights, mock.patch.object(
+        bleeding_correction,
+        "fit_spot_rates_em",
+        wraps=bleeding_correction.fit_spot_rates_em,
+    ) as fit_em:
+        (
+            tiled_global_rates,
+            tiled_rates,
+            tiled_weights,
+        ) = bleeding_correction.fit_spot_rates_tiled(
+            bleed_counts,
+            locations,
+            tissue_mask,
+            basis_functions,
+            max_bleed_distance=2,
+            local_weight=15,
+            tile_size=6,
+        )
+
+    # The weights of each tile are built once, and every later round
+    # starts from the rates of the previous one
+    n_tiles = len(bleeding_correction.tile_spots(locations, 6, 4))
+    assert build_weights.call_count == n_tiles
+    assert fit_em.call_count > n_tiles
+    for i, call in enumerate(fit_em.call_args_list):
+        assert (call.kwargs["Rates_init"] is None) == (i < n_tiles)
+
+    # With margins of twice the bleed distance the stitched weights are exact
+    np.testing.assert_allclose(tiled_weights.toarray(), weights.toarray(), atol=1e-12)
+    assert np.all(tiled_rates[~tissue_mask] == 0)
+    assert np.abs(tiled_rates - rates).sum() / np.abs(rates).sum() < 1e-3
+    np.testing.assert_allclose(tiled_global_rates, global_rates, rtol=1e-2)
+
+    _, parallel_rates, _ = bleeding_correction.fit_spot_rates_tiled(
+        bleed_counts,
+        locations,
+        tissue_mask,
+        basis_functions,
+        max_bleed_distance=2,
+        local_weight=15,
+        tile_size=6,
+        n_workers=2,
+    )
+    np.testing.assert_equal(parallel_rates, tiled_rates)
+
+
+def test_iter_results():
+    from concurrent.futures import Future
+
+    submitted = []
+
+    def futures():
+        for i in range(10):
+            submitted.append(i)
+            future = Future()
+            future.set_result(i)
+            yield future
+
+    results = bleeding_correction._iter_results(futures(), max_in_flight=3)
+    assert next(results) == 0
+    assert len(submitted) == 3
+    assert list(results) == list(range(1, 10))
+
+
+def test_corrected_read_counts():
+    from unittest import mock
+
+    fit_rates = np.random.random((30, 7)) * (np.random.random((30, 7)) > 0.5)
+    fit_rates[:, 3] = 0
+    read_totals = np.random.randint(0, 1000, size=7)
+
+    with mock.patch.object(bleeding_correction, "CORRECTED_READS_CHUNK_SIZE", 60):
+        corrected_reads = bleeding_correction.corrected_read_counts(
+            fit_rates, read_totals
+        )
+
+    assert corrected_reads.format == "csc"
+    assert np.issubdtype(corrected_reads.dtype, np.integer)
+    expected = np.round(
+        fit_rates / fit_rates.sum(axis=0).clip(1e-10, None) * read_totals
+    )
+    np.testing.assert_array_equal(corrected_reads.toarray(), expected)
+
+
+def test_decontaminate_spots_without_basis_fit():
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=8, n_cols=8, n_genes=2
+    )
+    basis_idxs = bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+    n_basis, basis_length = bleeding_correction.get_basis_shape(basis_idxs)
+    basis_functions = np.tile(np.linspace(1, 0.1, basis_length), (n_basis, 1))
+
+    (
+        _,
+        rates,
+        fit_basis_functions,
+        weights,
+        _,
+        _,
+    ) = bleeding_correction.decontaminate_spots(
+        bleed_counts,
+        tissue_mask,
+        basis_idxs,
+        None,
+        max_steps=0,
+        basis_init=bleeding_correction.basis_functions_to_x(basis_functions),
+    )
+
+    np.testing.assert_allclose(fit_basis_functions, basis_functions, rtol=1e-6)
+    assert rates.shape == bleed_counts.shape
+
+
+def test_decontaminate_spots_default_rate_solver_regression():
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=8, n_cols=8, n_genes=3
+    )
+    basis_idxs = bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+
+    _, rates, _, _, _, _ = bleeding_correction.decontaminate_spots(
+        bleed_counts,
+        tissue_mask,
+        basis_idxs,
+        None,
+        max_steps=0,
+        basis_init=np.full(bleeding_correction.get_basis_shape(basis_idxs), -1.0),
+    )
+
+    # Share of each gene's corrected reads per in-tissue spot, recorded with the
+    # per-gene L-BFGS fit before SpotRateSolver was introduced. The penalized fit
+    # only determines the rates up to float32 rounding, while SpotRateSolver.EM
+    # moves some of these shares by more than 0.02.
+    expected = np.array(
+        [
+            [0.106, 0.1384, 0.0754],
+            [0.1068, 0.1105, 0.0619],
+            [0.0881, 0.1054, 0.0613],
+            [0.0713, 0.0188, 0.1191],
+            [0.1259, 0.1249, 0.1102],
+            [0.1407, 0.0868, 0.1124],
+            [0.1251, 0.1273, 0.1352],
+            [0.103, 0.1268, 0.1465],
+            [0.1332, 0.1612, 0.178],
+        ]
+    )
+    np.testing.assert_allclose(
+        rates[tissue_mask] / rates.sum(axis=0), expected, atol=2e-3
+    )
+
+
 def test_multinomial():
     import torch
     from torch.distributions.multinomial import Multinomial
@@ -141,6 +1042,30 @@ def test_multinomial():
     Multinomial(total_count=10, probs=torch.tensor([1, 1, 1]))
 
 
+def test_multinomial_log_prob():
+    import torch
+    from torch.distributions.multinomial import Multinomial
+
+    torch.manual_seed(0)
+    t_Y = torch.poisson(torch.full((4, 30), 3.0))
+    t_Y[0, :10] = 0
+    probs = torch.rand((4, 30))
+    probs[1, :5] = 0
+
+    expected = torch.stack(
+        [
+            Multinomial(total_count=int(t_Y[g].sum()), probs=probs[g]).log_prob(t_Y[g])
+            for g in range(4)
+        ]
+    )
+    torch.testing.assert_close(
+        bleeding_correction.multinomial_log_prob(
+            probs, t_Y, bleeding_correction.multinomial_log_normalizer(t_Y)
+        ),
+        expected,
+    )
+
+
 def test_clean_bleed():
     np.random.seed(100)
     (
@@ -182,6 +1107,214 @@ def test_clean_bleed():
         assert bleed_correction_result.global_rates.shape == (5,)
         assert cleaned_dataset.n_spot_in == tissue_mask.sum()
 
+    (cleaned_dataset, bleed_correction_result) = bleeding_correction.clean_bleed(
+        dataset1,
+        n_top=3,
+        local_weight=None,
+        max_steps=2,
+        engine=bleeding_correction.BleedCorrectionEngine.SEPARABLE,
+    )
+    assert bleed_correction_result.corrected_reads.shape == (12 * 12, 5)
+    assert cleaned_dataset.n_spot_in == tissue_mask.sum()
+
+    # Separable weights are recomputed as an operator, never as a dense matrix
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "bleed.h5")
+        bleed_correction_result.save(path, store_weights=False)
+        loaded = data.BleedCorrectionResult.read_h5(path)
+        assert loaded.weights is None
+        assert isinstance(
+            bleeding_correction.load_bleed_weights(loaded),
+            bleeding_correction.SeparableBleedWeights,
+        )
+        rates = bleed_counts[:, 0] * tissue_mask
+        np.testing.assert_allclose(
+            bleeding_correction.bleed_vectors(locations, rates, loaded.weights),
+            bleeding_correction.bleed_vectors(
+                locations, rates, bleed_correction_result.weights
+            ),
+            rtol=1e-6,
+        )
+    finally:
+        shutil.rmtree(tmpdir)
+
+    (cleaned_dataset, bleed_correction_result) = bleeding_correction.clean_bleed(
+        dataset1, n_top=3, local_weight=None, max_steps=2, coarse_factor=2
+    )
+    assert bleed_correction_result.corrected_reads.shape == (12 * 12, 5)
+    assert bleed_correction_result.basis_functions.shape == (
+        bleeding_correction.get_compact_basis_shape(
+            bleeding_correction.build_compact_basis_indices(locations, tissue_mask)
+        )
+    )
+
+    (cleaned_dataset, bleed_correction_result) = bleeding_correction.clean_bleed(
+        dataset1, n_top=3, local_weight=None, max_steps=2, max_bleed_distance=3
+    )
+    assert bleed_correction_result.corrected_reads.shape == (12 * 12, 5)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "bleed.h5")
+        bleed_correction_result.save(path)
+        loaded = data.BleedCorrectionResult.read_h5(path)
+        np.testing.assert_equal(
+            loaded.weights.toarray(), bleed_correction_result.weights.toarray()
+        )
+
+        bleed_correction_result.save(path, store_weights=False)
+        loaded = data.BleedCorrectionResult.read_h5(path)
+        np.testing.assert_allclose(
+            bleeding_correction.load_bleed_weights(loaded).toarray(),
+            bleed_correction_result.weights.toarray(),
+        )
+        np.testing.assert_equal(
+            loaded.corrected_reads.toarray(),
+            bleed_correction_result.corrected_reads.toarray(),
+        )
+    finally:
+        shutil.rmtree(tmpdir)
+
+    (cleaned_dataset, bleed_correction_result) = bleeding_correction.clean_bleed(
+        dataset1,
+        n_top=3,
+        local_weight=None,
+        max_steps=2,
+        max_bleed_distance=2,
+        tile_size=6,
+        rate_solver=bleeding_correction.SpotRateSolver.EM,
+    )
+    assert bleed_correction_result.corrected_reads.shape == (12 * 12, 5)
+    assert bleed_correction_result.weights.shape == (12 * 12, 12 * 12)
+    assert cleaned_dataset.n_spot_in == tissue_mask.sum()
+
+    with pytest.raises(ValueError):
+        bleeding_correction.clean_bleed(
+            dataset1,
+            n_top=3,
+            tile_size=6,
+            rate_solver=bleeding_correction.SpotRateSolver.EM,
+        )
+
+    with pytest.raises(ValueError):
+        bleeding_correction.clean_bleed(
+            dataset1, n_top=3, max_bleed_distance=2, tile_size=6
+        )
+
+    with pytest.raises(ValueError):
+        bleeding_correction.clean_bleed(dataset1, n_top=3, stochastic_basis_fit=True)
+
+    with pytest.raises(ValueError):
+        bleeding_correction.clean_bleed(
+            dataset1,
+            n_top=3,
+            rate_solver=bleeding_correction.SpotRateSolver.EM,
+            n_workers=2,
+        )
+
+
+def test_clean_bleed_reuse_basis_functions():
+    from unittest import mock
+
+    np.random.seed(100)
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=12, n_cols=12, n_genes=5
+    )
+    dataset = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["1", "2", "3", "4", "5"]),
+        layout=bayestme.common.Layout.SQUARE,
+        edges=utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    # EM spot rates are determined by the basis functions alone, so the corrected
+    # reads can be compared between the fits
+    _, bleed_correction_result = bleeding_correction.clean_bleed(
+        dataset,
+        n_top=3,
+        max_steps=2,
+        rate_solver=bleeding_correction.SpotRateSolver.EM,
+    )
+
+    # Reused as they are, the basis functions are not refit
+    with mock.patch.object(bleeding_correction, "fit_basis_functions") as fit:
+        _, reused_result = bleeding_correction.clean_bleed(
+            dataset,
+            n_top=3,
+            basis_functions=bleed_correction_result.basis_functions,
+            rate_solver=bleeding_correction.SpotRateSolver.EM,
+        )
+        fit.assert_not_called()
+    np.testing.assert_array_equal(
+        reused_result.basis_functions, bleed_correction_result.basis_functions
+    )
+    # The weights are exactly those rebuilt from the saved basis functions
+    np.testing.assert_array_equal(
+        reused_result.weights,
+        bleeding_correction.rebuild_bleed_weights(
+            bleed_correction_result.basis_functions,
+            locations,
+            tissue_mask,
+            bleed_correction_result.local_weight,
+        ),
+    )
+    np.testing.assert_allclose(
+        reused_result.corrected_reads.toarray(),
+        bleed_correction_result.corrected_reads.toarray(),
+        atol=2,
+    )
+
+    # Basis functions from a smaller slide are extended to this one
+    _, refined_result = bleeding_correction.clean_bleed(
+        dataset,
+        n_top=3,
+        basis_functions=bleed_correction_result.basis_functions[:, :4],
+        refine_steps=1,
+    )
+    assert (
+        refined_result.basis_functions.shape
+        == bleed_correction_result.basis_functions.shape
+    )
+
+    _, tiled_result = bleeding_correction.clean_bleed(
+        dataset,
+        n_top=3,
+        max_bleed_distance=2,
+        tile_size=6,
+        basis_functions=bleed_correction_result.basis_functions,
+        rate_solver=bleeding_correction.SpotRateSolver.EM,
+    )
+    assert tiled_result.corrected_reads.shape == (12 * 12, 5)
+
+
+def test_bleed_vectors():
+    from scipy import sparse
+
+    locations = np.random.random((15, 2)) * 10
+    rates = np.random.random(15)
+    weights = np.random.random((15, 15)) * (np.random.random((15, 15)) > 0.5)
+
+    contributions = rates[None] * weights
+    directions = locations[None] - locations[:, None]
+    expected = (directions * contributions[..., None]).mean(axis=1)
+    expected = expected / np.abs(expected).max(axis=0, keepdims=True)
+
+    np.testing.assert_allclose(
+        bleeding_correction.bleed_vectors(locations, rates, weights), expected
+    )
+    np.testing.assert_allclose(
+        bleeding_correction.bleed_vectors(locations, rates, sparse.csr_matrix(weights)),
+        expected,
+    )
+
 
 def test_plot_bleed_vectors():
     np.random.seed(100)
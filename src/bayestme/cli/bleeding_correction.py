@@ -37,6 +37,104 @@ def get_parser():
         help="Initial value for local weight, a tuning parameter for bleed correction. "
         "rho_0g from equation 1 in the paper. By default will be set to sqrt(N tissue spots)",
     )
+    parser.add_argument(
+        "--engine",
+        type=bleeding_correction.BleedCorrectionEngine,
+        choices=list(bleeding_correction.BleedCorrectionEngine),
+        default=bleeding_correction.BleedCorrectionEngine.EXACT,
+        help="How to evaluate the bleed weights. SEPARABLE never forms the dense "
+        "spot by spot weight matrix, use it for large arrays.",
+    )
+    parser.add_argument(
+        "--max-bleed-distance",
+        type=float,
+        default=None,
+        help="Only model bleeding between spots within this distance (in grid units) of "
+        "each other. Memory and time then scale linearly with the number of spots. "
+        "By default bleeding between all pairs of spots is modeled.",
+    )
+    parser.add_argument(
+        "--rate-solver",
+        type=bleeding_correction.SpotRateSolver,
+        choices=list(bleeding_correction.SpotRateSolver),
+        default=bleeding_correction.SpotRateSolver.LBFGS,
+        help="How to fit the corrected spot rates of every gene. LBFGS fits each gene "
+        "separately with the penalized multinomial model, EM fits all genes at once "
+        "with multiplicative updates, which is much faster but drops the penalty, so "
+        "its corrected counts differ slightly.",
+    )
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        default=1,
+        help="Number of processes used to fit the spot rates of each gene in parallel "
+        "with --rate-solver LBFGS, or the tiles of --tile-size in parallel. "
+        "Without --tile-size, --rate-solver EM requires a single worker.",
+    )
+    parser.add_argument(
+        "--optimizer-backend",
+        type=bleeding_correction.OptimizerBackend,
+        choices=list(bleeding_correction.OptimizerBackend),
+        default=bleeding_correction.OptimizerBackend.SCIPY,
+        help="Optimizer used for the L-BFGS fits. TORCH keeps the parameters as torch "
+        "tensors instead of copying them to scipy on every evaluation.",
+    )
+    parser.add_argument(
+        "--stochastic-basis-fit",
+        action="store_true",
+        default=False,
+        help="Fit the bleed basis functions on random minibatches of spots and genes "
+        "with Adam, which makes larger values of --n-top affordable. "
+        "Requires --max-bleed-distance.",
+    )
+    parser.add_argument(
+        "--coarse-factor",
+        type=int,
+        default=None,
+        help="Fit the bleed basis functions on a grid downsampled by this factor first, "
+        "and use them to initialize the fit at full resolution. With the default "
+        "--fine-steps 1 the full resolution step dominates the runtime, so this is "
+        "about 3x faster than --max-steps full resolution steps. Only --fine-steps 0 "
+        "gives an order of magnitude speedup, at a cost in accuracy.",
+    )
+    parser.add_argument(
+        "--fine-steps",
+        type=int,
+        default=1,
+        help="Number of full resolution fitting steps after the coarse fit, "
+        "only used with --coarse-factor. Each step costs about as much as a step "
+        "without --coarse-factor. With 0 the upsampled basis functions are used "
+        "as they are, which is much faster but less accurate.",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=None,
+        help="Correct the slide in tiles of this many grid positions along each axis, "
+        "fit in parallel by --n-workers processes. Requires --max-bleed-distance "
+        "and --rate-solver EM.",
+    )
+    parser.add_argument(
+        "--reuse-bleed-result",
+        type=str,
+        default=None,
+        help="BleedCorrectionResult in h5 format, e.g. of a slide from the same chip design "
+        "and protocol, whose basis functions are reused instead of fit from scratch.",
+    )
+    parser.add_argument(
+        "--refine-steps",
+        type=int,
+        default=0,
+        help="Number of EM steps refining the basis functions of --reuse-bleed-result, "
+        "by default they are used as they are.",
+    )
+    parser.add_argument(
+        "--no-bleed-weights",
+        default=False,
+        action="store_true",
+        help="Save --bleed-out without the <N spots> x <N spots> bleed weights, "
+        "which are recomputed from the basis functions and tissue geometry when needed.",
+    )
     bayestme.log_config.add_logging_args(parser)
     return parser
 
@@ -48,14 +146,33 @@ def main():
 
     dataset = data.SpatialExpressionDataset.read_h5(args.adata)
 
+    basis_functions = None
+    if args.reuse_bleed_result is not None:
+        basis_functions = data.BleedCorrectionResult.read_h5(
+            args.reuse_bleed_result
+        ).basis_functions
+
     (cleaned_dataset, bleed_correction_result) = bleeding_correction.clean_bleed(
         dataset=dataset,
         n_top=args.n_top,
         max_steps=args.max_steps,
         local_weight=args.local_weight,
+        engine=args.engine,
+        max_bleed_distance=args.max_bleed_distance,
+        rate_solver=args.rate_solver,
+        n_workers=args.n_workers,
+        optimizer_backend=args.optimizer_backend,
+        stochastic_basis_fit=args.stochastic_basis_fit,
+        coarse_factor=args.coarse_factor,
+        fine_steps=args.fine_steps,
+        tile_size=args.tile_size,
+        basis_functions=basis_functions,
+        refine_steps=args.refine_steps,
     )
 
-    bleed_correction_result.save(args.bleed_out)
+    bleed_correction_result.save(
+        args.bleed_out, store_weights=not args.no_bleed_weights
+    )
 
     if not args.inplace:
         cleaned_dataset.save(args.adata_output)
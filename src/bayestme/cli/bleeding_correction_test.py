@@ -6,6 +6,11 @@ from unittest import mock
 import numpy as np
 
 from bayestme import data
+from bayestme.bleeding_correction import (
+    BleedCorrectionEngine,
+    OptimizerBackend,
+    SpotRateSolver,
+)
 from bayestme.cli import bleeding_correction
 from bayestme.data_test import generate_toy_stdataset
 
@@ -54,7 +59,70 @@ def test_filter_genes():
                 data.SpatialExpressionDataset.read_h5(clean_out)
 
                 clean_bleed.assert_called_once_with(
-                    dataset=mock.ANY, n_top=3, max_steps=5, local_weight=15
+                    dataset=mock.ANY,
+                    n_top=3,
+                    max_steps=5,
+                    local_weight=15,
+                    engine=BleedCorrectionEngine.EXACT,
+                    max_bleed_distance=None,
+                    rate_solver=SpotRateSolver.LBFGS,
+                    n_workers=1,
+                    optimizer_backend=OptimizerBackend.SCIPY,
+                    stochastic_basis_fit=False,
+                    coarse_factor=None,
+                    fine_steps=1,
+                    tile_size=None,
+                    basis_functions=None,
+                    refine_steps=0,
                 )
     finally:
         shutil.rmtree(tmpdir)
+
+
+def test_reuse_bleed_result():
+    dataset = generate_toy_stdataset()
+    previous_results = data.BleedCorrectionResult(
+        corrected_reads=np.zeros((2, 2)),
+        global_rates=np.zeros((2, 2)),
+        basis_functions=np.random.random((8, 3)),
+        weights=np.zeros((2, 2)),
+    )
+
+    tmpdir = tempfile.mkdtemp()
+
+    input_path = os.path.join(tmpdir, "data.h5")
+    previous_bleed_out = os.path.join(tmpdir, "previous_bleed.h5")
+    bleed_out = os.path.join(tmpdir, "bleed.h5")
+    clean_out = os.path.join(tmpdir, "cleaned.h5")
+
+    command_line_arguments = [
+        "bleeding_correction",
+        "--adata",
+        input_path,
+        "--bleed-out",
+        bleed_out,
+        "--adata-output",
+        clean_out,
+        "--reuse-bleed-result",
+        previous_bleed_out,
+        "--refine-steps",
+        "2",
+    ]
+
+    try:
+        dataset.save(input_path)
+        previous_results.save(previous_bleed_out)
+
+        with mock.patch("sys.argv", command_line_arguments):
+            with mock.patch("bayestme.bleeding_correction.clean_bleed") as clean_bleed:
+                clean_bleed.return_value = (dataset, previous_results)
+
+                bleeding_correction.main()
+
+                np.testing.assert_array_equal(
+                    clean_bleed.call_args.kwargs["basis_functions"],
+                    previous_results.basis_functions,
+                )
+                assert clean_bleed.call_args.kwargs["refine_steps"] == 2
+    finally:
+        shutil.rmtree(tmpdir)
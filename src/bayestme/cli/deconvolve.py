@@ -10,6 +10,7 @@ import bayestme.data
 import bayestme.expression_truth
 import bayestme.log_config
 import bayestme.plot.deconvolution
+import bayestme.svi.deconvolution
 from bayestme import data
 from bayestme import deconvolution
 from bayestme.common import create_rng
@@ -42,6 +43,64 @@ def get_parser():
         type=str,
         help="Path where DeconvolutionResult will be written h5 format",
     )
+    parser.add_argument(
+        "--likelihood",
+        type=bayestme.svi.deconvolution.PoissonLikelihood,
+        choices=list(bayestme.svi.deconvolution.PoissonLikelihood),
+        default=bayestme.svi.deconvolution.PoissonLikelihood.FACTOR,
+        help="How the Poisson likelihood of the counts is scored during SVI. FACTOR "
+        "uses the closed form log likelihood, SPARSE evaluates it from sparse counts "
+        "at the nonzero entries only, DISTRIBUTION uses pyro's Poisson distribution.",
+    )
+    parser.add_argument(
+        "--spot-batch-size",
+        type=int,
+        default=None,
+        help="If provided, run each SVI step on a random minibatch of this many spots "
+        "instead of the whole slide.",
+    )
+    parser.add_argument(
+        "--gene-batch-size",
+        type=int,
+        default=None,
+        help="If provided, score the counts of each SVI step on a random minibatch of "
+        "this many genes instead of all genes.",
+    )
+    parser.add_argument(
+        "--stream-batch-size",
+        type=int,
+        default=None,
+        help="If provided, leave the counts of --adata on disk and stream batches of "
+        "this many consecutive spots to each SVI step, for datasets that do not fit "
+        "in memory.",
+    )
+    posterior_output = parser.add_mutually_exclusive_group()
+    posterior_output.add_argument(
+        "--summary-only",
+        default=False,
+        action="store_true",
+        help="If provided, write posterior summaries (means, variances, marker gene "
+        "statistics and quantiles) accumulated while sampling instead of every "
+        "posterior sample, so memory does not grow with --n-samples.",
+    )
+    posterior_output.add_argument(
+        "--stream-traces",
+        default=False,
+        action="store_true",
+        help="If provided, write every posterior sample to --output while sampling "
+        "instead of holding them all in memory. The written DeconvolutionResult has "
+        "no reads_trace, which is larger than the other traces by a factor of the "
+        "number of genes; DeconvolutionResult.reads_trace recomputes it from the "
+        "written traces.",
+    )
+    parser.add_argument(
+        "--jit",
+        default=False,
+        action="store_true",
+        help="If provided, trace the model and guide once with the PyTorch JIT and "
+        "replay the compiled ELBO on every SVI step. Cannot be combined with "
+        "--stream-batch-size.",
+    )
     bayestme.cli.common.add_deconvolution_arguments(parser)
     bayestme.log_config.add_logging_args(parser)
     return parser
@@ -53,7 +112,7 @@ def main():
     logger.info("deconvolution called with arguments: {}".format(args))
 
     dataset: data.SpatialExpressionDataset = data.SpatialExpressionDataset.read_h5(
-        args.adata
+        args.adata, backed=args.stream_batch_size is not None
     )
 
     rng = create_rng(args.seed)
@@ -77,7 +136,7 @@ def main():
             "--n-components not explicitly provided, and no expression truth provided."
         )
 
-    results: data.DeconvolutionResult = deconvolution.sample_from_posterior(
+    results = deconvolution.sample_from_posterior(
         data=dataset,
         n_components=n_components,
         spatial_smoothing_parameter=args.spatial_smoothing_parameter,
@@ -86,9 +145,19 @@ def main():
         expression_truth=expression_truth,
         use_spatial_guide=args.use_spatial_guide,
         rng=rng,
+        likelihood=args.likelihood,
+        spot_batch_size=args.spot_batch_size,
+        gene_batch_size=args.gene_batch_size,
+        stream_batch_size=args.stream_batch_size,
+        # Streamed traces are written to --output while sampling, and only
+        # their summary is returned
+        summary_only=args.summary_only or args.stream_traces,
+        trace_path=args.output if args.stream_traces else None,
+        jit=args.jit,
     )
 
-    results.save(args.output)
+    if not args.stream_traces:
+        results.save(args.output)
 
     if results.losses is not None:
         bayestme.plot.deconvolution.plot_loss(
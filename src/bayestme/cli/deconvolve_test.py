@@ -3,8 +3,11 @@ import shutil
 import tempfile
 from unittest import mock
 
+import h5py
 import numpy as np
+import pytest
 
+import bayestme.svi.deconvolution
 import bayestme.synthetic_data
 from bayestme import data
 from bayestme.cli import deconvolve
@@ -12,6 +15,16 @@ from bayestme.common import InferenceType
 from bayestme.data_test import generate_toy_stdataset
 
 
+def write_traces(result):
+    # Stands in for sample_from_posterior, which writes the traces to trace_path
+    def sample_from_posterior(trace_path=None, **kwargs):
+        if trace_path is not None:
+            result.save(trace_path)
+        return result
+
+    return sample_from_posterior
+
+
 def test_deconvolve():
     dataset = generate_toy_stdataset()
     tmpdir = tempfile.mkdtemp()
@@ -52,12 +65,14 @@ def test_deconvolve():
             with mock.patch(
                 "bayestme.deconvolution.sample_from_posterior"
             ) as deconvolve_mock:
-                deconvolve_mock.return_value = deconvolve_rv
+                deconvolve_mock.side_effect = write_traces(deconvolve_rv)
 
                 deconvolve.main()
 
                 data.DeconvolutionResult.read_h5(output_path)
                 data.SpatialExpressionDataset.read_h5(adata_output_path)
+                with h5py.File(output_path, "r") as f:
+                    assert "reads_trace" in f
 
                 deconvolve_mock.assert_called_once_with(
                     data=mock.ANY,
@@ -68,6 +83,13 @@ def test_deconvolve():
                     n_svi_steps=4,
                     use_spatial_guide=False,
                     rng=mock.ANY,
+                    likelihood=bayestme.svi.deconvolution.PoissonLikelihood.FACTOR,
+                    spot_batch_size=None,
+                    gene_batch_size=None,
+                    stream_batch_size=None,
+                    summary_only=False,
+                    trace_path=None,
+                    jit=False,
                 )
 
     finally:
@@ -118,7 +140,7 @@ def test_deconvolve_with_expression_truth():
                 ) as load_expression_truth_mock:
                     expression_truth = np.zeros((9, 10))
                     load_expression_truth_mock.return_value = expression_truth
-                    deconvolve_mock.return_value = deconvolve_rv
+                    deconvolve_mock.side_effect = write_traces(deconvolve_rv)
 
                     deconvolve.main()
 
@@ -134,6 +156,110 @@ def test_deconvolve_with_expression_truth():
                         expression_truth=mock.ANY,
                         use_spatial_guide=True,
                         rng=mock.ANY,
+                        likelihood=bayestme.svi.deconvolution.PoissonLikelihood.FACTOR,
+                        spot_batch_size=None,
+                        gene_batch_size=None,
+                        stream_batch_size=None,
+                        summary_only=False,
+                        trace_path=None,
+                        jit=False,
                     )
     finally:
         shutil.rmtree(tmpdir)
+
+
+def test_deconvolve_streamed_inplace():
+    dataset = generate_toy_stdataset()
+    tmpdir = tempfile.mkdtemp()
+
+    input_path = os.path.join(tmpdir, "data.h5")
+    output_path = os.path.join(tmpdir, "deconvolve.h5")
+
+    deconvolve_rv = bayestme.synthetic_data.create_toy_deconvolve_result(
+        n_nodes=dataset.n_spot_in, n_components=5, n_samples=100, n_gene=dataset.n_gene
+    )
+
+    command_line_arguments = [
+        "deconvolve",
+        "--adata",
+        input_path,
+        "--inplace",
+        "--output",
+        output_path,
+        "--n-components",
+        "5",
+        "--n-svi-steps",
+        "4",
+        "--stream-batch-size",
+        "2",
+    ]
+
+    try:
+        dataset.save(input_path)
+
+        with mock.patch("sys.argv", command_line_arguments):
+            with mock.patch(
+                "bayestme.deconvolution.sample_from_posterior"
+            ) as deconvolve_mock:
+                deconvolve_mock.side_effect = write_traces(deconvolve_rv)
+
+                deconvolve.main()
+
+                assert deconvolve_mock.call_args.kwargs["data"].adata.isbacked
+                assert deconvolve_mock.call_args.kwargs["stream_batch_size"] == 2
+
+                result = data.SpatialExpressionDataset.read_h5(input_path)
+                assert result.n_cell_types == 5
+                np.testing.assert_array_equal(result.counts, dataset.counts)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_deconvolve_stream_traces():
+    dataset = generate_toy_stdataset()
+    tmpdir = tempfile.mkdtemp()
+
+    input_path = os.path.join(tmpdir, "data.h5")
+    output_path = os.path.join(tmpdir, "deconvolve.h5")
+    adata_output_path = os.path.join(tmpdir, "data_out.h5")
+
+    deconvolve_rv = bayestme.synthetic_data.create_toy_deconvolve_result(
+        n_nodes=dataset.n_spot_in, n_components=5, n_samples=100, n_gene=dataset.n_gene
+    )
+
+    command_line_arguments = [
+        "deconvolve",
+        "--adata",
+        input_path,
+        "--adata-output",
+        adata_output_path,
+        "--output",
+        output_path,
+        "--n-components",
+        "5",
+        "--n-svi-steps",
+        "4",
+        "--stream-traces",
+    ]
+
+    try:
+        dataset.save(input_path)
+
+        with mock.patch("sys.argv", command_line_arguments):
+            with mock.patch(
+                "bayestme.deconvolution.sample_from_posterior"
+            ) as deconvolve_mock:
+                deconvolve_mock.side_effect = write_traces(deconvolve_rv)
+
+                deconvolve.main()
+
+                assert deconvolve_mock.call_args.kwargs["summary_only"]
+                assert deconvolve_mock.call_args.kwargs["trace_path"] == output_path
+                data.DeconvolutionResult.read_h5(output_path)
+                data.SpatialExpressionDataset.read_h5(adata_output_path)
+
+        with mock.patch("sys.argv", command_line_arguments + ["--summary-only"]):
+            with pytest.raises(SystemExit):
+                deconvolve.main()
+    finally:
+        shutil.rmtree(tmpdir)
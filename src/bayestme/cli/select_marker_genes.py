@@ -60,7 +60,7 @@ def main():
     logger.info("select_marker_genes called with arguments: {}".format(args))
 
     stdata = data.SpatialExpressionDataset.read_h5(args.adata)
-    deconvolution_result = data.DeconvolutionResult.read_h5(args.deconvolution_result)
+    deconvolution_result = data.read_deconvolution_result(args.deconvolution_result)
 
     marker_genes = bayestme.marker_genes.select_marker_genes(
         deconvolution_result=deconvolution_result,
@@ -98,7 +98,7 @@ def main():
 
     rng = create_rng(args.seed)
 
-    deconvolution_results = data.DeconvolutionResult.read_h5(args.deconvolution_result)
+    deconvolution_results = data.read_deconvolution_result(args.deconvolution_result)
 
     if args.cell_type_names is not None:
         cell_type_names = [name.strip() for name in args.cell_type_names.split(",")]
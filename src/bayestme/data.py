@@ -1,7 +1,7 @@
 import glob
 import logging
 import os
-from typing import Optional, List
+from typing import Optional, List, Union
 
 import anndata
 import h5py
@@ -151,6 +151,13 @@ class SpatialExpressionDataset:
         else:
             return X
 
+    @property
+    def sparse_counts(self) -> csr_matrix:
+        """
+        In tissue counts as a sparse matrix, without densifying a sparse X.
+        """
+        return csr_matrix(self.adata[self.adata.obs[IN_TISSUE_ATTR]].X)
+
     @property
     def positions(self) -> ArrayType:
         return self.adata.obsm[SPATIAL_ATTR]
@@ -231,7 +238,17 @@ class SpatialExpressionDataset:
         return self.adata.varm[RELATIVE_MEAN_EXPRESSION_ATTR].T
 
     def save(self, path):
-        self.adata.write_h5ad(path)
+        if self.adata.isbacked and os.path.abspath(path) == os.path.abspath(
+            self.adata.filename
+        ):
+            # The backing file is open for reading, so write a new file and swap
+            tmp_path = path + ".tmp"
+            self.adata.write_h5ad(tmp_path)
+            self.adata.file.close()
+            os.replace(tmp_path, path)
+            self.adata = anndata.read_h5ad(path, backed="r")
+        else:
+            self.adata.write_h5ad(path)
 
     @classmethod
     def from_arrays(
@@ -409,13 +426,14 @@ class SpatialExpressionDataset:
         )
 
     @classmethod
-    def read_h5(cls, path):
+    def read_h5(cls, path, backed: bool = False):
         """
         Read this class from an h5 archive
         :param path: Path to h5 file.
+        :param backed: If True, leave the count matrix on disk and read it lazily.
         :return: SpatialExpressionDataset
         """
-        return cls(anndata.read_h5ad(path))
+        return cls(anndata.read_h5ad(path, backed="r" if backed else None))
 
     def copy(self) -> "SpatialExpressionDataset":
         """
@@ -426,6 +444,27 @@ class SpatialExpressionDataset:
         return SpatialExpressionDataset(ad)
 
 
+def _write_sparse_matrix(group: h5py.Group, matrix):
+    matrix = csr_matrix(matrix)
+    for key, values in [
+        ("data", matrix.data),
+        ("indices", matrix.indices),
+        ("indptr", matrix.indptr),
+    ]:
+        if values.size > 0:
+            group.create_dataset(key, data=values, chunks=True, compression="gzip")
+        else:
+            group[key] = values
+    group.attrs["shape"] = matrix.shape
+
+
+def _read_sparse_matrix(group: h5py.Group) -> csr_matrix:
+    return csr_matrix(
+        (group["data"][:], group["indices"][:], group["indptr"][:]),
+        shape=tuple(group.attrs["shape"]),
+    )
+
+
 class BleedCorrectionResult:
     """
     Data model for the results of bleeding correction.
@@ -436,44 +475,117 @@ class BleedCorrectionResult:
         corrected_reads: np.ndarray,
         global_rates: np.ndarray,
         basis_functions: np.ndarray,
-        weights: np.ndarray,
+        weights: Optional[np.ndarray] = None,
+        local_weight: Optional[float] = None,
+        positions: Optional[np.ndarray] = None,
+        tissue_mask: Optional[np.ndarray] = None,
+        max_bleed_distance: Optional[float] = None,
+        engine=None,
     ):
         """
-        :param corrected_reads: <N in-tissue spot> x <N genes> matrix of corrected read counts.
+        :param corrected_reads: <N in-tissue spot> x <N genes> matrix of corrected read counts,
+                                dense or scipy sparse.
         :param global_rates:
         :param basis_functions:
-        :param weights:
+        :param weights: <N spots> x <N spots> bleed weights, either a dense matrix, a scipy
+                        sparse matrix or an object supporting matrix products
+                        (only dense and sparse weights are saved). If not given,
+                        bleeding_correction.load_bleed_weights recomputes them from the
+                        basis functions and the tissue geometry below.
+        :param local_weight: Weight for the local spot the weights were computed with
+        :param positions: <N spots> x 2 matrix of spot positions
+        :param tissue_mask: <N spots> boolean array, True if the spot is in the tissue
+        :param max_bleed_distance: Distance (in grid units) the weights were truncated at,
+                                   or None if bleeding between all pairs of spots is modeled
+        :param engine: bleeding_correction.BleedCorrectionEngine (or its name) the weights
+                       were evaluated with, None for BleedCorrectionEngine.EXACT. Weights of
+                       the SEPARABLE engine are recomputed as a SeparableBleedWeights
+                       operator rather than as a dense matrix.
         """
         self.weights = weights
         self.basis_functions = basis_functions
         self.global_rates = global_rates
         self.corrected_reads = corrected_reads
+        self.local_weight = local_weight
+        self.positions = positions
+        self.tissue_mask = tissue_mask
+        self.max_bleed_distance = max_bleed_distance
+        self.engine = engine
 
-    def save(self, path):
+    def save(self, path, store_weights: bool = True):
+        """
+        :param path: Path to h5 file.
+        :param store_weights: If False, only store what is needed to recompute the weights
+                              (basis functions, local weight and tissue geometry),
+                              which is much smaller than the <N spots> x <N spots> weights.
+
+        The corrected read counts are stored as a compressed sparse integer matrix.
+        """
         with h5py.File(path, "w") as f:
-            f["corrected_reads"] = self.corrected_reads
+            corrected_reads = self.corrected_reads
+            if not issparse(corrected_reads):
+                corrected_reads = np.rint(corrected_reads)
+            _write_sparse_matrix(
+                f.create_group("corrected_reads"),
+                csr_matrix(corrected_reads).astype(np.int64),
+            )
             f["global_rates"] = self.global_rates
             f["basis_functions"] = self.basis_functions
-            f["weights"] = self.weights
+            if self.positions is not None:
+                f["positions"] = self.positions
+            if self.tissue_mask is not None:
+                f["tissue_mask"] = self.tissue_mask
+            if self.local_weight is not None:
+                f.attrs["local_weight"] = self.local_weight
+            if self.max_bleed_distance is not None:
+                f.attrs["max_bleed_distance"] = self.max_bleed_distance
+            if self.engine is not None:
+                f.attrs["engine"] = str(self.engine)
+
+            if not store_weights:
+                return
+            if isinstance(self.weights, np.ndarray):
+                f["weights"] = self.weights
+            elif issparse(self.weights):
+                _write_sparse_matrix(f.create_group("weights"), self.weights)
+            elif self.weights is not None:
+                logger.warning(
+                    "Not saving bleed weights of type {}".format(
+                        type(self.weights).__name__
+                    )
+                )
 
     @classmethod
     def read_h5(cls, path):
         """
         Read this class from an h5 archive
         :param path: Path to h5 file.
-        :return: SpatialExpressionDataset
+        :return: BleedCorrectionResult
         """
         with h5py.File(path, "r") as f:
-            corrected_reads = f["corrected_reads"][:]
+            if isinstance(f["corrected_reads"], h5py.Group):
+                corrected_reads = _read_sparse_matrix(f["corrected_reads"])
+            else:
+                corrected_reads = f["corrected_reads"][:]
             global_rates = f["global_rates"][:]
             basis_functions = f["basis_functions"][:]
-            weights = f["weights"][:]
+            if "weights" not in f:
+                weights = None
+            elif isinstance(f["weights"], h5py.Group):
+                weights = _read_sparse_matrix(f["weights"])
+            else:
+                weights = f["weights"][:]
 
             return cls(
                 corrected_reads=corrected_reads,
                 global_rates=global_rates,
                 basis_functions=basis_functions,
                 weights=weights,
+                local_weight=f.attrs.get("local_weight"),
+                positions=f["positions"][:] if "positions" in f else None,
+                tissue_mask=f["tissue_mask"][:] if "tissue_mask" in f else None,
+                max_bleed_distance=f.attrs.get("max_bleed_distance"),
+                engine=f.attrs.get("engine"),
             )
 
 
@@ -564,6 +676,32 @@ class PhenotypeSelectionResult:
             )
 
 
+def _relative_expression(gene_expression):
+    n_components = gene_expression.shape[0]
+    expression = np.zeros(shape=gene_expression.shape, dtype=np.float64)
+    for k in range(n_components):
+        mask = np.arange(n_components) != k
+        max_exp_g_k_prime = gene_expression[mask].max(axis=0)
+        expression[k] = (gene_expression[k] - max_exp_g_k_prime) / np.max(
+            gene_expression, axis=0
+        )
+
+    return expression
+
+
+def _relative_mean_expression(gene_expression):
+    n_components = gene_expression.shape[0]
+    expression = np.zeros(
+        shape=gene_expression.shape, dtype=np.float64
+    )  # n_components, n_genes
+    for k in range(n_components):
+        mask = np.arange(n_components) != k
+        out_group_mean = gene_expression[mask].mean(axis=0)  # n_genes
+        expression[k] = gene_expression[k] / out_group_mean
+
+    return expression
+
+
 class DeconvolutionResult:
     """
     Data model for the results of sampling from the deconvolution posterior distribution.
@@ -679,16 +817,7 @@ class DeconvolutionResult:
 
         :return: An <N cell types> x <N markers> floating point matrix.
         """
-        expression = np.zeros(shape=self.expression_trace.shape[1:], dtype=np.float64)
-        gene_expression = self.expression_trace.mean(axis=0)
-        for k in range(self.n_components):
-            mask = np.arange(self.n_components) != k
-            max_exp_g_k_prime = gene_expression[mask].max(axis=0)
-            expression[k] = (gene_expression[k] - max_exp_g_k_prime) / np.max(
-                gene_expression, axis=0
-            )
-
-        return expression
+        return _relative_expression(self.expression_mean)
 
     @property
     def relative_mean_expression(self):
@@ -697,16 +826,42 @@ class DeconvolutionResult:
 
         :return: An <N cell types> x <N markers> floating point matrix.
         """
-        expression = np.zeros(
-            shape=self.expression_trace.shape[1:], dtype=np.float64
-        )  # n_components, n_genes
-        gene_expression = self.expression_trace.mean(axis=0)  # n_components, n_genes
-        for k in range(self.n_components):
-            mask = np.arange(self.n_components) != k
-            out_group_mean = gene_expression[mask].mean(axis=0)  # n_genes
-            expression[k] = gene_expression[k] / out_group_mean
+        return _relative_mean_expression(self.expression_mean)
+
+    @property
+    def expression_mean(self):
+        """
+        :return: <N components> x <N markers> posterior mean expression
+        """
+        return self.expression_trace.mean(axis=0)
 
-        return expression
+    @property
+    def cell_prob_mean(self):
+        """
+        :return: <N tissue spots> x <N components> mean cell type probabilities
+        """
+        return self.cell_prob_trace.mean(axis=0)
+
+    @property
+    def cell_num_mean(self):
+        """
+        :return: <N tissue spots> x <N components> posterior mean cell numbers
+        """
+        return self.cell_num_trace.mean(axis=0)
+
+    @property
+    def reads_mean(self):
+        """
+        Posterior mean of reads_trace, without forming reads_trace.
+
+        :return: <N Spots> x <N Genes> x <N Cell Types>
+        """
+        number_of_cells_per_component = (
+            self.cell_prob_trace.T * self.cell_num_total_trace.T
+        ).T * self.beta_trace[:, None, :]
+        return np.einsum(
+            "snk,skg->ngk", number_of_cells_per_component, self.expression_trace
+        ) / len(self.expression_trace)
 
     @property
     def reads_trace(self):
@@ -765,6 +920,247 @@ class DeconvolutionResult:
             )
 
 
+class DeconvolutionTraceWriter:
+    """
+    Writes a DeconvolutionResult h5 archive one batch of samples at a time, into
+    resizable datasets chunked by batch, so the full traces are never held in
+    memory. The archive can be read with DeconvolutionResult.read_h5.
+
+    Unlike DeconvolutionResult.save, reads_trace is not written, as it is
+    larger than all the other traces together by a factor of the number of genes.
+    DeconvolutionResult.reads_trace recomputes it from the written traces.
+    """
+
+    _TRACES = (
+        "cell_prob_trace",
+        "expression_trace",
+        "beta_trace",
+        "cell_num_total_trace",
+    )
+
+    def __init__(
+        self,
+        path,
+        lam2: float,
+        n_components: int,
+        losses: Optional[np.ndarray] = None,
+    ):
+        """
+        :param path: Path to h5 file, overwritten if it exists
+        :param lam2: lambda smoothing parameter used for the posterior distribution
+        :param n_components: N components value for the posterior distribution
+        :param losses: Training loss (if applicable for inference method)
+        """
+        self.file = h5py.File(path, "w")
+        if losses is not None:
+            self.file["losses"] = losses
+        self.file.attrs["lam2"] = lam2
+        self.file.attrs["n_components"] = n_components
+
+    def append(
+        self,
+        cell_prob_trace: np.ndarray,
+        expression_trace: np.ndarray,
+        beta_trace: np.ndarray,
+        cell_num_total_trace: np.ndarray,
+    ):
+        """
+        Append a batch of samples, shaped as the traces of DeconvolutionResult.
+
+        :param cell_prob_trace: <N samples> x <N tissue spots> x <N components> matrix
+        :param expression_trace: <N samples> x <N components> x <N markers> matrix
+        :param beta_trace: <N samples> x <N components> matrix
+        :param cell_num_total_trace: <N samples> x <N tissue spots> matrix
+        """
+        batch = dict(
+            cell_prob_trace=cell_prob_trace,
+            expression_trace=expression_trace,
+            beta_trace=beta_trace,
+            cell_num_total_trace=cell_num_total_trace,
+        )
+        for name in self._TRACES:
+            samples = batch[name]
+            if name not in self.file:
+                self.file.create_dataset(
+                    name,
+                    shape=(0,) + samples.shape[1:],
+                    maxshape=(None,) + samples.shape[1:],
+                    chunks=samples.shape,
+                    dtype=samples.dtype,
+                )
+            dataset = self.file[name]
+            n = dataset.shape[0]
+            dataset.resize(n + samples.shape[0], axis=0)
+            dataset[n:] = samples
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DeconvolutionSummary:
+    """
+    Data model for posterior summaries of the deconvolution, accumulated while
+    sampling (see bayestme.summaries) instead of keeping every sample.
+
+    Exposes the posterior means and marker gene statistics of DeconvolutionResult,
+    so it can be used wherever only those are needed, with memory independent of
+    the number of samples.
+    """
+
+    _ARRAYS = (
+        "cell_prob_mean",
+        "cell_prob_var",
+        "cell_prob_quantiles",
+        "quantile_levels",
+        "cell_num_mean",
+        "cell_num_var",
+        "expression_mean",
+        "expression_var",
+        "beta_mean",
+        "beta_var",
+        "scaled_expression_mean",
+        "omega",
+        "omega_difference",
+    )
+
+    def __init__(
+        self,
+        n_samples: int,
+        cell_prob_mean: np.ndarray,
+        cell_prob_var: np.ndarray,
+        cell_prob_quantiles: np.ndarray,
+        quantile_levels: np.ndarray,
+        cell_num_mean: np.ndarray,
+        cell_num_var: np.ndarray,
+        expression_mean: np.ndarray,
+        expression_var: np.ndarray,
+        beta_mean: np.ndarray,
+        beta_var: np.ndarray,
+        scaled_expression_mean: np.ndarray,
+        omega: np.ndarray,
+        omega_difference: np.ndarray,
+        lam2: float,
+        n_components: int,
+        losses: Optional[np.ndarray] = None,
+    ):
+        """
+        :param n_samples: Number of posterior samples summarized
+        :param cell_prob_mean: <N tissue spots> x <N components> matrix
+        :param cell_prob_var: <N tissue spots> x <N components> matrix
+        :param cell_prob_quantiles: <N levels> x <N tissue spots> x <N components> matrix
+        :param quantile_levels: <N levels> quantile levels of cell_prob_quantiles
+        :param cell_num_mean: <N tissue spots> x <N components> matrix
+        :param cell_num_var: <N tissue spots> x <N components> matrix
+        :param expression_mean: <N components> x <N markers> matrix
+        :param expression_var: <N components> x <N markers> matrix
+        :param beta_mean: <N components> vector
+        :param beta_var: <N components> vector
+        :param scaled_expression_mean: <N components> x <N markers> posterior mean of
+        beta * expression
+        :param omega: <N components> x <N markers> matrix, see DeconvolutionResult.omega
+        :param omega_difference: <N components> x <N markers> matrix,
+        see DeconvolutionResult.omega_difference
+        :param lam2: lambda smoothing parameter used for the posterior distribution
+        :param n_components: N components value for the posterior distribution
+        :param losses: Training loss (if applicable for inference method)
+        """
+        self.n_samples = n_samples
+        self.cell_prob_mean = cell_prob_mean
+        self.cell_prob_var = cell_prob_var
+        self.cell_prob_quantiles = cell_prob_quantiles
+        self.quantile_levels = quantile_levels
+        self.cell_num_mean = cell_num_mean
+        self.cell_num_var = cell_num_var
+        self.expression_mean = expression_mean
+        self.expression_var = expression_var
+        self.beta_mean = beta_mean
+        self.beta_var = beta_var
+        self.scaled_expression_mean = scaled_expression_mean
+        self.omega = omega
+        self.omega_difference = omega_difference
+        self.lam2 = lam2
+        self.n_components = n_components
+        self.losses = losses
+
+    @property
+    def relative_expression(self):
+        """
+        See DeconvolutionResult.relative_expression
+
+        :return: An <N cell types> x <N markers> floating point matrix.
+        """
+        return _relative_expression(self.expression_mean)
+
+    @property
+    def relative_mean_expression(self):
+        """
+        See DeconvolutionResult.relative_mean_expression
+
+        :return: An <N cell types> x <N markers> floating point matrix.
+        """
+        return _relative_mean_expression(self.expression_mean)
+
+    @property
+    def reads_mean(self):
+        """
+        Posterior mean of the reads of each spot, gene and cell type, from the
+        mean cell numbers and mean scaled expression. This is exact when the spot
+        and expression variables are independent, as in the mean field variational
+        posterior.
+
+        :return: <N Spots> x <N Genes> x <N Cell Types>
+        """
+        return self.cell_num_mean[:, None, :] * self.scaled_expression_mean.T[None]
+
+    def save(self, path):
+        with h5py.File(path, "w") as f:
+            for name in self._ARRAYS:
+                f[name] = getattr(self, name)
+            if self.losses is not None:
+                f["losses"] = self.losses
+            f.attrs["n_samples"] = self.n_samples
+            f.attrs["lam2"] = self.lam2
+            f.attrs["n_components"] = self.n_components
+            f.attrs["summary"] = True
+
+    @classmethod
+    def read_h5(cls, path):
+        """
+        Read this class from an h5 archive
+        :param path: Path to h5 file.
+        :return: DeconvolutionSummary
+        """
+        with h5py.File(path, "r") as f:
+            return cls(
+                n_samples=f.attrs["n_samples"],
+                lam2=f.attrs["lam2"],
+                n_components=f.attrs["n_components"],
+                losses=f["losses"][:] if "losses" in f else None,
+                **{name: f[name][:] for name in cls._ARRAYS},
+            )
+
+
+def read_deconvolution_result(path):
+    """
+    Read a DeconvolutionResult or DeconvolutionSummary from an h5 archive,
+    whichever was saved there.
+
+    :param path: Path to h5 file.
+    :return: DeconvolutionResult or DeconvolutionSummary
+    """
+    with h5py.File(path, "r") as f:
+        is_summary = f.attrs.get("summary", False)
+    if is_summary:
+        return DeconvolutionSummary.read_h5(path)
+    return DeconvolutionResult.read_h5(path)
+
+
 class SpatialDifferentialExpressionResult:
     """
     Data model for results from sampling from the spatial differential expression posterior distribution.
@@ -817,16 +1213,17 @@ class SpatialDifferentialExpressionResult:
 
 
 def add_deconvolution_results_to_dataset(
-    stdata: SpatialExpressionDataset, result: DeconvolutionResult
+    stdata: SpatialExpressionDataset,
+    result: Union[DeconvolutionResult, DeconvolutionSummary],
 ):
     """
     Modify stdata in-place to annotate it with selected marker genes
 
     :param stdata: data.SpatialExpressionDataset to modify
-    :param result: data.DeconvolutionResult to use
+    :param result: data.DeconvolutionResult or data.DeconvolutionSummary to use
     """
-    cell_num_matrix = result.cell_num_trace.mean(axis=0)
-    cell_prob_matrix = result.cell_prob_trace.mean(axis=0)
+    cell_num_matrix = result.cell_num_mean
+    cell_prob_matrix = result.cell_prob_mean
 
     cell_prob_matrix_full = np.zeros((stdata.n_spot, cell_prob_matrix.shape[1]))
 
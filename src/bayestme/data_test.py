@@ -7,7 +7,7 @@ import numpy.testing
 
 import bayestme.common
 import bayestme.data
-from bayestme import data, synthetic_data, utils
+from bayestme import data, summaries, synthetic_data, utils
 from bayestme.synthetic_data import create_toy_deconvolve_result
 
 
@@ -98,6 +98,133 @@ def test_serialize_deserialize_deconvolution_results_dataset():
         shutil.rmtree(tmpdir)
 
 
+def test_deconvolution_trace_writer():
+    n_samples = 25
+    n_nodes = 25
+    n_components = 4
+    n_gene = 50
+    cell_prob_trace = np.random.random((n_samples, n_nodes, n_components))
+    cell_num_total_trace = np.random.random((n_samples, n_nodes))
+    expression_trace = np.random.random((n_samples, n_components, n_gene))
+    beta_trace = np.random.random((n_samples, n_components))
+    losses = np.random.random((10,))
+
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        path = os.path.join(tmpdir, "data.h5")
+        with data.DeconvolutionTraceWriter(
+            path, lam2=1000, n_components=n_components, losses=losses
+        ) as writer:
+            for start in range(0, n_samples, 10):
+                writer.append(
+                    cell_prob_trace=cell_prob_trace[start : start + 10],
+                    expression_trace=expression_trace[start : start + 10],
+                    beta_trace=beta_trace[start : start + 10],
+                    cell_num_total_trace=cell_num_total_trace[start : start + 10],
+                )
+
+        new_dataset = data.DeconvolutionResult.read_h5(path)
+
+        np.testing.assert_array_equal(new_dataset.cell_prob_trace, cell_prob_trace)
+        np.testing.assert_array_equal(new_dataset.expression_trace, expression_trace)
+        np.testing.assert_array_equal(new_dataset.beta_trace, beta_trace)
+        np.testing.assert_array_equal(
+            new_dataset.cell_num_total_trace, cell_num_total_trace
+        )
+        np.testing.assert_array_equal(new_dataset.losses, losses)
+        assert new_dataset.lam2 == 1000
+        assert new_dataset.n_components == n_components
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_serialize_deserialize_deconvolution_summary():
+    rng = np.random.default_rng(0)
+    n_samples, n_nodes, n_components, n_gene = 10, 4, 3, 5
+    result = data.DeconvolutionResult(
+        cell_prob_trace=rng.random((n_samples, n_nodes, n_components)),
+        expression_trace=rng.random((n_samples, n_components, n_gene)),
+        beta_trace=rng.random((n_samples, n_components)),
+        cell_num_total_trace=rng.random((n_samples, n_nodes)),
+        lam2=1000,
+        n_components=n_components,
+    )
+    accumulator = summaries.DeconvolutionSummaryAccumulator()
+    accumulator.update(
+        cell_prob_trace=result.cell_prob_trace,
+        expression_trace=result.expression_trace,
+        beta_trace=result.beta_trace,
+        cell_num_total_trace=result.cell_num_total_trace,
+    )
+    summary = accumulator.result(
+        lam2=1000, n_components=n_components, losses=rng.random(7)
+    )
+
+    np.testing.assert_allclose(
+        result.reads_mean, result.reads_trace.mean(axis=0), rtol=1e-10
+    )
+
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        result.save(os.path.join(tmpdir, "result.h5"))
+        summary.save(os.path.join(tmpdir, "summary.h5"))
+
+        assert isinstance(
+            data.read_deconvolution_result(os.path.join(tmpdir, "result.h5")),
+            data.DeconvolutionResult,
+        )
+        new_summary = data.read_deconvolution_result(os.path.join(tmpdir, "summary.h5"))
+        assert isinstance(new_summary, data.DeconvolutionSummary)
+        for name in data.DeconvolutionSummary._ARRAYS + ("losses",):
+            np.testing.assert_array_equal(
+                getattr(new_summary, name), getattr(summary, name)
+            )
+        assert new_summary.n_samples == n_samples
+        assert new_summary.lam2 == 1000
+        assert new_summary.n_components == n_components
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_serialize_deserialize_bleed_correction_result():
+    corrected_reads = np.random.poisson(0.5, size=(20, 5)).astype(float)
+    result = data.BleedCorrectionResult(
+        corrected_reads=corrected_reads,
+        global_rates=np.random.random(5),
+        basis_functions=np.random.random((8, 4)),
+        weights=np.random.random((20, 20)),
+    )
+
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        result.save(os.path.join(tmpdir, "bleed.h5"))
+        new_result = data.BleedCorrectionResult.read_h5(
+            os.path.join(tmpdir, "bleed.h5")
+        )
+
+        np.testing.assert_array_equal(
+            new_result.corrected_reads.toarray(), corrected_reads
+        )
+        np.testing.assert_array_equal(new_result.global_rates, result.global_rates)
+        np.testing.assert_array_equal(
+            new_result.basis_functions, result.basis_functions
+        )
+        np.testing.assert_array_equal(new_result.weights, result.weights)
+
+        result.save(os.path.join(tmpdir, "bleed.h5"), store_weights=False)
+        new_result = data.BleedCorrectionResult.read_h5(
+            os.path.join(tmpdir, "bleed.h5")
+        )
+
+        # Weights that were not stored are not read back
+        assert new_result.weights is None
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_deconvolution_results_properties():
     rng = np.random.default_rng(1)
     n_samples = 100
@@ -203,6 +330,9 @@ def test_properties_work_without_obs_names():
     dataset = data.SpatialExpressionDataset(adata)
 
     np.testing.assert_array_equal(dataset.counts, bleed_counts[tissue_mask])
+    np.testing.assert_array_equal(
+        dataset.sparse_counts.toarray(), bleed_counts[tissue_mask]
+    )
     np.testing.assert_array_equal(dataset.positions_tissue, locations[tissue_mask])
     np.testing.assert_array_equal(dataset.n_spot_in, tissue_mask.sum())
     np.testing.assert_array_equal(dataset.raw_counts, bleed_counts)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Union
 
 from numpy.random import Generator
 
@@ -16,7 +16,16 @@ def sample_from_posterior(
     expression_truth=None,
     use_spatial_guide=True,
     rng: Optional[Generator] = None,
-) -> data.DeconvolutionResult:
+    likelihood: bayestme.svi.deconvolution.PoissonLikelihood = (
+        bayestme.svi.deconvolution.PoissonLikelihood.FACTOR
+    ),
+    spot_batch_size: Optional[int] = None,
+    gene_batch_size: Optional[int] = None,
+    stream_batch_size: Optional[int] = None,
+    summary_only: bool = False,
+    trace_path: Optional[str] = None,
+    jit: bool = False,
+) -> Union[data.DeconvolutionResult, data.DeconvolutionSummary]:
     return bayestme.svi.deconvolution.deconvolve(
         stdata=data,
         n_components=n_components,
@@ -26,4 +35,11 @@ def sample_from_posterior(
         use_spatial_guide=use_spatial_guide,
         expression_truth=expression_truth,
         rng=rng,
+        likelihood=likelihood,
+        spot_batch_size=spot_batch_size,
+        gene_batch_size=gene_batch_size,
+        stream_batch_size=stream_batch_size,
+        summary_only=summary_only,
+        trace_path=trace_path,
+        jit=jit,
     )
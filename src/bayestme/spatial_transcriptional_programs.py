@@ -98,9 +98,7 @@ def train(
 ) -> SpatialDifferentialExpressionResult:
     if rng is None:
         rng = np.random.default_rng()
-    r_flat = deconvolution_result.reads_trace.mean(
-        axis=0
-    )  # <N Spots> x <N Genes> x <N Cell Types>
+    r_flat = deconvolution_result.reads_mean  # <N Spots> x <N Genes> x <N Cell Types>
     r_flat = r_flat.transpose(2, 1, 0)  # <N Cell Types> x <N Genes> x <N Spots>
     r_flat = np.clip(r_flat, 1e-10, np.inf)
     trendfilter_indices = edges_to_linear_tf(data.edges)
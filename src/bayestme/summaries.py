@@ -0,0 +1,209 @@
+from typing import Sequence
+
+import numpy as np
+
+from bayestme import data
+
+DEFAULT_QUANTILE_LEVELS = (0.05, 0.5, 0.95)
+
+
+class RunningMoments:
+    """
+    Running elementwise mean and variance of batches of samples, merging each
+    batch with Chan et al.'s parallel form of Welford's algorithm.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, samples: np.ndarray):
+        """
+        :param samples: <N samples> x ... array, the samples of this batch
+        """
+        n_batch = samples.shape[0]
+        batch_mean = samples.mean(axis=0, dtype=np.float64)
+        batch_m2 = ((samples - batch_mean) ** 2).sum(axis=0)
+        if self.n == 0:
+            self.n, self.mean, self.m2 = n_batch, batch_mean, batch_m2
+            return
+
+        n = self.n + n_batch
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * n_batch / n
+        self.m2 = self.m2 + batch_m2 + delta**2 * self.n * n_batch / n
+        self.n = n
+
+    @property
+    def variance(self):
+        """
+        Variance of the samples so far (ddof=0, as numpy.var)
+        """
+        return self.m2 / self.n
+
+
+class StreamingQuantiles:
+    """
+    Elementwise streaming quantile estimates with the P-square algorithm
+    (Jain & Chlamtac, 1985), which keeps five markers per quantile and element.
+    """
+
+    def __init__(self, levels: Sequence[float] = DEFAULT_QUANTILE_LEVELS):
+        """
+        :param levels: Quantile levels to estimate, each in (0, 1)
+        """
+        self.levels = np.asarray(levels, dtype=np.float64)
+        p = self.levels[None, :, None]
+        # Markers lead the (5, levels, elements) arrays so each marker is contiguous
+        self.desired_increments = np.concatenate(
+            [np.zeros_like(p), p / 2, p, (1 + p) / 2, np.ones_like(p)]
+        )
+        self.desired_positions = np.concatenate(
+            [np.zeros_like(p), 2 * p, 4 * p, 2 + 2 * p, 4 * np.ones_like(p)]
+        )
+        self.first_samples = []
+        self.shape = None
+        self.heights = None
+        self.positions = None
+
+    def update(self, samples: np.ndarray):
+        """
+        :param samples: <N samples> x ... array, the samples of this batch
+        """
+        # Single precision, like the samples, halves the cost of each update
+        for sample in samples:
+            self._update_one(np.asarray(sample, dtype=np.float32))
+
+    def _update_one(self, x):
+        if self.heights is None:
+            self.first_samples.append(x)
+            if len(self.first_samples) == 5:
+                self.shape = x.shape
+                heights = np.sort(
+                    np.stack([s.reshape(-1) for s in self.first_samples]), axis=0
+                )
+                self.heights = np.repeat(heights[:, None], len(self.levels), axis=1)
+                self.positions = np.broadcast_to(
+                    np.arange(5, dtype=np.float32)[:, None, None], self.heights.shape
+                ).copy()
+                self.first_samples = []
+            return
+
+        x = x.reshape(-1)
+        q, n = self.heights, self.positions
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        # markers above the cell [q_k, q_k+1) containing x shift right by one
+        for i in range(1, 5):
+            n[i] += x < q[i] if i < 4 else 1
+        self.desired_positions = self.desired_positions + self.desired_increments
+
+        for i in range(1, 4):
+            d = self.desired_positions[i].astype(np.float32) - n[i]
+            move = ((d >= 1) & (n[i + 1] - n[i] > 1)) | (
+                (d <= -1) & (n[i - 1] - n[i] < -1)
+            )
+            # Only a fraction of the markers move on each sample, so adjust just those
+            level, element = np.nonzero(move)
+            if len(level) == 0:
+                continue
+            d = np.sign(d[level, element])
+            q_lo, q_i, q_hi = (q[j][level, element] for j in (i - 1, i, i + 1))
+            n_lo, n_i, n_hi = (n[j][level, element] for j in (i - 1, i, i + 1))
+            parabolic = q_i + d / (n_hi - n_lo) * (
+                (n_i - n_lo + d) * (q_hi - q_i) / (n_hi - n_i)
+                + (n_hi - n_i - d) * (q_i - q_lo) / (n_i - n_lo)
+            )
+            linear = q_i + d * (np.where(d > 0, q_hi, q_lo) - q_i) / (
+                np.where(d > 0, n_hi, n_lo) - n_i
+            )
+            in_order = (q_lo < parabolic) & (parabolic < q_hi)
+            q[i][level, element] = np.where(in_order, parabolic, linear)
+            n[i][level, element] = n_i + d
+
+    @property
+    def quantiles(self):
+        """
+        :return: <N levels> x ... array of the quantile estimates
+        """
+        if self.heights is None:
+            return np.quantile(np.stack(self.first_samples), self.levels, axis=0)
+        return self.heights[2].reshape((len(self.levels),) + self.shape)
+
+
+class DeconvolutionSummaryAccumulator:
+    """
+    Accumulates batches of deconvolution posterior samples into a
+    data.DeconvolutionSummary.
+    """
+
+    def __init__(self, quantile_levels: Sequence[float] = DEFAULT_QUANTILE_LEVELS):
+        """
+        :param quantile_levels: Quantile levels of the cell type probabilities to track
+        """
+        self.cell_prob = RunningMoments()
+        self.cell_num = RunningMoments()
+        self.expression = RunningMoments()
+        self.beta = RunningMoments()
+        self.scaled_expression = RunningMoments()
+        self.max_expression_ratio = RunningMoments()
+        self.cell_prob_quantiles = StreamingQuantiles(quantile_levels)
+        self.argmax_counts = None
+
+    def update(
+        self,
+        cell_prob_trace: np.ndarray,
+        expression_trace: np.ndarray,
+        beta_trace: np.ndarray,
+        cell_num_total_trace: np.ndarray,
+    ):
+        """
+        Add a batch of samples, shaped as the traces of data.DeconvolutionResult.
+
+        :param cell_prob_trace: <N samples> x <N tissue spots> x <N components> matrix
+        :param expression_trace: <N samples> x <N components> x <N markers> matrix
+        :param beta_trace: <N samples> x <N components> matrix
+        :param cell_num_total_trace: <N samples> x <N tissue spots> matrix
+        """
+        self.cell_prob.update(cell_prob_trace)
+        self.cell_num.update(cell_prob_trace * cell_num_total_trace[..., None])
+        self.expression.update(expression_trace)
+        self.beta.update(beta_trace)
+        self.scaled_expression.update(beta_trace[..., None] * expression_trace)
+        self.cell_prob_quantiles.update(cell_prob_trace)
+
+        max_exp = expression_trace.max(axis=1, keepdims=True)
+        self.max_expression_ratio.update(expression_trace / max_exp)
+        argmax_counts = (expression_trace == max_exp).sum(axis=0)
+        if self.argmax_counts is None:
+            self.argmax_counts = argmax_counts
+        else:
+            self.argmax_counts += argmax_counts
+
+    def result(self, lam2: float, n_components: int, losses=None):
+        """
+        :param lam2: lambda smoothing parameter used for the posterior distribution
+        :param n_components: N components value for the posterior distribution
+        :param losses: Training loss (if applicable for inference method)
+        :return: data.DeconvolutionSummary
+        """
+        return data.DeconvolutionSummary(
+            n_samples=self.cell_prob.n,
+            cell_prob_mean=self.cell_prob.mean,
+            cell_prob_var=self.cell_prob.variance,
+            cell_prob_quantiles=self.cell_prob_quantiles.quantiles,
+            quantile_levels=self.cell_prob_quantiles.levels,
+            cell_num_mean=self.cell_num.mean,
+            cell_num_var=self.cell_num.variance,
+            expression_mean=self.expression.mean,
+            expression_var=self.expression.variance,
+            beta_mean=self.beta.mean,
+            beta_var=self.beta.variance,
+            scaled_expression_mean=self.scaled_expression.mean,
+            omega=self.argmax_counts / self.cell_prob.n,
+            omega_difference=self.max_expression_ratio.mean,
+            lam2=lam2,
+            n_components=n_components,
+            losses=losses,
+        )
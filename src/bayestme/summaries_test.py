@@ -0,0 +1,79 @@
+import numpy as np
+
+from bayestme import data, summaries
+
+
+def test_running_moments():
+    rng = np.random.default_rng(0)
+    samples = rng.gamma(2.0, 3.0, size=(53, 4, 6))
+
+    moments = summaries.RunningMoments()
+    for start in range(0, len(samples), 10):
+        moments.update(samples[start : start + 10])
+
+    assert moments.n == len(samples)
+    np.testing.assert_allclose(moments.mean, samples.mean(axis=0))
+    np.testing.assert_allclose(moments.variance, samples.var(axis=0))
+
+
+def test_streaming_quantiles():
+    rng = np.random.default_rng(0)
+    samples = rng.normal(size=(3000, 2, 3))
+
+    quantiles = summaries.StreamingQuantiles((0.05, 0.5, 0.95))
+    for start in range(0, len(samples), 10):
+        quantiles.update(samples[start : start + 10])
+
+    np.testing.assert_allclose(
+        quantiles.quantiles,
+        np.quantile(samples, (0.05, 0.5, 0.95), axis=0),
+        atol=0.1,
+    )
+
+
+def test_streaming_quantiles_few_samples():
+    samples = np.arange(3.0)[:, None]
+
+    quantiles = summaries.StreamingQuantiles((0.5,))
+    quantiles.update(samples)
+
+    np.testing.assert_array_equal(quantiles.quantiles, [[1.0]])
+
+
+def test_deconvolution_summary_accumulator():
+    rng = np.random.default_rng(0)
+    n_samples, n_spots, n_components, n_genes = 40, 7, 3, 5
+    result = data.DeconvolutionResult(
+        cell_prob_trace=rng.dirichlet(np.ones(n_components), (n_samples, n_spots)),
+        expression_trace=rng.dirichlet(np.ones(n_genes), (n_samples, n_components)),
+        beta_trace=rng.gamma(100.0, 1.0, (n_samples, n_components)),
+        cell_num_total_trace=rng.gamma(10.0, 1.0, (n_samples, n_spots)),
+        lam2=1.0,
+        n_components=n_components,
+    )
+
+    accumulator = summaries.DeconvolutionSummaryAccumulator()
+    for start in range(0, n_samples, 9):
+        accumulator.update(
+            cell_prob_trace=result.cell_prob_trace[start : start + 9],
+            expression_trace=result.expression_trace[start : start + 9],
+            beta_trace=result.beta_trace[start : start + 9],
+            cell_num_total_trace=result.cell_num_total_trace[start : start + 9],
+        )
+    summary = accumulator.result(lam2=1.0, n_components=n_components)
+
+    assert summary.n_samples == n_samples
+    np.testing.assert_allclose(summary.cell_prob_mean, result.cell_prob_mean)
+    np.testing.assert_allclose(
+        summary.cell_prob_var, result.cell_prob_trace.var(axis=0)
+    )
+    np.testing.assert_allclose(summary.cell_num_mean, result.cell_num_mean)
+    np.testing.assert_allclose(summary.expression_mean, result.expression_mean)
+    np.testing.assert_allclose(summary.omega, result.omega)
+    np.testing.assert_allclose(summary.omega_difference, result.omega_difference)
+    np.testing.assert_allclose(summary.relative_expression, result.relative_expression)
+    np.testing.assert_allclose(
+        summary.relative_mean_expression, result.relative_mean_expression
+    )
+    assert summary.cell_prob_quantiles.shape == (3, n_spots, n_components)
+    assert summary.reads_mean.shape == result.reads_mean.shape
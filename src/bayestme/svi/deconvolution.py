@@ -1,6 +1,6 @@
 import logging
-from collections import defaultdict
-from typing import Optional
+from enum import Enum
+from typing import Optional, Union
 
 import random
 import numpy as np
@@ -10,31 +10,128 @@ import torch
 import torch.distributions.constraints as constraints
 import tqdm
 from pyro import poutine
-from pyro.infer import SVI, Trace_ELBO
+from pyro.infer import SVI, JitTrace_ELBO, Trace_ELBO
 from pyro.optim import Adam
 
 from bayestme import data
-from bayestme.data import SpatialExpressionDataset, DeconvolutionResult
+from bayestme.data import (
+    SpatialExpressionDataset,
+    DeconvolutionResult,
+    DeconvolutionTraceWriter,
+)
 from bayestme.utils import get_edges
 from bayestme.common import ArrayType
+from bayestme.summaries import DeconvolutionSummaryAccumulator
+from bayestme.svi.loader import SpotBatchLoader
 from matplotlib import pyplot as plt
 
 logger = logging.getLogger(__name__)
 
+# Posterior samples held at once by the summary-only sampling mode
+POSTERIOR_SAMPLE_CHUNK_SIZE = 10
 
-def rv_should_be_sampled(site):
+
+class PoissonLikelihood(Enum):
+    """
+    How the Poisson likelihood of the observed counts is scored in the model.
+
+    DISTRIBUTION samples the observations from dist.Poisson, which evaluates
+    lgamma(counts + 1) on every step.
+    FACTOR adds the closed form log likelihood with pyro.factor, reusing
+    the lgamma term computed once from the counts.
+    SPARSE adds the same closed form log likelihood from counts kept as a
+    sparse tensor, evaluating the rates only at the nonzero counts.
+    """
+
+    DISTRIBUTION = "DISTRIBUTION"
+    FACTOR = "FACTOR"
+    SPARSE = "SPARSE"
+
+    def __str__(self):
+        return self.value
+
+
+def poisson_log_likelihood(counts, rates, log_count_factorials):
+    """
+    Closed form Poisson log likelihood of the counts of each spot.
+
+    :param counts: Observed counts, spots x genes
+    :param rates: Poisson rates, same shape as counts
+    :param log_count_factorials: Precomputed sum of lgamma(counts + 1) of each spot
+    :return: Log likelihood of each spot
+    """
+    return (torch.xlogy(counts, rates) - rates).sum(-1) - log_count_factorials
+
+
+def sparse_poisson_log_likelihood(
+    counts, cell_nums, celltype_exp, log_count_factorials
+):
+    """
+    Closed form Poisson log likelihood of the sparse counts of each spot with
+    rates cell_nums @ celltype_exp, without forming the dense rate matrix.
+
+    :param counts: Coalesced sparse COO tensor of counts, spots x genes
+    :param cell_nums: Cell numbers of each cell type, spots x cell types
+    :param celltype_exp: Expression of each cell type, cell types x genes
+    :param log_count_factorials: Precomputed sum of lgamma(counts + 1) of each spot
+    :return: Log likelihood of each spot
+    """
+    spot_idxs, gene_idxs = counts.indices()
+    nonzero_rates = (cell_nums[spot_idxs] * celltype_exp.T[gene_idxs]).sum(-1)
+    nonzero_log_rates = torch.zeros(
+        counts.shape[0], dtype=nonzero_rates.dtype
+    ).index_add(0, spot_idxs, torch.xlogy(counts.values(), nonzero_rates))
+    return nonzero_log_rates - cell_nums @ celltype_exp.sum(-1) - log_count_factorials
+
+
+def log_count_factorials(counts):
     """
-    Determine if a random variable in the model should be saved or
-    if its redundant.
+    Sum of lgamma(counts + 1) of each spot, the data dependent constant of the
+    Poisson log likelihood.
+
+    :param counts: Counts, spots x genes, dense or sparse COO
+    :return: Sum of the log factorials of the counts of each spot
     """
-    return (
-        (site["type"] == "sample")
-        and (
-            (not site.get("is_observed", True))
-            or (site.get("infer", False).get("_deterministic", False))
+    if counts.is_sparse:
+        counts = counts.coalesce()
+        values = torch.lgamma(counts.values() + 1.0)
+        return torch.zeros(counts.shape[0], dtype=values.dtype).index_add(
+            0, counts.indices()[0], values
         )
-        and not isinstance(site.get("fn", None), poutine.subsample_messenger._Subsample)
-    )
+    return torch.lgamma(counts + 1.0).sum(-1)
+
+
+def select_spots(counts, spot_idxs):
+    """
+    :param counts: Counts, spots x genes, dense or sparse COO
+    :param spot_idxs: Spots to keep
+    :return: Counts of spot_idxs
+    """
+    counts = counts.index_select(0, spot_idxs)
+    if counts.is_sparse:
+        counts = counts.coalesce()
+    return counts
+
+
+def select_genes(counts, gene_idxs):
+    """
+    :param counts: Counts, spots x genes, dense or sparse COO
+    :param gene_idxs: Genes to keep
+    :return: Counts of gene_idxs
+    """
+    if not counts.is_sparse:
+        return counts[:, gene_idxs]
+    gene_positions = torch.full((counts.shape[1],), -1, dtype=torch.long)
+    gene_positions[gene_idxs] = torch.arange(len(gene_idxs))
+    spot_idxs, counts_gene_idxs = counts.indices()
+    counts_gene_idxs = gene_positions[counts_gene_idxs]
+    keep = counts_gene_idxs >= 0
+    return torch.sparse_coo_tensor(
+        torch.stack([spot_idxs[keep], counts_gene_idxs[keep]]),
+        counts.values()[keep],
+        (counts.shape[0], len(gene_idxs)),
+        check_invariants=False,
+    ).coalesce()
 
 
 class BayesTME_VI:
@@ -48,6 +145,8 @@ class BayesTME_VI:
         expression_truth: Optional[ArrayType] = None,
         expression_truth_weight=10.0,
         expression_truth_n_dummy_cell_types=2,
+        likelihood: PoissonLikelihood = PoissonLikelihood.FACTOR,
+        loader: Optional[SpotBatchLoader] = None,
     ):
         # Obs:  ST count mat
         #       etiher np array or torch tensor
@@ -55,141 +154,238 @@ class BayesTME_VI:
         #       np array
         # lr:   learning rate
         # beta: Adam decay params
+        # likelihood: how the counts are scored, see PoissonLikelihood
+        # loader: streams minibatches of counts instead of holding them all in memory
         self.opt_params = {"lr": lr, "betas": (beta_1, beta_2)}
         self.optimizer = Adam(self.opt_params)
 
-        self.counts = torch.tensor(stdata.counts)
+        self.likelihood = likelihood
         self.N = stdata.n_spot_in
         self.n_genes = stdata.n_gene
-        self.edges = get_edges(stdata.positions_tissue, layout=stdata.layout)
+        self.loader = loader
+        if loader is not None:
+            if loader.sparse != (likelihood == PoissonLikelihood.SPARSE):
+                raise ValueError(
+                    "The loader must yield sparse counts if and only if the "
+                    "likelihood is {}".format(PoissonLikelihood.SPARSE)
+                )
+            self.counts = None
+            self.log_count_factorials = loader.log_count_factorials
+        elif likelihood == PoissonLikelihood.SPARSE:
+            counts = stdata.sparse_counts.tocoo()
+            self.counts = torch.sparse_coo_tensor(
+                np.vstack([counts.row, counts.col]),
+                counts.data,
+                counts.shape,
+                check_invariants=False,
+            ).coalesce()
+        else:
+            self.counts = torch.tensor(stdata.counts)
+        if loader is None:
+            # Data dependent constant of the Poisson likelihood, only computed once
+            self.log_count_factorials = log_count_factorials(self.counts)
+        self.edges = torch.as_tensor(
+            get_edges(stdata.positions_tissue, layout=stdata.layout), dtype=torch.long
+        )
+        # Every edge in both directions, for the minibatch spatial regularizer
+        self.edge_sources = torch.cat([self.edges[:, 0], self.edges[:, 1]])
+        self.edge_targets = torch.cat([self.edges[:, 1], self.edges[:, 0]])
         self.spatial_regularization_coefficient = rho
+        # Step invariant hyperparameters of the model priors, built once
+        self.exp_load_prior = (torch.tensor(100.0), torch.tensor(1.0))
+        self.cell_num_prior = (torch.tensor(10.0), torch.tensor(1.0))
+        self.exp_profile_concentration = torch.ones(self.n_genes)
+        self._n_celltypes = None
         self.losses = []
         self.expression_truth_weight = expression_truth_weight
         self.expression_truth_n_dummy_cell_types = expression_truth_n_dummy_cell_types
         if expression_truth is not None:
             self.expression_truth = expression_truth
+            # Dirichlet prior of the expression profiles, built once so the model
+            # has no numpy work on each step
+            self.expression_truth_concentration = torch.tensor(
+                np.concatenate(
+                    [
+                        expression_truth * expression_truth_weight * self.n_genes,
+                        np.ones((expression_truth_n_dummy_cell_types, self.n_genes)),
+                    ]
+                )
+            )
         else:
             self.expression_truth = None
+            self.expression_truth_concentration = None
+
+    @property
+    def n_celltypes(self):
+        return self._n_celltypes
 
-    def model(self, data, n_class, n_genes):
+    @n_celltypes.setter
+    def n_celltypes(self, n_celltypes):
+        # Priors that depend on the number of cell types are rebuilt when it is set
+        self._n_celltypes = n_celltypes
+        self.cell_prob_concentration = torch.ones(n_celltypes)
+
+    def model(
+        self,
+        data,
+        n_class,
+        n_genes,
+        spot_batch_size=None,
+        gene_batch_size=None,
+        spot_idxs=None,
+    ):
+        """
+        :param data: Counts of all spots, or of spot_idxs only if given
+        :param spot_batch_size: If given, subsample this many spots at random
+        :param gene_batch_size: If given, score the counts of this many random genes
+        :param spot_idxs: Spots of a batch streamed by a SpotBatchLoader
+        """
         # expression coeff
-        a_0 = torch.tensor(100.0)
-        b_0 = torch.tensor(1.0)
+        a_0, b_0 = self.exp_load_prior
         beta = pyro.sample(
             "exp_load", dist.Gamma(a_0, b_0).expand([self.n_celltypes]).to_event()
         )
         # expression profile
-        alpha_0 = torch.ones(self.n_genes)
         if self.expression_truth is None:
             phi = pyro.sample(
                 "exp_profile",
-                dist.Dirichlet(alpha_0).expand([self.n_celltypes]).to_event(),
+                dist.Dirichlet(self.exp_profile_concentration)
+                .expand([self.n_celltypes])
+                .to_event(),
             )
         else:
-            exp_truth_weighted = (
-                self.expression_truth * self.expression_truth_weight * self.n_genes
-            )
-
-            for _ in range(self.expression_truth_n_dummy_cell_types):
-                exp_truth_weighted = np.concatenate(
-                    [exp_truth_weighted, np.ones(self.n_genes)[None, :]]
-                )
-
             phi = pyro.sample(
                 "exp_profile",
-                dist.Dirichlet(torch.tensor(exp_truth_weighted)).to_event(1),
+                dist.Dirichlet(self.expression_truth_concentration).to_event(1),
             )
         # expression
         celltype_exp = beta[:, None] * phi
 
-        # cell type probs
-        psi_0 = torch.ones(self.n_celltypes)
-        psi = pyro.sample("psi", dist.Dirichlet(psi_0).expand([self.N]).to_event())
-        # cell numbers
-        d_a = torch.tensor(10.0)
-        d_b = torch.tensor(1.0)
-        cell_num = pyro.sample(
-            "cell_num_total", dist.Gamma(d_a, d_b).expand([self.N]).to_event()
-        )
-        # TODO: maybe make this pyro.deterministic or Normal(cell_num[:, None] * psi, sigma) or something
-        d = cell_num[:, None] * psi
-
-        # exprected expression
-        expected_exp = d @ celltype_exp
-        # TODO: potentially can speed this up further
-        #       calc something like log_prob = (data_flat * log(expected_exp_flat) - expected_exp_flat).sum()
-        #       do pyro.factor('obs', log_prob)
-        return pyro.sample("obs", dist.Poisson(expected_exp).to_event(), obs=data)
+        with pyro.plate(
+            "spots", self.N, subsample_size=spot_batch_size, subsample=spot_idxs
+        ) as batch_idxs:
+            # cell type probs
+            psi = pyro.sample("psi", dist.Dirichlet(self.cell_prob_concentration))
+            # cell numbers
+            d_a, d_b = self.cell_num_prior
+            cell_num = pyro.sample("cell_num_total", dist.Gamma(d_a, d_b))
+            # TODO: maybe make this pyro.deterministic or Normal(cell_num[:, None] * psi, sigma) or something
+            d = cell_num[:, None] * psi
+
+            if spot_idxs is not None:
+                counts = data
+                count_factorials = self.log_count_factorials[spot_idxs]
+            elif spot_batch_size is not None:
+                counts = select_spots(data, batch_idxs)
+                count_factorials = self.log_count_factorials[batch_idxs]
+            else:
+                counts = data
+                count_factorials = self.log_count_factorials
+
+            gene_scale = 1.0
+            if gene_batch_size is not None:
+                gene_idxs = torch.randperm(self.n_genes)[:gene_batch_size]
+                celltype_exp = celltype_exp[:, gene_idxs]
+                counts = select_genes(counts, gene_idxs)
+                count_factorials = log_count_factorials(counts)
+                gene_scale = self.n_genes / gene_batch_size
+
+            with poutine.scale(scale=gene_scale):
+                if self.likelihood == PoissonLikelihood.SPARSE:
+                    return pyro.factor(
+                        "obs",
+                        sparse_poisson_log_likelihood(
+                            counts, d, celltype_exp, count_factorials
+                        ),
+                    )
+
+                # exprected expression
+                expected_exp = d @ celltype_exp
+                if self.likelihood == PoissonLikelihood.FACTOR:
+                    return pyro.factor(
+                        "obs",
+                        poisson_log_likelihood(counts, expected_exp, count_factorials),
+                    )
+                return pyro.sample(
+                    "obs", dist.Poisson(expected_exp).to_event(1), obs=counts
+                )
 
-    def guide(self, data, n_class, n_genes):
+    def guide(
+        self,
+        data,
+        n_class,
+        n_genes,
+        spot_batch_size=None,
+        gene_batch_size=None,
+        spot_idxs=None,
+    ):
         """
         guide without spatial regularizer
         """
-        beta_a = pyro.param(
-            "beta_a",
-            torch.ones(self.n_celltypes) * 100.0,
-            constraint=constraints.positive,
-        )
-        beta_b = pyro.param(
-            "beta_b", torch.tensor(1.0), constraint=constraints.positive
-        )
-        beta = pyro.sample("exp_load", dist.Gamma(beta_a, beta_b).to_event())
-
-        phi_a = pyro.param(
-            "phi_a",
-            torch.ones(self.n_celltypes, self.n_genes),
-            constraint=constraints.positive,
-        )
-        phi = pyro.sample("exp_profile", dist.Dirichlet(phi_a).to_event())
+        self._guide(spot_batch_size, spot_idxs, spatial=False)
 
-        psi_a = pyro.param(
-            "psi_a",
-            torch.ones(self.N, self.n_celltypes),
-            constraint=constraints.positive,
-        )
-        psi = pyro.sample("psi", dist.Dirichlet(psi_a).to_event())
-
-        d_a = pyro.param(
-            "d_a", torch.ones(self.N) * 20, constraint=constraints.positive
-        )
-        d_b = pyro.param("d_b", torch.tensor(1.0), constraint=constraints.positive)
-        cell_num = pyro.sample("cell_num_total", dist.Gamma(d_a, d_b).to_event())
-
-    def spatial_guide(self, data, n_class, n_genes):
+    def spatial_guide(
+        self,
+        data,
+        n_class,
+        n_genes,
+        spot_batch_size=None,
+        gene_batch_size=None,
+        spot_idxs=None,
+    ):
         """
         guide with spatial regularizer
         """
+        self._guide(spot_batch_size, spot_idxs, spatial=True)
+
+    def _guide(self, spot_batch_size=None, spot_idxs=None, spatial=False):
+        # Initial values are callables, only evaluated when the params are created
         beta_a = pyro.param(
             "beta_a",
-            torch.ones(self.n_celltypes) * 100.0,
+            lambda: torch.ones(self.n_celltypes) * 100.0,
             constraint=constraints.positive,
         )
         beta_b = pyro.param(
-            "beta_b", torch.tensor(1.0), constraint=constraints.positive
+            "beta_b", lambda: torch.tensor(1.0), constraint=constraints.positive
         )
         beta = pyro.sample("exp_load", dist.Gamma(beta_a, beta_b).to_event())
 
         phi_a = pyro.param(
             "phi_a",
-            torch.ones(self.n_celltypes, self.n_genes),
+            lambda: torch.ones(self.n_celltypes, self.n_genes),
             constraint=constraints.positive,
         )
         phi = pyro.sample("exp_profile", dist.Dirichlet(phi_a).to_event())
 
         psi_a = pyro.param(
             "psi_a",
-            torch.ones(self.N, self.n_celltypes),
+            lambda: torch.ones(self.N, self.n_celltypes),
             constraint=constraints.positive,
         )
-        psi = pyro.sample("psi", dist.Dirichlet(psi_a).to_event())
-        # spatial regularizer
-        pyro.factor("regularizer", self.spatial_regularizer(psi), has_rsample=True)
-
         d_a = pyro.param(
-            "d_a", torch.ones(self.N) * 20, constraint=constraints.positive
+            "d_a", lambda: torch.ones(self.N) * 20, constraint=constraints.positive
         )
-        d_b = pyro.param("d_b", torch.tensor(1.0), constraint=constraints.positive)
-        cell_num = pyro.sample("cell_num_total", dist.Gamma(d_a, d_b).to_event())
+        d_b = pyro.param(
+            "d_b", lambda: torch.tensor(1.0), constraint=constraints.positive
+        )
+
+        minibatch = spot_batch_size is not None or spot_idxs is not None
+        with pyro.plate(
+            "spots", self.N, subsample_size=spot_batch_size, subsample=spot_idxs
+        ) as batch_idxs:
+            psi = pyro.sample("psi", dist.Dirichlet(psi_a[batch_idxs]))
+            if spatial and minibatch:
+                # spatial regularizer of the edges touching the batch
+                pyro.factor(
+                    "regularizer",
+                    self.batch_spatial_regularizer(psi, batch_idxs, psi_a),
+                    has_rsample=True,
+                )
+            cell_num = pyro.sample("cell_num_total", dist.Gamma(d_a[batch_idxs], d_b))
+
+        if spatial and not minibatch:
+            # spatial regularizer
+            pyro.factor("regularizer", self.spatial_regularizer(psi), has_rsample=True)
 
     def spatial_regularizer(self, x):
         # Delta should be of size (n_edges * n_celltype) by (n_spot * n_celltype)
@@ -199,7 +395,52 @@ class BayesTME_VI:
             * self.spatial_regularization_coefficient
         )
 
-    def deconvolution(self, K, n_iter=10000, n_traces=1000, use_spatial_guide=True):
+    def batch_spatial_regularizer(self, x, spot_idxs, psi_a):
+        """
+        Spatial regularizer split over the spots of a minibatch.
+
+        Every edge contributes half of its penalty to each of its two spots, so
+        the per-spot terms sum to spatial_regularizer over the full slide and
+        are rescaled like any other term of the spots plate. Neighbours outside
+        the batch are represented by the mean of their variational Dirichlet.
+
+        :param x: Cell type probabilities of the batch, batch spots x cell types
+        :param spot_idxs: Spots of the batch
+        :param psi_a: Dirichlet concentrations of all spots
+        :return: Regularizer of each spot of the batch
+        """
+        batch_positions = torch.full((self.N,), -1, dtype=torch.long)
+        batch_positions[spot_idxs] = torch.arange(len(spot_idxs))
+        sources = batch_positions[self.edge_sources]
+        keep = sources >= 0
+        sources, targets = sources[keep], self.edge_targets[keep]
+
+        neighbours = psi_a[targets] / psi_a[targets].sum(-1, keepdim=True)
+        target_positions = batch_positions[targets]
+        in_batch = target_positions >= 0
+        neighbours = torch.where(
+            in_batch[:, None], x[target_positions.clamp(min=0)], neighbours
+        )
+        penalties = torch.abs(x[sources] - neighbours).sum(-1) / 2.0
+        return (
+            torch.zeros(len(spot_idxs), dtype=penalties.dtype).index_add(
+                0, sources, penalties
+            )
+            * self.spatial_regularization_coefficient
+        )
+
+    def deconvolution(
+        self,
+        K,
+        n_iter=10000,
+        n_traces=1000,
+        use_spatial_guide=True,
+        spot_batch_size=None,
+        gene_batch_size=None,
+        summary_only=False,
+        trace_path=None,
+        jit=False,
+    ):
         if self.expression_truth is not None:
             self.n_celltypes = (
                 self.expression_truth.shape[0]
@@ -221,40 +462,148 @@ class BayesTME_VI:
         else:
             guide = self.guide
             logger.info("without spatial regularizer")
+        if spot_batch_size is not None or gene_batch_size is not None:
+            logger.info(
+                "with minibatches of {} spots and {} genes".format(
+                    spot_batch_size or self.N, gene_batch_size or self.n_genes
+                )
+            )
+
+        if self.loader is not None:
+            if spot_batch_size is not None:
+                raise ValueError(
+                    "spot_batch_size cannot be used with a loader, which sets the "
+                    "spots of each batch"
+                )
+            logger.info("streaming batches of {} spots".format(self.loader.batch_size))
+            batches = self.loader.batches()
+
+        if jit:
+            if self.loader is not None:
+                raise ValueError(
+                    "jit cannot be used with a loader, as the spots of each "
+                    "streamed batch change the traced graph"
+                )
+            # The model and guide are traced once and replayed on every step
+            loss = JitTrace_ELBO(ignore_jit_warnings=True)
+            logger.info("with a JIT compiled ELBO")
+        else:
+            loss = Trace_ELBO()
 
         pyro.clear_param_store()
-        svi = SVI(self.model, guide, self.optimizer, loss=Trace_ELBO())
+        svi = SVI(self.model, guide, self.optimizer, loss=loss)
         for step in tqdm.trange(n_iter):
-            self.losses.append(svi.step(self.counts, self.n_celltypes, self.n_genes))
-
-        result = defaultdict(list)
-        for _ in tqdm.trange(n_traces):
-            guide_trace = poutine.trace(guide).get_trace(
-                self.counts, self.n_celltypes, self.n_genes
+            if self.loader is None:
+                counts, spot_idxs = self.counts, None
+            else:
+                spot_idxs, counts = next(batches)
+            self.losses.append(
+                # Only tensors can be positional arguments of a traced step
+                svi.step(
+                    counts,
+                    n_class=self.n_celltypes,
+                    n_genes=self.n_genes,
+                    spot_batch_size=spot_batch_size,
+                    gene_batch_size=gene_batch_size,
+                    spot_idxs=spot_idxs,
+                )
             )
-            model_trace = poutine.trace(
-                poutine.replay(self.model, guide_trace)
-            ).get_trace(self.counts, self.n_celltypes, self.n_genes)
-            sample = {
-                name: site["value"]
-                for name, site in model_trace.nodes.items()
-                if rv_should_be_sampled(site)
-            }
-            sample = {name: site.detach().numpy() for name, site in sample.items()}
-            for k, v in sample.items():
-                result[k].append(v)
-
-        samples = {k: np.stack(v) for k, v in result.items()}
+        if self.loader is not None:
+            batches.close()
+
+        if summary_only:
+            return self.summarize_posterior(n_traces, trace_path=trace_path)
+
+        chunks = list(self.sample_posterior(n_traces, trace_path=trace_path))
         return DeconvolutionResult(
-            cell_prob_trace=samples["psi"],
-            expression_trace=samples["exp_profile"],
-            beta_trace=samples["exp_load"],
-            cell_num_total_trace=samples["cell_num_total"],
+            **{
+                name: np.concatenate([chunk[name] for chunk in chunks])
+                for name in chunks[0]
+            },
             lam2=self.spatial_regularization_coefficient,
             n_components=self.n_celltypes,
             losses=np.array(self.losses),
         )
 
+    def sample_posterior(self, n_traces, trace_path=None):
+        """
+        Draw n_traces posterior samples in chunks of POSTERIOR_SAMPLE_CHUNK_SIZE.
+
+        :param n_traces: Number of posterior samples
+        :param trace_path: If provided, also write every chunk to this path as a
+        DeconvolutionResult h5 archive (see data.DeconvolutionTraceWriter). As with
+        the writer, reads_trace is left out of the archive, DeconvolutionResult.reads_trace
+        recomputes it from the other traces after reading.
+        :return: Generator of dicts of the traces of DeconvolutionResult for each chunk
+        """
+        distributions = self.variational_distributions()
+        writer = (
+            DeconvolutionTraceWriter(
+                trace_path,
+                lam2=self.spatial_regularization_coefficient,
+                n_components=self.n_celltypes,
+                losses=np.array(self.losses),
+            )
+            if trace_path is not None
+            else None
+        )
+        try:
+            for start in range(0, n_traces, POSTERIOR_SAMPLE_CHUNK_SIZE):
+                n_samples = min(POSTERIOR_SAMPLE_CHUNK_SIZE, n_traces - start)
+                with torch.no_grad():
+                    samples = {
+                        name: distribution.sample((n_samples,)).numpy()
+                        for name, distribution in distributions.items()
+                    }
+                traces = dict(
+                    cell_prob_trace=samples["psi"],
+                    expression_trace=samples["exp_profile"],
+                    beta_trace=samples["exp_load"],
+                    cell_num_total_trace=samples["cell_num_total"],
+                )
+                if writer is not None:
+                    writer.append(**traces)
+                yield traces
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def summarize_posterior(self, n_traces, trace_path=None):
+        """
+        Summarize n_traces posterior samples, drawn in chunks of
+        POSTERIOR_SAMPLE_CHUNK_SIZE, without keeping them in memory.
+
+        :param n_traces: Number of posterior samples
+        :param trace_path: If provided, also write every sample to this path,
+        see sample_posterior
+        :return: data.DeconvolutionSummary
+        """
+        accumulator = DeconvolutionSummaryAccumulator()
+        for traces in self.sample_posterior(n_traces, trace_path=trace_path):
+            accumulator.update(**traces)
+        return accumulator.result(
+            lam2=self.spatial_regularization_coefficient,
+            n_components=self.n_celltypes,
+            losses=np.array(self.losses),
+        )
+
+    def variational_distributions(self):
+        """
+        Variational distributions of the guide over all spots, built from the
+        fitted parameters in the param store, so posterior samples can be drawn
+        in one call without tracing the guide or replaying the model.
+
+        :return: Dict of site name to distribution
+        """
+        return {
+            "exp_load": dist.Gamma(
+                pyro.param("beta_a"), pyro.param("beta_b")
+            ).to_event(),
+            "exp_profile": dist.Dirichlet(pyro.param("phi_a")).to_event(),
+            "psi": dist.Dirichlet(pyro.param("psi_a")),
+            "cell_num_total": dist.Gamma(pyro.param("d_a"), pyro.param("d_b")),
+        }
+
     def plot_loss(self, output_file):
         """
         Plot the loss curve
@@ -277,7 +626,14 @@ def deconvolve(
     use_spatial_guide=True,
     expression_truth=None,
     rng: Optional[np.random.Generator] = None,
-) -> data.DeconvolutionResult:
+    likelihood: PoissonLikelihood = PoissonLikelihood.FACTOR,
+    spot_batch_size: Optional[int] = None,
+    gene_batch_size: Optional[int] = None,
+    stream_batch_size: Optional[int] = None,
+    summary_only: bool = False,
+    trace_path: Optional[str] = None,
+    jit: bool = False,
+) -> Union[data.DeconvolutionResult, data.DeconvolutionSummary]:
     if rng:
         try:
             seed_sequence = np.random.SeedSequence(rng.__getstate__()["state"]["state"])
@@ -288,14 +644,31 @@ def deconvolve(
         except KeyError:
             logger.warning("RNG state init failed, using default")
 
+    if stream_batch_size is not None:
+        loader = SpotBatchLoader(
+            stdata,
+            batch_size=stream_batch_size,
+            sparse=likelihood == PoissonLikelihood.SPARSE,
+            rng=rng,
+        )
+    else:
+        loader = None
+
     svi = BayesTME_VI(
         stdata=stdata,
         rho=rho,
         expression_truth=expression_truth,
+        likelihood=likelihood,
+        loader=loader,
     )
     return svi.deconvolution(
         n_traces=n_samples,
         n_iter=n_svi_steps,
         K=n_components,
         use_spatial_guide=use_spatial_guide,
+        spot_batch_size=spot_batch_size,
+        gene_batch_size=gene_batch_size,
+        summary_only=summary_only,
+        trace_path=trace_path,
+        jit=jit,
     )
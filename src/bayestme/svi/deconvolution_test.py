@@ -2,9 +2,13 @@ import shutil
 import tempfile
 import os.path
 import numpy as np
+import pyro
+import torch
+from pyro import poutine
 
 import bayestme.common
 import bayestme.expression_truth
+import bayestme.summaries
 import bayestme.synthetic_data
 import bayestme.utils
 from bayestme import data
@@ -204,3 +208,467 @@ def test_deconvolve_with_spatial_guide_and_expression_truth():
     assert result.cell_prob_trace.shape == (n_traces, stdata.n_spot_in, K + 2)
     assert result.cell_num_trace.shape == (n_traces, stdata.n_spot_in, K + 2)
     assert result.reads_trace.shape == (n_traces, stdata.n_spot_in, n_genes, K + 2)
+
+
+def test_poisson_likelihoods_match():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+
+    log_probs = []
+    for likelihood in deconvolution.PoissonLikelihood:
+        pyro.clear_param_store()
+        pyro.set_rng_seed(0)
+        svi = deconvolution.BayesTME_VI(stdata=stdata, likelihood=likelihood)
+        svi.n_celltypes = 3
+        guide_trace = poutine.trace(svi.guide).get_trace(svi.counts, 3, n_genes)
+        model_trace = poutine.trace(poutine.replay(svi.model, guide_trace)).get_trace(
+            svi.counts, 3, n_genes
+        )
+        log_probs.append(model_trace.log_prob_sum().item())
+
+    np.testing.assert_allclose(log_probs[1:], log_probs[0], rtol=1e-5)
+
+
+def test_deconvolve_with_sparse_likelihood():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    K = 3
+    n_traces = 7
+
+    result = bayestme.svi.deconvolution.deconvolve(
+        stdata=stdata,
+        n_components=K,
+        rho=0.5,
+        n_svi_steps=10,
+        n_samples=n_traces,
+        use_spatial_guide=True,
+        rng=np.random.default_rng(42),
+        likelihood=deconvolution.PoissonLikelihood.SPARSE,
+    )
+
+    assert result.cell_prob_trace.shape == (n_traces, stdata.n_spot_in, K)
+    assert result.expression_trace.shape == (n_traces, K, n_genes)
+    assert np.all(np.isfinite(result.losses))
+
+
+def test_deconvolve_with_minibatches():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    K = 3
+    n_traces = 7
+
+    for likelihood in deconvolution.PoissonLikelihood:
+        result = bayestme.svi.deconvolution.deconvolve(
+            stdata=stdata,
+            n_components=K,
+            rho=0.5,
+            n_svi_steps=10,
+            n_samples=n_traces,
+            use_spatial_guide=True,
+            rng=np.random.default_rng(42),
+            likelihood=likelihood,
+            spot_batch_size=20,
+            gene_batch_size=3,
+        )
+
+        assert result.cell_prob_trace.shape == (n_traces, stdata.n_spot_in, K)
+        assert result.cell_num_trace.shape == (n_traces, stdata.n_spot_in, K)
+        assert np.all(np.isfinite(result.losses))
+
+
+def test_deconvolve_with_jit():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    K = 3
+    n_traces = 7
+    expression_truth = np.random.poisson(1, (K, n_genes)) + 0.1
+
+    for spot_batch_size, gene_batch_size in [(None, None), (20, 3)]:
+        result = bayestme.svi.deconvolution.deconvolve(
+            stdata=stdata,
+            n_components=K,
+            rho=0.5,
+            n_svi_steps=10,
+            n_samples=n_traces,
+            use_spatial_guide=True,
+            expression_truth=expression_truth,
+            rng=np.random.default_rng(42),
+            spot_batch_size=spot_batch_size,
+            gene_batch_size=gene_batch_size,
+            jit=True,
+        )
+
+        n_components = K + 2
+        assert result.cell_prob_trace.shape == (
+            n_traces,
+            stdata.n_spot_in,
+            n_components,
+        )
+        assert result.expression_trace.shape == (n_traces, n_components, n_genes)
+        assert len(result.losses) == 10
+        assert np.all(np.isfinite(result.losses))
+
+
+def test_step_invariant_tensors():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    expression_truth = np.random.poisson(1, (3, n_genes)) + 0.1
+    vi = deconvolution.BayesTME_VI(stdata=stdata, expression_truth=expression_truth)
+
+    assert vi.edges.dtype == torch.long
+    assert len(vi.edge_sources) == 2 * len(vi.edges)
+    np.testing.assert_array_equal(
+        vi.expression_truth_concentration.numpy(),
+        np.concatenate(
+            [expression_truth * 10.0 * n_genes, np.ones((2, n_genes))], axis=0
+        ),
+    )
+
+    vi.n_celltypes = 3
+    assert vi.cell_prob_concentration.shape == (3,)
+    vi.n_celltypes = 5
+    assert vi.cell_prob_concentration.shape == (5,)
+
+
+def test_batch_spatial_regularizer_of_all_spots():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    svi = deconvolution.BayesTME_VI(stdata=stdata)
+    psi = torch.rand(svi.N, 3)
+
+    np.testing.assert_allclose(
+        svi.batch_spatial_regularizer(
+            psi, torch.arange(svi.N), torch.ones(svi.N, 3)
+        ).sum(),
+        svi.spatial_regularizer(psi),
+        rtol=1e-5,
+    )
+
+
+def test_deconvolve_with_streamed_batches():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    K = 3
+    n_traces = 7
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        stdata.save(os.path.join(tmpdir, "data.h5"))
+        backed_stdata = data.SpatialExpressionDataset.read_h5(
+            os.path.join(tmpdir, "data.h5"), backed=True
+        )
+
+        for likelihood in deconvolution.PoissonLikelihood:
+            result = bayestme.svi.deconvolution.deconvolve(
+                stdata=backed_stdata,
+                n_components=K,
+                rho=0.5,
+                n_svi_steps=10,
+                n_samples=n_traces,
+                use_spatial_guide=True,
+                rng=np.random.default_rng(42),
+                likelihood=likelihood,
+                stream_batch_size=20,
+            )
+
+            assert result.cell_prob_trace.shape == (n_traces, stdata.n_spot_in, K)
+            assert result.cell_num_trace.shape == (n_traces, stdata.n_spot_in, K)
+            assert np.all(np.isfinite(result.losses))
+        backed_stdata.adata.file.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_variational_distributions_match_guide():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    pyro.clear_param_store()
+    svi = deconvolution.BayesTME_VI(stdata=stdata)
+    svi.n_celltypes = 3
+    guide_trace = poutine.trace(svi.guide).get_trace(svi.counts, 3, n_genes)
+    guide_trace.compute_log_prob()
+
+    distributions = svi.variational_distributions()
+    for name, distribution in distributions.items():
+        site = guide_trace.nodes[name]
+        np.testing.assert_allclose(
+            distribution.log_prob(site["value"]).detach(),
+            site["log_prob"].detach(),
+            rtol=1e-5,
+        )
+        assert distribution.sample((4,)).shape == (4,) + site["value"].shape
+
+
+def test_deconvolve_summary_only():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    K = 3
+    n_traces = 25
+
+    result = bayestme.svi.deconvolution.deconvolve(
+        stdata=stdata,
+        n_components=K,
+        rho=0.5,
+        n_svi_steps=10,
+        n_samples=n_traces,
+        use_spatial_guide=True,
+        rng=np.random.default_rng(42),
+        summary_only=True,
+    )
+
+    assert isinstance(result, data.DeconvolutionSummary)
+    assert result.n_samples == n_traces
+    assert result.cell_prob_mean.shape == (stdata.n_spot_in, K)
+    assert result.cell_num_mean.shape == (stdata.n_spot_in, K)
+    assert result.expression_mean.shape == (K, n_genes)
+    assert result.omega.shape == (K, n_genes)
+    np.testing.assert_allclose(result.omega.sum(axis=0), 1.0)
+    assert result.reads_mean.shape == (stdata.n_spot_in, n_genes, K)
+
+    data.add_deconvolution_results_to_dataset(stdata, result)
+
+
+def test_deconvolve_with_trace_path():
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=15, n_cols=15, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    K = 3
+    n_traces = 25
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        trace_path = os.path.join(tmpdir, "deconvolve.h5")
+        summary = bayestme.svi.deconvolution.deconvolve(
+            stdata=stdata,
+            n_components=K,
+            rho=0.5,
+            n_svi_steps=10,
+            n_samples=n_traces,
+            use_spatial_guide=True,
+            rng=np.random.default_rng(42),
+            summary_only=True,
+            trace_path=trace_path,
+        )
+        result = data.DeconvolutionResult.read_h5(trace_path)
+
+        assert isinstance(summary, data.DeconvolutionSummary)
+        assert result.cell_prob_trace.shape == (n_traces, stdata.n_spot_in, K)
+        assert result.expression_trace.shape == (n_traces, K, n_genes)
+        assert result.beta_trace.shape == (n_traces, K)
+        assert result.cell_num_total_trace.shape == (n_traces, stdata.n_spot_in)
+        assert len(result.losses) == 10
+        np.testing.assert_allclose(
+            summary.cell_prob_mean, result.cell_prob_mean, rtol=1e-5
+        )
+        np.testing.assert_allclose(
+            summary.expression_mean, result.expression_mean, rtol=1e-5
+        )
+        np.testing.assert_allclose(summary.omega, result.omega)
+
+        # Writing the traces does not change which quantiles are summarized
+        np.testing.assert_array_equal(
+            summary.quantile_levels, bayestme.summaries.DEFAULT_QUANTILE_LEVELS
+        )
+        assert summary.cell_prob_quantiles.shape == (
+            len(summary.quantile_levels),
+            stdata.n_spot_in,
+            K,
+        )
+
+        # Without summary_only the traces are both written and returned
+        full_result = bayestme.svi.deconvolution.deconvolve(
+            stdata=stdata,
+            n_components=K,
+            rho=0.5,
+            n_svi_steps=10,
+            n_samples=n_traces,
+            rng=np.random.default_rng(42),
+            trace_path=trace_path,
+        )
+        result = data.DeconvolutionResult.read_h5(trace_path)
+        np.testing.assert_array_equal(
+            full_result.cell_prob_trace, result.cell_prob_trace
+        )
+        np.testing.assert_array_equal(
+            full_result.expression_trace, result.expression_trace
+        )
+    finally:
+        shutil.rmtree(tmpdir)
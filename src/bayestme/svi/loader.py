@@ -0,0 +1,163 @@
+import logging
+import queue
+import threading
+from typing import Optional
+
+import numpy as np
+import torch
+from scipy.sparse import issparse
+
+from bayestme.data import SpatialExpressionDataset
+
+logger = logging.getLogger(__name__)
+
+
+def counts_to_tensor(counts, sparse=False):
+    """
+    Convert a block of counts read from an AnnData to a torch tensor.
+
+    :param counts: Dense array or scipy sparse matrix of counts, spots x genes
+    :param sparse: If True return a coalesced sparse COO tensor, else a dense tensor
+    :return: torch.Tensor
+    """
+    if not sparse:
+        return torch.tensor(counts.toarray() if issparse(counts) else counts)
+    if not issparse(counts):
+        counts = np.asarray(counts)
+        rows, cols = np.nonzero(counts)
+        values = counts[rows, cols]
+    else:
+        counts = counts.tocoo()
+        rows, cols, values = counts.row, counts.col, counts.data
+    return torch.sparse_coo_tensor(
+        np.vstack([rows, cols]), values, counts.shape, check_invariants=False
+    ).coalesce()
+
+
+class SpotBatchLoader:
+    """
+    Streams minibatches of in tissue spot counts from a SpatialExpressionDataset,
+    which can be backed by an h5ad file on disk (see SpatialExpressionDataset.read_h5).
+
+    The in tissue spots are split into chunks of consecutive spots, as equal in size as
+    possible, so each batch is one contiguous read from the file. Each batch is a chunk
+    drawn at random with probability proportional to its size. A subsampled plate
+    scales the likelihood of a batch by N / (batch size), so every spot then has an
+    expected scale of exactly one, also when the chunks cannot all have the same
+    size. A background thread reads the next batches while the current one is used.
+    """
+
+    def __init__(
+        self,
+        stdata: SpatialExpressionDataset,
+        batch_size: int,
+        sparse: bool = False,
+        n_prefetch: int = 2,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        """
+        :param stdata: Dataset to read counts from, usually opened with backed=True
+        :param batch_size: Number of in tissue spots in each batch
+        :param sparse: If True yield counts as sparse COO tensors, else dense tensors
+        :param n_prefetch: Number of batches read ahead by the background thread
+        :param rng: Random number generator for the order of the batches
+        """
+        self.X = stdata.adata.X
+        self.tissue_rows = np.flatnonzero(stdata.tissue_mask)
+        self.N = len(self.tissue_rows)
+        self.n_genes = stdata.n_gene
+        self.batch_size = batch_size
+        self.sparse = sparse
+        self.n_prefetch = n_prefetch
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.chunks = np.array_split(
+            np.arange(self.N), max(1, int(np.ceil(self.N / batch_size)))
+        )
+        chunk_sizes = np.array([len(spot_idxs) for spot_idxs in self.chunks])
+        self.chunk_probs = chunk_sizes / chunk_sizes.sum()
+        self.log_count_factorials = self._log_count_factorials()
+
+    def read_chunk(self, spot_idxs):
+        """
+        Read the counts of consecutive in tissue spots.
+
+        :param spot_idxs: Sorted indices of in tissue spots
+        :return: Dense array or scipy sparse matrix of counts, spots x genes
+        """
+        rows = self.tissue_rows[spot_idxs]
+        block = self.X[rows[0] : rows[-1] + 1]
+        return block[rows - rows[0]]
+
+    def _log_count_factorials(self):
+        # One streaming pass, the model only needs this constant summed per spot
+        log_count_factorials = np.zeros(self.N)
+        for spot_idxs in self.chunks:
+            counts = self.read_chunk(spot_idxs)
+            if issparse(counts):
+                counts = counts.tocoo()
+                log_count_factorials[spot_idxs] = np.bincount(
+                    counts.row,
+                    weights=torch.lgamma(torch.tensor(counts.data) + 1.0).numpy(),
+                    minlength=len(spot_idxs),
+                )
+            else:
+                counts = torch.tensor(np.asarray(counts))
+                log_count_factorials[spot_idxs] = (
+                    torch.lgamma(counts + 1.0).sum(-1).numpy()
+                )
+        return torch.tensor(log_count_factorials, dtype=torch.get_default_dtype())
+
+    def _put(self, batches: queue.Queue, stop: threading.Event, item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _prefetch(self, batches: queue.Queue, stop: threading.Event):
+        try:
+            while not stop.is_set():
+                for chunk_idx in self.rng.choice(
+                    len(self.chunks), size=len(self.chunks), p=self.chunk_probs
+                ):
+                    if stop.is_set():
+                        return
+                    spot_idxs = self.chunks[chunk_idx]
+                    counts = self.read_chunk(spot_idxs)
+                    self._put(
+                        batches,
+                        stop,
+                        (
+                            torch.tensor(spot_idxs),
+                            counts_to_tensor(counts, sparse=self.sparse),
+                        ),
+                    )
+        except Exception as e:
+            # Hand the error to the consumer instead of leaving it waiting
+            self._put(batches, stop, e)
+
+    def batches(self):
+        """
+        Endlessly yield batches, cycling through epochs.
+
+        Closing the generator stops the background thread.
+
+        :return: Generator of (spot indices, counts) tuples, where the spot indices
+        index the in tissue spots and counts is a spots x genes tensor
+        """
+        batches = queue.Queue(maxsize=self.n_prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._prefetch, args=(batches, stop), daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
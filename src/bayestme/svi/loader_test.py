@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix
+
+import bayestme.common
+import bayestme.synthetic_data
+import bayestme.utils
+from bayestme import data
+from bayestme.svi import loader
+
+
+def generate_backed_dataset(tmpdir, sparse):
+    n_genes = 5
+    (
+        locations,
+        tissue_mask,
+        true_rates,
+        true_counts,
+        bleed_counts,
+    ) = bayestme.synthetic_data.generate_simulated_bleeding_reads_data(
+        n_rows=10, n_cols=10, n_genes=n_genes
+    )
+
+    stdata = data.SpatialExpressionDataset.from_arrays(
+        raw_counts=bleed_counts,
+        tissue_mask=tissue_mask,
+        positions=locations,
+        gene_names=np.array(["{}".format(x) for x in range(n_genes)]),
+        layout=bayestme.common.Layout.SQUARE,
+        barcodes=np.array(["barcode" + str(i) for i in range(len(locations))]),
+        edges=bayestme.utils.get_edges(locations, bayestme.common.Layout.SQUARE),
+    )
+    if sparse:
+        stdata.adata.X = csr_matrix(stdata.adata.X)
+    path = os.path.join(tmpdir, "data.h5")
+    stdata.save(path)
+    return (
+        data.SpatialExpressionDataset.read_h5(path, backed=True),
+        bleed_counts[tissue_mask],
+    )
+
+
+def test_spot_batch_loader():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for sparse in (False, True):
+            stdata, counts = generate_backed_dataset(tmpdir, sparse)
+            assert stdata.adata.isbacked
+
+            spot_loader = loader.SpotBatchLoader(
+                stdata, batch_size=7, sparse=sparse, rng=np.random.default_rng(0)
+            )
+            np.testing.assert_allclose(
+                spot_loader.log_count_factorials,
+                torch.lgamma(torch.tensor(counts) + 1.0).sum(-1),
+                rtol=1e-5,
+            )
+
+            batches = spot_loader.batches()
+            seen = []
+            for _ in range(10 * len(spot_loader.chunks)):
+                spot_idxs, batch_counts = next(batches)
+                assert batch_counts.is_sparse == sparse
+                if sparse:
+                    batch_counts = batch_counts.to_dense()
+                np.testing.assert_array_equal(
+                    batch_counts.numpy(), counts[spot_idxs.numpy()]
+                )
+                seen.append(spot_idxs.numpy())
+            batches.close()
+
+            np.testing.assert_array_equal(
+                np.unique(np.concatenate(seen)), np.arange(len(counts))
+            )
+            stdata.adata.file.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_spot_batch_loader_expected_scale():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        stdata, counts = generate_backed_dataset(tmpdir, sparse=False)
+        n_spots = len(counts)
+
+        for batch_size in (4, 7, 10):
+            assert n_spots % batch_size != 0
+            spot_loader = loader.SpotBatchLoader(
+                stdata, batch_size=batch_size, rng=np.random.default_rng(0)
+            )
+            assert max(len(spot_idxs) for spot_idxs in spot_loader.chunks) <= batch_size
+
+            # A subsampled plate scales each batch by n_spots / (batch size)
+            expected_scale = np.zeros(n_spots)
+            for spot_idxs, prob in zip(spot_loader.chunks, spot_loader.chunk_probs):
+                expected_scale[spot_idxs] += prob * n_spots / len(spot_idxs)
+            np.testing.assert_allclose(expected_scale, 1)
+
+            batches = spot_loader.batches()
+            scale = np.zeros(n_spots)
+            n_batches = 2000
+            for _ in range(n_batches):
+                spot_idxs, _ = next(batches)
+                scale[spot_idxs.numpy()] += n_spots / len(spot_idxs)
+            batches.close()
+            np.testing.assert_allclose(scale / n_batches, 1, atol=0.15)
+        stdata.adata.file.close()
+    finally:
+        shutil.rmtree(tmpdir)